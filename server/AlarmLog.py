@@ -0,0 +1,163 @@
+#!/usr/bin/python
+#
+# File Name: AlarmLog.py
+# Purpose: Append-only log of alarm register transitions, queried by cursor or by time.
+# Notes:
+#               Each time an alarm bit changes, the ingest path appends one fixed size record
+#                   float64 EPOCH_TIME of the sample which changed it
+#                   uint64  series row (sequence number) of that sample
+#                   uint32  mask of the alarm bit
+#                   uint32  whole alarm register after the change
+#               (24 bytes, little-endian) after an 8 byte header "BPKA" + uint32 version. Event n
+#               (starting at 1) is record n-1, so a client resumes with the next_event cursor of its
+#               last answer, and a time range is found by bisecting the records, which are in time
+#               order. The log lives in a file when a name is given, so that WSGI workers can serve
+#               the events written by the ingest process and the history survives restarts, and in
+#               memory otherwise. To keep the records in time order, events which are not later than
+#               the last one logged (samples evaluated again after a restart) are not appended.
+#
+
+"""Alarm transition log.
+
+class:
+
+AlarmLog -- appends alarm bit transitions and returns them since an
+            event cursor or within a time range.
+"""
+import io
+import os
+import struct
+from threading import Lock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = "BPKA"
+VERSION = 1
+HEADER = struct.Struct("<4sI")
+RECORD = struct.Struct("<dQII")
+
+
+class AlarmLog(object):
+    """fileName None keeps the log in memory. Only the owner (create=True)
+    appends; other processes open the file read-only once it exists."""
+    def __init__(self, fileName=None, create=True):
+        self.fileName = fileName
+        self.create = create
+        self.lock = Lock()
+        self.fp = None
+        if fileName is None:
+            self.fp = io.BytesIO()
+            self.fp.write(HEADER.pack(MAGIC, VERSION))
+        elif create:
+            self._open()
+
+    def _open(self):
+        """Open the file, creating it if this is the owner. Returns False if
+        there is nothing to read yet."""
+        if self.fp is not None:
+            return True
+        if self.create:
+            if not os.path.exists(self.fileName) or os.path.getsize(self.fileName) == 0:
+                open(self.fileName, "wb").write(HEADER.pack(MAGIC, VERSION))
+            fp = open(self.fileName, "r+b")
+        elif os.path.exists(self.fileName):
+            fp = open(self.fileName, "rb")
+        else:
+            return False
+        magic, version = HEADER.unpack(fp.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            fp.close()
+            raise IOError("%s is not an alarm log" % self.fileName)
+        self.fp = fp
+        return True
+
+    def _count(self):
+        self.fp.seek(0, 2)
+        return (self.fp.tell() - HEADER.size) // RECORD.size
+
+    def append(self, events):
+        """Append a list of (time, row, mask, register) tuples, leaving out
+        those which are not later than the last event logged before the call.
+        Returns the number of events appended."""
+        if not events:
+            return 0
+        with self.lock:
+            self._open()
+            n = self._count()
+            if n > 0:
+                lastTime = self._read(n - 1, n)[0][0]
+                events = [event for event in events if event[0] > lastTime]
+            if events:
+                self.fp.seek(HEADER.size + n*RECORD.size)
+                self.fp.write("".join(RECORD.pack(*event) for event in events))
+                self.fp.flush()
+            return len(events)
+
+    def recordBlock(self, alarmMask, register, states, times, firstRow):
+        """Log the transitions in a block of samples. register is the alarm
+        register before the block, states the {alarm name: [state per sample]}
+        result of AlarmRegister.evaluate, times the EPOCH_TIME of the samples
+        and firstRow the series row of the first sample. Returns the number of
+        events logged."""
+        changes = []
+        for name, values in states.items():
+            mask = alarmMask[name]
+            previous = bool(register & mask)
+            if numpy is not None:
+                values = numpy.asarray(values, dtype=bool)
+                before = numpy.concatenate(([previous], values[:-1]))
+                for i in numpy.flatnonzero(values != before).tolist():
+                    changes.append((i, mask, bool(values[i])))
+            else:
+                for i, value in enumerate(values):
+                    if value != previous:
+                        changes.append((i, mask, value))
+                        previous = value
+        changes.sort()
+        events = []
+        for i, mask, value in changes:
+            register = (register | mask) if value else (register & ~mask)
+            events.append((float(times[i]), firstRow + i, mask, register))
+        return self.append(events)
+
+    def _read(self, lo, hi):
+        """Return records lo (inclusive) to hi (exclusive) as a list of tuples"""
+        self.fp.seek(HEADER.size + lo*RECORD.size)
+        block = self.fp.read((hi - lo)*RECORD.size)
+        return [RECORD.unpack_from(block, i*RECORD.size) for i in range(len(block) // RECORD.size)]
+
+    def _bisect(self, t, right, n):
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            time = self._read(mid, mid + 1)[0][0]
+            if time < t or (right and time == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, since=None, start=None, end=None, limit=1000):
+        """Return (next event cursor, [(event, time, row, mask, register), ...])
+        for the events from cursor since (1 is the first event) or, if since is
+        None, with start <= time <= end, at most limit of them."""
+        with self.lock:
+            if not self._open():
+                return 1, []
+            n = self._count()
+            if since is not None:
+                lo = max(since, 1) - 1
+                hi = n
+            else:
+                lo = self._bisect(start, False, n) if start is not None else 0
+                hi = self._bisect(end, True, n) if end is not None else n
+            hi = min(hi, lo + limit) if limit > 0 else hi
+            records = self._read(lo, hi) if hi > lo else []
+        return max(hi, lo) + 1, [(lo + 1 + i,) + record for i, record in enumerate(records)]
+
+    def stats(self):
+        with self.lock:
+            return {"file_name": self.fileName, "events": self._count() if self._open() else 0}
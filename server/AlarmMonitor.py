@@ -0,0 +1,212 @@
+#!/usr/bin/python
+#
+# File Name: AlarmMonitor.py
+# Purpose: Threshold alarms on DataLog columns (battery voltage, concentrations) and the alarm register.
+# Notes:
+#               A ThresholdMonitor raises its alarm once the value has stayed on the wrong side of the
+#               threshold for Points_Trigger_Alarm samples and, after the value comes back, keeps it
+#               for Points_Cancel_Alarm samples. Crossing back to the good side restarts the hold-off
+#               from 1, whatever the alarm was, so a short dip also holds the alarm for a few samples.
+#               A sample that is NaN or exactly on the threshold carries no information: the monitor
+#               repeats its previous result and keeps its state.
+#
+#               checkValues() evaluates a whole block of samples at once. With NumPy it splits the block
+#               into runs of samples on the same side of the threshold; within a run the result only
+#               depends on the position in the run and on the count carried into it, so every sample is
+#               computed with array operations instead of stepping the state machine. It gives exactly
+#               the results (and leaves exactly the state) of calling checkValue() for each sample.
+#
+
+"""Threshold alarms.
+
+class:
+
+ThresholdMonitor -- alarm state machine for values below (or above) a
+                    threshold, per sample or per block of samples.
+
+BatteryVoltageMonitor -- ThresholdMonitor for a low battery voltage.
+
+AlarmChannel -- a column, an alarm register bit and the monitors
+                (low and/or high threshold) which set it.
+
+AlarmRegister -- bit mask of the active alarms.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Blocks shorter than this are evaluated sample by sample
+MIN_BATCH = 16
+
+
+class ThresholdMonitor(object):
+    """Alarm when the value is below threshold, or above it if above is True.
+
+    Values are compared with the threshold after negating both when above
+    is True, so the two directions share one state machine; lastValue is
+    kept in that comparison space.
+    """
+    def __init__(self, threshold=0.0, pointsTriggerAlarm=10, pointsCancelAlarm=3, above=False):
+        self.threshold = threshold
+        self.pointsTriggerAlarm = pointsTriggerAlarm
+        self.pointsCancelAlarm = pointsCancelAlarm
+        self.above = above
+        self.lastValue = 0
+        self.count = 0
+        self.alarm = False
+
+    def getState(self):
+        return (self.lastValue, self.count, self.alarm)
+
+    def setState(self, state):
+        self.lastValue, self.count, self.alarm = state
+
+    def checkValue(self, value):
+        threshold = self.threshold
+        if self.above:
+            value, threshold = -value, -threshold
+        if value != value or value == threshold:
+            return self.alarm
+        if (self.lastValue - threshold) * (value - threshold) < 0:
+            self.count = 1
+            ret = (self.lastValue < threshold)
+        elif value < threshold:
+            ret = True if self.count >= self.pointsTriggerAlarm else False
+            self.count += 1
+        else:
+            if self.count == 0:
+                ret = False
+            elif self.count == self.pointsCancelAlarm:
+                ret = False
+                self.count = 0
+            else:
+                ret = True
+                self.count += 1
+        self.lastValue = value
+        self.alarm = ret
+        return ret
+
+    def checkValues(self, values):
+        """Return ([alarm after each value], final state) for a block of values,
+        leaving the monitor as checkValue() would have for each of them."""
+        if numpy is None or len(values) < MIN_BATCH:
+            return [self.checkValue(v) for v in values], self.getState()
+        v = numpy.asarray(values, dtype=float)
+        threshold = self.threshold
+        if self.above:
+            v, threshold = -v, -threshold
+        valid = (v == v) & (v != threshold)
+        w = v[valid]
+        if len(w) == 0:
+            return [self.alarm]*len(v), self.getState()
+        trigger = self.pointsTriggerAlarm
+        cancel = self.pointsCancelAlarm
+        low = w < threshold
+        change = numpy.flatnonzero(low[1:] != low[:-1]) + 1
+        starts = numpy.concatenate(([0], change))
+        runOf = numpy.zeros(len(w), dtype=int)
+        runOf[change] = 1
+        runOf = numpy.cumsum(runOf)
+        k = numpy.arange(len(w)) - starts[runOf]
+        # Only the first run can continue the count carried in; every later run starts with a crossing
+        crossing0 = (self.lastValue - threshold) * (w[0] - threshold) < 0
+        c0 = 0 if crossing0 else self.count
+        carried = (runOf == 0) & (not crossing0)
+        # Below the threshold the count before sample k of a run is c0 + k, or k after a crossing,
+        # where the first sample never raises the alarm
+        lowRet = numpy.where(carried, c0 + k >= trigger, (k > 0) & (k >= trigger))
+        # Above it the count goes up from c0 (or from 1 after a crossing, whose first sample holds
+        # the alarm) until it reaches Points_Cancel_Alarm, and then stays at 0
+        c = numpy.where(carried, c0, 1)
+        j = numpy.where(carried, k, k - 1)
+        held = (c > 0) & ((cancel < c) | (c + j < cancel))
+        highRet = numpy.where(carried, held, (k == 0) | held)
+        ret = numpy.where(low, lowRet, highRet)
+        # Final count of the last run
+        lastLen = len(w) - starts[-1]
+        lastCarried = bool(carried[-1])
+        if low[-1]:
+            count = (c0 if lastCarried else 0) + lastLen
+        else:
+            if lastCarried:
+                c, m = c0, lastLen
+            else:
+                c, m = 1, lastLen - 1
+            if c == 0:
+                count = 0
+            elif cancel < c or cancel - c >= m:
+                count = c + m
+            else:
+                count = 0
+        # Samples without information repeat the previous result
+        pos = numpy.cumsum(valid) - 1
+        result = numpy.where(pos >= 0, ret[numpy.maximum(pos, 0)], self.alarm)
+        self.lastValue = float(w[-1])
+        self.count = int(count)
+        self.alarm = bool(ret[-1])
+        return result.tolist(), self.getState()
+
+
+class BatteryVoltageMonitor(ThresholdMonitor):
+    """Low battery voltage alarm, configured from [BatteryMonitor]"""
+    def __init__(self):
+        ThresholdMonitor.__init__(self)
+
+    voltageThreshold = property(lambda self: self.threshold,
+                                lambda self, value: setattr(self, "threshold", value))
+    old_voltage = property(lambda self: self.lastValue,
+                           lambda self, value: setattr(self, "lastValue", value))
+
+
+class AlarmChannel(object):
+    """Sets the bit mask of the alarm register called name from a column.
+    monitors are ThresholdMonitors; the alarm is on when any of them is."""
+    def __init__(self, name, column, mask, monitors):
+        self.name = name
+        self.column = column
+        self.mask = mask
+        self.monitors = list(monitors)
+
+    def copy(self):
+        """Return a channel with the same settings and a fresh state"""
+        return AlarmChannel(self.name, self.column, self.mask,
+                            [ThresholdMonitor(m.threshold, m.pointsTriggerAlarm, m.pointsCancelAlarm, m.above)
+                             for m in self.monitors])
+
+    def checkValues(self, values):
+        """Return the alarm state after each value"""
+        states = None
+        for monitor in self.monitors:
+            result = monitor.checkValues(values)[0]
+            states = result if states is None else [a or b for a, b in zip(states, result)]
+        return states or []
+
+
+class AlarmRegister(object):
+    def __init__(self):
+        self.register = 0x00000000
+        self.alarmMask = {
+            "battery_voltage": 0x00000001
+        }
+
+    def addAlarm(self, alarmName, mask):
+        self.alarmMask[alarmName] = mask
+
+    def setAlarm(self, alarmName, value):
+        if value:
+            self.register |= self.alarmMask[alarmName]
+        else:
+            self.register &= ~self.alarmMask[alarmName]
+
+    def evaluate(self, channels, data):
+        """Run every channel over its column of data (a dict of column lists)
+        and set the register from the last sample. Returns {name: states}."""
+        states = {}
+        for channel in channels:
+            values = data.get(channel.column)
+            if values is None or len(values) == 0:
+                continue
+            states[channel.name] = channel.checkValues(values)
+            self.setAlarm(channel.name, states[channel.name][-1])
+        return states
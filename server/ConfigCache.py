@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# File Name: ConfigCache.py
+# Purpose: Share the parsed form of .ini files between processes through an on-disk cache.
+# Notes:
+#               Every analyzer process that starts parses the same large .ini files. With a cache
+#               directory given, CustomConfigObj(fileName, cache=ParsedConfigCache(dir)) stores the parsed
+#               section/option tree, its comments and the lower-case option index in a marshal file, and
+#               later loads of the same file read that back instead of tokenising the text again.
+#
+#               A cache file is named after the absolute path of the .ini file and the parser options,
+#               and starts with a header holding the Python version, path, size, modification time and
+#               SHA-1 of the content it was made from. The content is hashed on every load, so an edit
+#               that keeps the size and the (coarse) modification time is still noticed; any mismatch,
+#               unreadable or truncated cache file is a miss and the file is parsed as usual. Cache files
+#               are written under a temporary name and renamed, so a concurrent reader never sees half
+#               of one.
+#
+
+"""On-disk cache of parsed configuration files.
+
+class:
+
+ParsedConfigCache -- stores and looks up parsed configuration trees
+                     keyed by file path, size, mtime, content hash and
+                     parser options, and counts hits and misses.
+"""
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+from threading import Lock
+
+CACHE_VERSION = 1
+
+
+class ParsedConfigCache(object):
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.lock = Lock()
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def key(self, fileName, options):
+        """Return (cache file name, header) for fileName parsed with options, a
+        dictionary of the parser options, or None if the file cannot be read."""
+        path = os.path.abspath(fileName)
+        try:
+            st = os.stat(path)
+            content = open(path, "rb").read()
+        except (IOError, OSError):
+            return None
+        optionsKey = repr(sorted(options.items()))
+        name = hashlib.sha1(path + "\0" + optionsKey).hexdigest() + ".cfgc"
+        header = (CACHE_VERSION, tuple(sys.version_info[:2]), path, optionsKey,
+                  st.st_size, st.st_mtime, hashlib.sha1(content).hexdigest())
+        return os.path.join(self.cacheDir, name), header
+
+    def lookup(self, key):
+        """Return the cached payload for key, or None on a miss"""
+        if key is None:
+            self._count("misses")
+            return None
+        cacheFile, header = key
+        try:
+            fp = open(cacheFile, "rb")
+        except IOError:
+            self._count("misses")
+            return None
+        try:
+            try:
+                if marshal.load(fp) != header:
+                    self._count("misses")
+                    return None
+                payload = marshal.load(fp)
+            except (EOFError, ValueError, TypeError):
+                self._count("errors")
+                self._count("misses")
+                return None
+        finally:
+            fp.close()
+        self._count("hits")
+        return payload
+
+    def store(self, key, payload):
+        """Write payload for key. Failing to write only costs the next load."""
+        if key is None:
+            return
+        cacheFile, header = key
+        tempName = None
+        try:
+            fd, tempName = tempfile.mkstemp(dir=self.cacheDir, suffix=".tmp")
+            fp = os.fdopen(fd, "wb")
+            try:
+                marshal.dump(header, fp)
+                marshal.dump(payload, fp)
+            finally:
+                fp.close()
+            if os.name == "nt" and os.path.exists(cacheFile):
+                os.remove(cacheFile)
+            os.rename(tempName, cacheFile)
+        except (IOError, OSError, ValueError):
+            self._count("errors")
+            if tempName is not None and os.path.exists(tempName):
+                os.remove(tempName)
+
+    def stats(self):
+        return {"cache_dir": self.cacheDir, "hits": self.hits, "misses": self.misses, "errors": self.errors}
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+#
+# File Name: ConfigSnapshot.py
+# Purpose: Typed, read-only snapshot of a CustomConfigObj file, reloaded when the file changes.
+# Notes:
+#               A schema lists, for each section, the options a program uses with a converter and a
+#               default. The file is parsed with CustomConfigObj and every option is converted once,
+#               into a namedtuple per section, so readers use plain attribute access such as
+#               config.snapshot.BatteryMonitor.Voltage_Threshold. Missing options take the schema
+#               default; unlike CustomConfigObj.get() nothing is written back to the parsed file.
+#
+#               ReloadableConfig checks the modification time and size of the file at most once per
+#               check interval. When they change the file is parsed and converted again and the new
+#               snapshot replaces the old one in a single assignment, so a reader sees either the old
+#               or the new values, never a mixture. A file that fails to parse or convert (e.g. while
+#               it is being saved) leaves the old snapshot in place.
+#
+
+"""Typed configuration snapshots.
+
+class:
+
+ConfigSchema -- sections, options, converters and defaults of a
+                configuration file, compiled to one namedtuple per section.
+
+ReloadableConfig -- holds the current snapshot of a file and swaps in
+                    a new one when the file changes.
+
+function:
+
+asString, asInt, asFloat, asOptionalFloat, asBoolean, asIntList,
+asExpression -- converters for schema entries.
+"""
+from collections import namedtuple
+import logging
+import os
+import time
+from threading import Lock
+
+log = logging.getLogger(__name__)
+
+# CustomConfigObj (and with it configobj) is imported when a file is first
+# parsed, so that importing the schema of a program stays cheap
+
+
+class ConfigValueError(ValueError):
+    """Raised when an option is missing or cannot be converted."""
+    pass
+
+
+def asString(text, where):
+    return text
+
+
+def asInt(text, where):
+    try:
+        return int(text)
+    except ValueError:
+        return int(float(text))
+
+
+def asFloat(text, where):
+    return float(text)
+
+
+def asBoolean(text, where):
+    from CustomConfigObj import CustomConfigObj
+    try:
+        return CustomConfigObj._boolean_states[text.strip().lower()]
+    except KeyError:
+        raise ValueError("Not a boolean: %s" % text)
+
+
+def asOptionalFloat(text, where):
+    return float(text) if text.strip() else None
+
+
+def asIntList(text, where):
+    return tuple(int(item) for item in text.split(',') if item.strip())
+
+
+def asExpression(text, where):
+    """Compile an expression once so that evaluating it only runs the code
+    object. An empty expression gives None."""
+    text = text.strip()
+    if not text:
+        return None
+    return compile(text, where, "eval")
+
+
+class ConfigSchema(object):
+    """sections is a list of (section, [(option, converter, default), ...]).
+
+    A default of None makes the option required. Defaults are given as they
+    would appear in the file and go through the converter like any value.
+
+    A section name ending in "_*" (e.g. "Alarm_*") stands for every section
+    whose name starts with that prefix. Its snapshot attribute (e.g. Alarm)
+    is a tuple, in file order, of one namedtuple per matching section, with
+    the section name as the extra first field Section.
+
+    check, if given, is called with every converted snapshot and raises
+    ConfigValueError for values which are wrong together (e.g. two sections
+    using the same alarm bit), so that such a file is never loaded.
+    """
+    def __init__(self, sections, check=None):
+        self.sections = [(section, list(options)) for section, options in sections]
+        self.check = check
+        self.sectionTypes = {}
+        names = []
+        for section, options in self.sections:
+            fields = [option for option, conv, default in options]
+            name = self._groupName(section)
+            if name is not None:
+                fields.insert(0, "Section")
+            else:
+                name = section
+            self.sectionTypes[section] = namedtuple(name, fields)
+            names.append(name)
+        self.snapshotType = namedtuple("ConfigSnapshot", names)
+
+    def _groupName(self, section):
+        return section[:-2] if section.endswith("_*") else None
+
+    def _convertSection(self, config, section, options, prefix=()):
+        values = list(prefix)
+        present = config.has_section(section)
+        for option, conv, default in options:
+            where = "[%s] %s" % (section, option)
+            if present and config.has_option(section, option):
+                text = config.get(section, option)
+            elif default is not None:
+                text = str(default)
+            else:
+                raise ConfigValueError("%s is required" % where)
+            try:
+                values.append(conv(text, where))
+            except (ValueError, SyntaxError), e:
+                raise ConfigValueError("%s: %s" % (where, e))
+        return values
+
+    def convert(self, config):
+        """Return a snapshot of the values of config, a CustomConfigObj"""
+        sections = []
+        for section, options in self.sections:
+            sectionType = self.sectionTypes[section]
+            if self._groupName(section) is not None:
+                group = [sectionType(*self._convertSection(config, name, options, (name,)))
+                         for name in config.list_sections() if name.startswith(section[:-1])]
+                sections.append(tuple(group))
+            else:
+                sections.append(sectionType(*self._convertSection(config, section, options)))
+        snapshot = self.snapshotType(*sections)
+        if self.check is not None:
+            self.check(snapshot)
+        return snapshot
+
+
+class ReloadableConfig(object):
+    """The current snapshot of fileName is the snapshot attribute.
+
+    Call check() regularly (it is cheap); it returns True when a new
+    snapshot has been swapped in, so the caller can apply settings that
+    are copied elsewhere. cache is an optional ConfigCache.ParsedConfigCache.
+    """
+    def __init__(self, fileName, schema, checkInterval=1.0, cache=None):
+        self.fileName = fileName
+        self.schema = schema
+        self.cache = cache
+        self.checkInterval = checkInterval
+        self.lock = Lock()
+        self.loads = 0
+        self.lastError = None
+        self.nextCheck = 0.0
+        self.signature = self._signature()
+        self.snapshot = self._load()
+
+    def _signature(self):
+        st = os.stat(self.fileName)
+        return (st.st_mtime, st.st_size)
+
+    def _load(self):
+        from CustomConfigObj import CustomConfigObj
+        snapshot = self.schema.convert(CustomConfigObj(self.fileName, cache=self.cache))
+        self.loads += 1
+        return snapshot
+
+    def check(self, now=None):
+        now = now if now is not None else time.time()
+        if now < self.nextCheck or not self.lock.acquire(False):
+            return False
+        try:
+            self.nextCheck = now + self.checkInterval
+            try:
+                signature = self._signature()
+            except OSError:
+                return False    # being replaced; try again later
+            if signature == self.signature:
+                return False
+            try:
+                self.snapshot = self._load()
+            except Exception, e:
+                # The signature is left as it was, so the file is tried again at the next check
+                if self.lastError != "%s" % e:
+                    log.warning("Configuration not reloaded from %s: %s", self.fileName, e)
+                self.lastError = "%s" % e
+                return False
+            self.signature = signature
+            self.lastError = None
+            return True
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        stats = {"file_name": self.fileName, "loads": self.loads, "last_error": self.lastError}
+        if self.cache is not None:
+            stats["cache"] = self.cache.stats()
+        return stats
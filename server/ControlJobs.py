@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+# File Name: ControlJobs.py
+# Purpose: Run control commands (analyzer RPCs) on a worker thread and report on them by job id.
+# Notes:
+#               Control commands end in RPCs to the instrument manager, the data logger or the driver,
+#               which can take as long as the instrument takes to answer. The control API queues them
+#               instead of calling them in the request thread and answers with a job id straight away;
+#               the client then asks for the job by id. Commands run one at a time, in order, on a
+#               single worker thread, as the analyzer handles one of these requests at a time anyway.
+#               Submitting a command which is already queued or running returns the existing job.
+#
+#               Finished jobs are kept for the last maxHistory commands. Jobs live in the process which
+#               queued them, so with several WSGI workers a job is only known to the worker which took
+#               the request that created it.
+#
+
+"""Control command jobs.
+
+class:
+
+ControlJob -- one queued command, its state and result.
+
+JobQueue -- runs jobs one at a time on a worker thread and finds
+            them by id.
+
+TtlValue -- a value which expires ttl seconds after it is set.
+"""
+from collections import OrderedDict
+import logging
+import Queue
+import time
+from threading import Event, Lock, Thread
+
+log = logging.getLogger(__name__)
+
+
+class ControlJob(object):
+    """state goes from "queued" to "running" to "done" or "failed"."""
+    def __init__(self, jobId, command):
+        self.jobId = jobId
+        self.command = command
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.doneEvent = Event()
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for the job to finish; returns True if it has"""
+        return self.doneEvent.wait(timeout) if timeout > 0 else self.doneEvent.is_set()
+
+    def asDict(self):
+        return {"job": self.jobId, "command": self.command, "state": self.state,
+                "result": self.result, "error": self.error, "submitted": self.submitted,
+                "started": self.started, "finished": self.finished}
+
+
+class JobQueue(object):
+    """run(command) carries out a command and returns its result. The worker
+    thread is started by the first submit."""
+    def __init__(self, run, maxHistory=100):
+        self.run = run
+        self.maxHistory = maxHistory
+        self.jobs = OrderedDict()
+        self.queue = Queue.Queue()
+        self.lock = Lock()
+        self.nextId = 1
+        self.worker = None
+        self.failed = 0
+        self.completed = 0
+
+    def submit(self, command):
+        """Queue command and return its job, or the job of the same command
+        if it is already queued or running"""
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if job.command == command and job.state in ("queued", "running"):
+                    return job
+            job = ControlJob(self.nextId, command)
+            self.nextId += 1
+            self.jobs[job.jobId] = job
+            while len(self.jobs) > self.maxHistory:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.state in ("queued", "running"):
+                    break
+                del self.jobs[oldest.jobId]
+            if self.worker is None:
+                self.worker = Thread(target=self._workLoop, name="ControlJobs")
+                self.worker.setDaemon(True)
+                self.worker.start()
+        self.queue.put(job)
+        return job
+
+    def get(self, jobId):
+        return self.jobs.get(jobId)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _workLoop(self):
+        while True:
+            job = self.queue.get()
+            job.state = "running"
+            job.started = time.time()
+            try:
+                job.result = self.run(job.command)
+                job.state = "done"
+                self.completed += 1
+            except Exception, e:
+                log.exception("Control command %s failed", job.command)
+                job.error = "%s" % e
+                job.state = "failed"
+                self.failed += 1
+            job.finished = time.time()
+            job.doneEvent.set()
+
+    def stats(self):
+        return {"jobs": len(self.jobs), "queued": self.queue.qsize(), "completed": self.completed,
+                "failed": self.failed}
+
+
+class TtlValue(object):
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.value = None
+        self.expires = 0.0
+
+    def get(self):
+        """Return the value, or None if it was never set or has expired"""
+        return self.value if time.time() < self.expires else None
+
+    def set(self, value):
+        self.value = value
+        self.expires = time.time() + self.ttl
@@ -13,6 +13,7 @@
 #
 # File History:
 # 08-09-16  Alex  Created file
+# 10-18-26  agent  Keep the lower-case index up to date incrementally instead of rebuilding it
 
 """Customized configuration file parser using ConfigObj.
 
@@ -98,10 +99,28 @@ CustomConfigObj -- responsible for parsing a list of
         return a list of tuples with (name, value) for each option
         in the section. This used to be the items() function in ConfigParser.
 
+    cache
+        A ConfigCache.ParsedConfigCache. When given, the parsed file is
+        stored in and loaded from that on-disk cache, so other processes
+        loading the same unchanged file skip parsing it.
+
     Additional methods:
     ignore_option_case_on (or off)
         Turn on/off the ignore_option_case flag.
 
+    update_many(section, values, format=None)
+        set many options of a section, given as a dictionary or a
+        list of (option, value) pairs, creating the section if needed.
+
+    merge(indict)
+        lay another configuration (e.g. a site or user override file)
+        over this one. Options are matched regardless of case when
+        ignore_option_case is on.
+
+    The lower-cased index used when ignore_option_case is on is built
+    once when the file is read and is then updated for each change,
+    including changes made directly to a section (config[s][o] = v).
+
 """
 import configobj
 import types
@@ -127,27 +146,99 @@ class DuplicateOptionError(Error):
     def __init__(self, option):
         Error.__init__(self, "Option %r already exists" % option)
 
+class _IndexedSection(configobj.Section):
+    """Section which keeps the case-folded index of its CustomConfigObj up to
+    date when it is changed directly, e.g. config[section][option] = value."""
+    def __setitem__(self, key, value, unrepr=False):
+        shadow = self.main._indexCheck(self, key)
+        configobj.Section.__setitem__(self, key, value, unrepr)
+        if shadow is not None:
+            self.main._indexSet(self, key, shadow)
+
+    def __delitem__(self, key):
+        configobj.Section.__delitem__(self, key)
+        self.main._indexDelete(self, key)
+
+    def rename(self, oldkey, newkey):
+        configobj.Section.rename(self, oldkey, newkey)
+        self.main._indexDelete(self, oldkey)
+        shadow = self.main._indexCheck(self, newkey)
+        if shadow is not None:
+            self.main._indexSet(self, newkey, shadow)
+
+    def clear(self):
+        configobj.Section.clear(self)
+        self.main._indexClear(self)
+
 class CustomConfigObj(configobj.ConfigObj):
-    def __init__(self, infile=None, options=None, ignore_option_case=True, print_case_convert=False, **kwargs):
+    def __init__(self, infile=None, options=None, ignore_option_case=True, print_case_convert=False, cache=None, **kwargs):
         if not kwargs.has_key('file_error'):
             kwargs['file_error'] = True
         if not kwargs.has_key('list_values'):
             kwargs['list_values'] = False
-        configobj.ConfigObj.__init__(self, infile, options, **kwargs)
+        # No index while the file is parsed, it is built once afterwards
+        self.shadow = None
+        self._itemsCache = {}
+        cacheKey = None
+        cached = None
+        if cache is not None and isinstance(infile, basestring) and options is None and 'configspec' not in kwargs:
+            keyOptions = dict(kwargs, ignore_option_case=ignore_option_case)
+            cacheKey = cache.key(infile, keyOptions)
+            cached = cache.lookup(cacheKey)
+        if cached is None:
+            configobj.ConfigObj.__init__(self, infile, options, **kwargs)
+        else:
+            configobj.ConfigObj.__init__(self, None, options, **kwargs)
+            self._restoreTree(cached)
         self.ignoreOptionCase = ignore_option_case
         self.print_case_convert = print_case_convert
-        if ignore_option_case:
+        if cached is not None and ignore_option_case:
+            self.shadow = cached["shadow"]
+        elif ignore_option_case:
             self.shadow = self._lowerCaseOpts(self)
-        else:
-            self.shadow = None
+        if cacheKey is not None and cached is None:
+            cache.store(cacheKey, self._dumpTree())
+
+    def _dumpTree(self):
+        """Return the parsed file as plain dictionaries and lists, for ConfigCache"""
+        def dumpSection(section):
+            return {"scalars": [(k, dict.__getitem__(section, k)) for k in section.scalars],
+                    "sections": [(k, dumpSection(section[k])) for k in section.sections],
+                    "comments": dict(section.comments),
+                    "inline_comments": dict(section.inline_comments)}
+        tree = dumpSection(self)
+        for attr in ("filename", "initial_comment", "final_comment", "newlines", "BOM", "encoding"):
+            tree[attr] = getattr(self, attr)
+        tree["shadow"] = self.shadow
+        return tree
+
+    def _restoreTree(self, tree):
+        """Fill this (empty) object from the result of _dumpTree"""
+        def restoreSection(section, node):
+            for k, v in node["scalars"]:
+                dict.__setitem__(section, k, v)
+            section.scalars = [k for k, v in node["scalars"]]
+            for k, child in node["sections"]:
+                sub = _IndexedSection(section, section.depth + 1, self, name=k)
+                restoreSection(sub, child)
+                dict.__setitem__(section, k, sub)
+            section.sections = [k for k, child in node["sections"]]
+            section.comments = node["comments"]
+            section.inline_comments = node["inline_comments"]
+        restoreSection(self, tree)
+        for attr in ("filename", "initial_comment", "final_comment", "newlines", "BOM", "encoding"):
+            setattr(self, attr, tree[attr])
 
     def _lowerCaseOpts(self,subDict):
         """Recursive routine which takes a nested dictionary and lower-cases
-        the keys of the leaf nodes"""
+        the keys of the leaf nodes. Sections are switched to _IndexedSection
+        on the way so that later changes keep the result current."""
         newDict = {}
         for k in subDict:
             v = subDict[k]
             if isinstance(v,dict):
+                if type(v) is configobj.Section:
+                    v.__class__ = _IndexedSection
                 newDict[k] = self._lowerCaseOpts(v)
             else:
                 if k.lower() in newDict:
@@ -156,6 +247,98 @@ class CustomConfigObj(configobj.ConfigObj):
                     newDict[k.lower()] = (v,k)
         return newDict
 
+    def _shadowFor(self, section):
+        """Return the shadow dictionary of a Section object, forgetting the
+        list_items() result of the top-level section it belongs to"""
+        if section.parent is self and section is not self:
+            self._itemsCache.pop(section.name, None)
+            return self.shadow[section.name]
+        names = []
+        while section is not self:
+            names.append(section.name)
+            section = section.parent
+        shadow = self.shadow
+        for name in reversed(names):
+            shadow = shadow[name]
+        if names:
+            self._itemsCache.pop(names[-1], None)
+        return shadow
+
+    def _indexCheck(self, section, key):
+        """Called before key is set in section; returns the shadow dictionary
+        to pass to _indexSet, or None if there is no index. An option which
+        differs from an existing one only by case is an error when options are
+        not case-sensitive; otherwise the index cannot represent both and is
+        dropped until ignore_option_case_on() rebuilds it (and reports the
+        duplicate)."""
+        if self.shadow is None or not isinstance(key, basestring):
+            return None
+        shadow = self._shadowFor(section)
+        entry = shadow.get(key.lower())
+        if entry.__class__ is tuple and entry[1] != key:
+            if self.ignoreOptionCase:
+                raise DuplicateOptionError(key)
+            self.shadow = None
+            self._itemsCache = {}
+            return None
+        return shadow
+
+    def _indexSet(self, section, key, shadow):
+        if section is self:
+            self._itemsCache.pop(key, None)
+        value = section[key]
+        if isinstance(value, dict) and key in section.sections:
+            if type(value) is configobj.Section:
+                value.__class__ = _IndexedSection
+            shadow[key] = self._lowerCaseOpts(value)
+        else:
+            shadow[key.lower()] = (value, key)
+
+    def _indexDelete(self, section, key):
+        if self.shadow is None:
+            return
+        if section is self:
+            self._itemsCache.pop(key, None)
+        shadow = self._shadowFor(section)
+        if isinstance(shadow.get(key), dict):
+            del shadow[key]
+        elif shadow.get(key.lower(), (None, None))[1] == key:
+            del shadow[key.lower()]
+
+    def _indexClear(self, section):
+        if self.shadow is not None:
+            self._shadowFor(section).clear()
+            if section is self:
+                self._itemsCache = {}
+
+    def __setitem__(self, key, value, unrepr=False):
+        shadow = self._indexCheck(self, key)
+        configobj.ConfigObj.__setitem__(self, key, value, unrepr)
+        if shadow is not None:
+            self._indexSet(self, key, shadow)
+
+    def __delitem__(self, key):
+        configobj.ConfigObj.__delitem__(self, key)
+        self._indexDelete(self, key)
+
+    def rename(self, oldkey, newkey):
+        configobj.ConfigObj.rename(self, oldkey, newkey)
+        self._indexDelete(self, oldkey)
+        shadow = self._indexCheck(self, newkey)
+        if shadow is not None:
+            self._indexSet(self, newkey, shadow)
+
+    def clear(self):
+        configobj.ConfigObj.clear(self)
+        self._indexClear(self)
+
+    def reload(self):
+        self.shadow = None
+        self._itemsCache = {}
+        configobj.ConfigObj.reload(self)
+        if self.ignoreOptionCase:
+            self.shadow = self._lowerCaseOpts(self)
+
     def get(self, section, option, default=None):
         if default is None:
             if not self.ignoreOptionCase:
@@ -193,21 +376,61 @@ class CustomConfigObj(configobj.ConfigObj):
             raise ValueError, 'Not a boolean: %s' % v
         return self._boolean_states[v.lower()]
 
+    def _setOption(self, sect, shadow, option, value):
+        """Set option of sect (a top-level section) and its index entry,
+        keeping the case of an existing option"""
+        optionLc = option.lower()
+        entry = shadow.get(optionLc)
+        if entry.__class__ is tuple:
+            option = entry[1]
+        configobj.Section.__setitem__(sect, option, value)
+        shadow[optionLc] = (value, option)
+
     def set(self, section, option, value, format=None):
         if format != None:
             value = format%value
 
         if not self.ignoreOptionCase:
-            self[section].update({option: str(value)})
+            self[section][option] = str(value)
         else:
-            optionLc = option.lower()
-            if optionLc in self.shadow[section]:
-                v, k = self.shadow[section][optionLc]
-                self[section].update({k: str(value)})
-                self.shadow[section].update({optionLc: (str(value),option)})
+            self._itemsCache.pop(section, None)
+            self._setOption(self[section], self.shadow[section], option, str(value))
+
+    def update_many(self, section, values, format=None):
+        """Set many options of section (created if it does not exist) in one
+        call. values is a dictionary or a list of (option, value) pairs."""
+        if not self.has_key(section):
+            self[section] = {}
+        sect = self[section]
+        if isinstance(values, dict):
+            values = values.items()
+        if format != None:
+            values = [(option, format%value) for option, value in values]
+        if not self.ignoreOptionCase:
+            for option, value in values:
+                sect[option] = str(value)
+        else:
+            self._itemsCache.pop(section, None)
+            shadow = self.shadow[section]
+            for option, value in values:
+                self._setOption(sect, shadow, option, str(value))
+
+    def merge(self, indict):
+        """Lay indict (a dictionary of sections, e.g. another ConfigObj) over
+        this configuration. Unlike ConfigObj.merge, options are matched
+        regardless of case when ignore_option_case is on."""
+        for key, val in indict.items():
+            if isinstance(val, dict):
+                if self.has_key(key) and isinstance(self[key], dict):
+                    scalars = [(k, v) for k, v in val.items() if not isinstance(v, dict)]
+                    self.update_many(key, scalars)
+                    for k, v in val.items():
+                        if isinstance(v, dict):
+                            self[key].merge({k: v})
+                else:
+                    self[key] = val
             else:
-                self[section].update({option: str(value)})
-                self.shadow[section].update({optionLc: (str(value),option)})
+                self[key] = val
 
     def has_section(self, section):
         return self.has_key(section)
@@ -220,8 +443,6 @@ class CustomConfigObj(configobj.ConfigObj):
     def add_section(self, section):
         if not self.has_key(section):
             self[section] = {}
-            if self.ignoreOptionCase:
-                self.shadow[section] = {}
         else:
             raise DuplicateSectionError(section)
 
@@ -229,8 +450,6 @@ class CustomConfigObj(configobj.ConfigObj):
         existed = self.has_key(section)
         if existed:
             del self[section]
-            if self.ignoreOptionCase:
-                del self.shadow[section]
         return existed
 
     def has_option(self, section, option):
@@ -262,7 +481,6 @@ class CustomConfigObj(configobj.ConfigObj):
                 try:
                     v,k = self.shadow[section][option.lower()]
                     del self[section][k]
-                    del self.shadow[section][option.lower()]
                     return True
                 except KeyError:
                     return False
@@ -275,19 +493,24 @@ class CustomConfigObj(configobj.ConfigObj):
         if not self.ignoreOptionCase:
             return self[section].items()
         else:
-            return [(k.lower(),self[section][k]) for k in self[section]]
+            items = self._itemsCache.get(section)
+            if items is None:
+                items = [(k.lower(),self[section][k]) for k in self[section]]
+                self._itemsCache[section] = items
+            return list(items)
 
     def ignore_option_case_on(self):
         """ The class treats options as case non-sensitive
         """
         self.ignoreOptionCase = True
-        self.shadow = self._lowerCaseOpts(self)
+        if self.shadow is None:
+            self.shadow = self._lowerCaseOpts(self)
 
     def ignore_option_case_off(self):
-        """ The class treats options as case sensitive
+        """ The class treats options as case sensitive. The index is still
+        kept up to date, so turning it back on is free.
         """
         self.ignoreOptionCase = False
-        self.shadow = None
 
     def _add_value(self, section, option, value):
         if self.has_key(section):
@@ -0,0 +1,557 @@
+#!/usr/bin/python
+#
+# File Name: DataArchive.py
+# Purpose: Chunked, columnar, compressed archive of finished DataLog files, read through a memory map.
+# Notes:
+#               A DataLog .dat file stores every value as space-padded text, and every historical read
+#               parses it again. Once the analyzer has moved on to a new file, the compactor rewrites
+#               the old one as a .dla archive next to it (and by default removes the text file):
+#
+#                   header      "BPKZ", uint32 version, uint32 columns, uint32 rows per chunk,
+#                               uint64 rows, uint64 offset of the chunk index
+#                   names       uint32 length + the column names separated by tabs
+#                   kinds       uint32 length + one character per column, "f" for a float64
+#                               column and "t" for a text column (not in version 1 archives,
+#                               which only have float64 columns)
+#                   chunks      for each chunk, one zlib stream per column
+#                   index       uint32 chunks, then for each chunk float64 first and last EPOCH_TIME,
+#                               uint64 first row, uint32 rows and, per column, uint64 offset and
+#                               uint32 length of its stream
+#
+#               (little-endian). A column stream holds the float64 values of the chunk with their bytes
+#               regrouped by significance (all first bytes, then all second bytes, ...), which puts the
+#               sign, exponent and leading mantissa bytes of similar values next to each other for zlib.
+#               EPOCH_TIME is delta encoded first: the int64 differences of the bit patterns of successive
+#               timestamps, which are nearly constant at a fixed sample rate and decode exactly. Columns
+#               whose values are not numbers (the DATE and TIME of DataLog files) are kept as text: the
+#               stream of a text column is its values of the chunk separated by newlines.
+#
+#               An archive only replaces its text file after every column of every row has been read
+#               back from it and found equal to the text file.
+#
+#               Rows are numbered from 1 like the rows of the text file. A time range query bisects the
+#               chunk index and then the EPOCH_TIME of one chunk, and only decompresses the columns asked
+#               for in the chunks that overlap the range. Archives are opened with mmap and a few are
+#               kept open between queries.
+#
+
+"""DataLog archives.
+
+class:
+
+ArchiveWriter -- writes a .dla archive chunk by chunk.
+
+ArchiveReader -- memory-mapped reader of a .dla archive.
+
+ArchiveFileInfo -- DataLogIndex entry for an archive, interchangeable
+                   with DataLogFileInfo.
+
+ArchiveCompactor -- converts the finished DataLog files under a tree
+                    into archives.
+
+function:
+
+archiveName(name) -- name of the archive of a DataLog file.
+
+compactFile(name, chunkRows) -- convert one DataLog file, returning the
+                                archive name.
+
+textColumns(info) -- the columns of a DataLog file which hold text.
+
+openArchive(name) -- shared ArchiveReader for a file.
+"""
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import fnmatch
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Lock
+
+from DataLogReader import DataLogFileInfo
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+MAGIC = "BPKZ"
+VERSION = 2
+HEADER = struct.Struct("<4sIIIQQ")
+CHUNK = struct.Struct("<ddQI")
+STREAM = struct.Struct("<QI")
+COUNT = struct.Struct("<I")
+ARCHIVE_SUFFIX = ".dla"
+# Archives kept memory-mapped between queries
+MAX_OPEN_ARCHIVES = 16
+# Decoded chunk columns kept by each reader
+MAX_DECODED_CHUNKS = 32
+
+
+def archiveName(name):
+    return os.path.splitext(name)[0] + ARCHIVE_SUFFIX
+
+
+def _shuffle(raw):
+    """Regroup the bytes of packed float64 values by significance"""
+    return "".join(raw[k::8] for k in range(8))
+
+
+def _unshuffle(planes):
+    n = len(planes) // 8
+    raw = bytearray(len(planes))
+    for k in range(8):
+        raw[k::8] = planes[k*n:(k + 1)*n]
+    return str(raw)
+
+
+def _encodeColumn(values, delta):
+    if numpy is not None:
+        v = numpy.asarray(values, dtype="<f8")
+        if delta and len(v):
+            bits = v.view("<i8")
+            v = numpy.concatenate((bits[:1], numpy.diff(bits)))
+        raw = v.tostring()
+    else:
+        values = [float(x) for x in values]
+        if delta and values:
+            bits = struct.unpack("<%dq" % len(values), struct.pack("<%dd" % len(values), *values))
+            deltas = [bits[0]] + [(b - a + 2**63) % 2**64 - 2**63 for a, b in zip(bits[:-1], bits[1:])]
+            raw = struct.pack("<%dq" % len(deltas), *deltas)
+        else:
+            raw = struct.pack("<%dd" % len(values), *values)
+    return zlib.compress(_shuffle(raw), 6)
+
+
+def _encodeText(values):
+    return zlib.compress("\n".join(values), 6)
+
+
+def _decodeText(stream, nRows):
+    values = str(zlib.decompress(stream)).split("\n") if nRows else []
+    return numpy.array(values) if numpy is not None else values
+
+
+def _packed(values):
+    """The float64 bytes of values, to compare columns exactly (NaN included)"""
+    if numpy is not None:
+        return numpy.asarray(values, dtype="<f8").tostring()
+    return struct.pack("<%dd" % len(values), *[float(x) for x in values])
+
+
+def _decodeColumn(stream, nRows, delta):
+    raw = _unshuffle(zlib.decompress(stream))
+    if numpy is not None:
+        if delta:
+            return numpy.cumsum(numpy.frombuffer(raw, dtype="<i8")).view("<f8")
+        return numpy.frombuffer(raw, dtype="<f8")
+    if delta:
+        bits = []
+        total = 0
+        for d in struct.unpack("<%dq" % nRows, raw):
+            total = (total + d + 2**63) % 2**64 - 2**63
+            bits.append(total)
+        return list(struct.unpack("<%dd" % nRows, struct.pack("<%dq" % nRows, *bits)))
+    return list(struct.unpack("<%dd" % nRows, raw))
+
+
+class ArchiveWriter(object):
+    """Write an archive with the given columns (which must include
+    EPOCH_TIME) to fileName, one chunk per addChunk call. The values of
+    textColumns are strings, those of the other columns numbers."""
+    def __init__(self, fileName, columns, chunkRows, textColumns=()):
+        self.fileName = fileName
+        self.columns = list(columns)
+        self.kinds = "".join("t" if col in textColumns else "f" for col in self.columns)
+        self.chunkRows = chunkRows
+        self.rows = 0
+        self.index = []
+        self.fp = open(fileName, "wb")
+        self.fp.write(HEADER.pack(MAGIC, VERSION, len(self.columns), chunkRows, 0, 0))
+        names = "\t".join(self.columns)
+        self.fp.write(COUNT.pack(len(names)) + names)
+        self.fp.write(COUNT.pack(len(self.kinds)) + self.kinds)
+
+    def addChunk(self, data, nRows):
+        """Append nRows rows; data maps every column to its values"""
+        if nRows == 0:
+            return
+        times = data["EPOCH_TIME"]
+        streams = []
+        for col, kind in zip(self.columns, self.kinds):
+            if kind == "t":
+                stream = _encodeText(data[col][:nRows])
+            else:
+                stream = _encodeColumn(data[col][:nRows], col == "EPOCH_TIME")
+            streams.append((self.fp.tell(), len(stream)))
+            self.fp.write(stream)
+        self.index.append((float(times[0]), float(times[nRows - 1]), self.rows + 1, nRows, streams))
+        self.rows += nRows
+
+    def close(self):
+        indexOffset = self.fp.tell()
+        parts = [COUNT.pack(len(self.index))]
+        for first, last, firstRow, nRows, streams in self.index:
+            parts.append(CHUNK.pack(first, last, firstRow, nRows))
+            parts.extend(STREAM.pack(offset, length) for offset, length in streams)
+        self.fp.write("".join(parts))
+        self.fp.seek(0)
+        self.fp.write(HEADER.pack(MAGIC, VERSION, len(self.columns), self.chunkRows, self.rows, indexOffset))
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+
+
+class ArchiveReader(object):
+    """Keeps the last MAX_DECODED_CHUNKS decoded chunk columns, so that the
+    bisection of a time range and the read of its rows decode a chunk once."""
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.decoded = OrderedDict()
+        self.lock = Lock()
+        fp = open(fileName, "rb")
+        try:
+            st = os.fstat(fp.fileno())
+            self.signature = (st.st_size, st.st_mtime)
+            self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+        magic, version, nColumns, self.chunkRows, self.rows, indexOffset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            self.map.close()
+            raise IOError("%s is not a DataLog archive" % fileName)
+        pos = HEADER.size
+        length = COUNT.unpack_from(self.map, pos)[0]
+        pos += COUNT.size
+        self.columns = self.map[pos:pos + length].split("\t")
+        self.header = self.columns
+        pos += length
+        if version == 1:
+            self.kinds = "f" * len(self.columns)
+        else:
+            length = COUNT.unpack_from(self.map, pos)[0]
+            pos += COUNT.size
+            self.kinds = self.map[pos:pos + length]
+        self.textColumns = set(col for col, kind in zip(self.columns, self.kinds) if kind == "t")
+        nChunks = COUNT.unpack_from(self.map, indexOffset)[0]
+        pos = indexOffset + COUNT.size
+        self.chunkFirst, self.chunkLast, self.chunkRow, self.chunkSize, self.streams = [], [], [], [], []
+        for i in range(nChunks):
+            first, last, firstRow, nRows = CHUNK.unpack_from(self.map, pos)
+            pos += CHUNK.size
+            streams = []
+            for col in self.columns:
+                streams.append(STREAM.unpack_from(self.map, pos))
+                pos += STREAM.size
+            self.chunkFirst.append(first)
+            self.chunkLast.append(last)
+            self.chunkRow.append(firstRow)
+            self.chunkSize.append(nRows)
+            self.streams.append(streams)
+        self.first = self.chunkFirst[0] if nChunks else None
+        self.last = self.chunkLast[-1] if nChunks else None
+
+    def close(self):
+        self.map.close()
+
+    def readChunk(self, i, col):
+        """Return the values of column col in chunk i"""
+        nRows = self.chunkSize[i]
+        if col not in self.columns:
+            return numpy.full(nRows, numpy.nan) if numpy is not None else [float('nan')]*nRows
+        with self.lock:
+            values = self.decoded.pop((i, col), None)
+            if values is None:
+                offset, length = self.streams[i][self.columns.index(col)]
+                if col in self.textColumns:
+                    values = _decodeText(buffer(self.map, offset, length), nRows)
+                else:
+                    values = _decodeColumn(buffer(self.map, offset, length), nRows, col == "EPOCH_TIME")
+            self.decoded[(i, col)] = values
+            while len(self.decoded) > MAX_DECODED_CHUNKS:
+                self.decoded.popitem(last=False)
+            return values
+
+    def readRows(self, lo, hi, columns):
+        """Return (nRows, data) for rows lo (inclusive) to hi (exclusive)"""
+        lo = max(lo, 1)
+        hi = min(hi, self.rows + 1)
+        parts = dict((col, []) for col in columns)
+        if hi > lo:
+            for i in range(bisect_right(self.chunkRow, lo) - 1, bisect_left(self.chunkRow, hi)):
+                a = max(lo, self.chunkRow[i]) - self.chunkRow[i]
+                b = min(hi, self.chunkRow[i] + self.chunkSize[i]) - self.chunkRow[i]
+                for col in columns:
+                    parts[col].append(self.readChunk(i, col)[a:b])
+        nRows = max(hi - lo, 0)
+        if numpy is not None:
+            return nRows, dict((col, numpy.concatenate(p) if p else numpy.empty(0)) for col, p in parts.items())
+        return nRows, dict((col, [v for part in p for v in part]) for col, p in parts.items())
+
+    def findRow(self, t, right=False):
+        """Return the first row whose EPOCH_TIME is >= t (> t if right is True)"""
+        search = bisect_right if right else bisect_left
+        i = search(self.chunkLast, t)
+        if i >= len(self.chunkLast):
+            return self.rows + 1
+        times = self.readChunk(i, "EPOCH_TIME")
+        if numpy is not None:
+            k = int(numpy.searchsorted(times, t, side="right" if right else "left"))
+        else:
+            k = search(times, t)
+        return self.chunkRow[i] + k
+
+
+_openLock = Lock()
+_openArchives = OrderedDict()
+
+
+def openArchive(name):
+    """Return a reader of archive name, shared with other callers and kept
+    open (mapped) for the MAX_OPEN_ARCHIVES most recently used archives"""
+    st = os.stat(name)
+    with _openLock:
+        reader = _openArchives.pop(name, None)
+        if reader is not None and reader.signature != (st.st_size, st.st_mtime):
+            reader.close()
+            reader = None
+        if reader is None:
+            reader = ArchiveReader(name)
+        _openArchives[name] = reader
+        while len(_openArchives) > MAX_OPEN_ARCHIVES:
+            _openArchives.popitem(last=False)[1].close()
+        return reader
+
+
+def closeArchive(name):
+    with _openLock:
+        reader = _openArchives.pop(name, None)
+        if reader is not None:
+            reader.close()
+
+
+class ArchiveFileInfo(DataLogFileInfo):
+    """Index entry for an archive; the data is read from the shared
+    memory-mapped reader instead of parsing the text file"""
+    pattern = "*" + ARCHIVE_SUFFIX
+
+    def update(self, st):
+        if st.st_size == self.size and st.st_mtime == self.mtime:
+            return
+        self.levels = None
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.rows = 0
+        self.first = self.last = None
+        try:
+            reader = openArchive(self.name)
+        except (IOError, OSError, struct.error, ValueError), e:
+            log.warning("Cannot read archive %s: %s", self.name, e)
+            return
+        self.header = reader.columns
+        if reader.rows > 0 and "EPOCH_TIME" in reader.columns:
+            self.rows = reader.rows
+            self.first = reader.first
+            self.last = reader.last
+
+    def readRange(self, start, end, columns):
+        reader = openArchive(self.name)
+        return reader.readRows(reader.findRow(start), reader.findRow(end, right=True), columns)
+
+    def readRows(self, lo, hi, columns):
+        return openArchive(self.name).readRows(lo, hi, columns)
+
+    def findRow(self, t, right=False):
+        return openArchive(self.name).findRow(t, right)
+
+
+def textColumns(info):
+    """Return the columns of DataLog file info whose value in the first row
+    is not a number, such as DATE and TIME"""
+    fp = open(info.name, "rb")
+    try:
+        fp.seek(info.lineLength)
+        values = fp.readline().split()
+    finally:
+        fp.close()
+    text = []
+    for col, value in zip(info.header, values):
+        try:
+            float(value)
+        except ValueError:
+            text.append(col)
+    return text
+
+
+def _readText(info, lo, hi, columns):
+    """Return the values of columns for rows lo to hi of DataLog file info as strings"""
+    fp = open(info.name, "rb")
+    try:
+        fp.seek(lo*info.lineLength)
+        lines = fp.read((hi - lo)*info.lineLength).splitlines()
+    finally:
+        fp.close()
+    indexes = [info.header.index(col) for col in columns]
+    rows = [line.split() for line in lines]
+    return dict((col, [row[k] for row in rows]) for col, k in zip(columns, indexes))
+
+
+def _sameColumns(info, reader, text, numeric, chunkRows):
+    """Check that every column of every row of the archive reader equals the
+    DataLog file info"""
+    if (reader.rows, reader.first, reader.last) != (info.rows, info.first, info.last):
+        return False
+    if reader.columns != info.header or reader.textColumns != set(text):
+        return False
+    row = 1
+    while row <= info.rows:
+        hi = min(row + chunkRows, info.rows + 1)
+        nRows, data = info.readRows(row, hi, numeric)
+        if nRows != hi - row:
+            return False
+        data.update(_readText(info, row, hi, text))
+        nRows, archived = reader.readRows(row, hi, info.header)
+        for col in numeric:
+            if _packed(archived[col]) != _packed(data[col]):
+                return False
+        for col in text:
+            if list(archived[col]) != data[col]:
+                return False
+        row = hi
+    return True
+
+
+def compactFile(name, chunkRows=4096):
+    """Convert the DataLog file name into an archive next to it and check
+    that every column of every row reads back the same. Returns the archive
+    name; the text file is left in place."""
+    info = DataLogFileInfo(name)
+    info.update(os.stat(name))
+    if info.rows == 0:
+        raise ValueError("%s has no complete rows" % name)
+    text = textColumns(info)
+    if "EPOCH_TIME" in text:
+        raise ValueError("%s has an EPOCH_TIME which is not a number" % name)
+    numeric = [col for col in info.header if col not in text]
+    target = archiveName(name)
+    temp = target + ".tmp"
+    writer = ArchiveWriter(temp, info.header, chunkRows, text)
+    try:
+        row = 1
+        while row <= info.rows:
+            hi = min(row + chunkRows, info.rows + 1)
+            nRows, data = info.readRows(row, hi, numeric)
+            if nRows != hi - row:
+                raise ValueError("%s has an incomplete row after row %d" % (name, row + nRows - 1))
+            data.update(_readText(info, row, hi, text))
+            writer.addChunk(data, nRows)
+            row = hi
+        writer.close()
+        reader = ArchiveReader(temp)
+        try:
+            if not _sameColumns(info, reader, text, numeric, chunkRows):
+                raise ValueError("%s does not match the rows of %s" % (temp, name))
+        finally:
+            reader.close()
+        os.rename(temp, target)
+    except Exception:
+        writer.fp.close()
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return target
+
+
+class ArchiveCompactor(object):
+    """Archives the DataLog files matching pattern under root which have not
+    been modified for minAge seconds, except the one being written."""
+    def __init__(self, root, pattern="*.dat", chunkRows=4096, minAge=600.0, keepText=False):
+        self.root = root
+        self.pattern = pattern
+        self.chunkRows = chunkRows
+        self.minAge = minAge
+        self.keepText = keepText
+        self.archived = 0
+        self.failed = 0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.failedNames = set()
+
+    def candidates(self, exclude=()):
+        now = time.time()
+        for path, dirs, files in os.walk(self.root):
+            dirs.sort()
+            for name in sorted(fnmatch.filter(files, self.pattern)):
+                name = os.path.join(path, name)
+                if name in exclude or name in self.failedNames:
+                    continue
+                try:
+                    st = os.stat(name)
+                except OSError:
+                    continue
+                if now - st.st_mtime < self.minAge:
+                    continue
+                if os.path.exists(archiveName(name)):
+                    if not self.keepText and self._archived(name):
+                        self._removeText(name)
+                    continue
+                yield name, st.st_size
+
+    def _archived(self, name):
+        """Whether the existing archive of name has all of its columns and rows"""
+        info = DataLogFileInfo(name)
+        try:
+            info.update(os.stat(name))
+            reader = ArchiveReader(archiveName(name))
+        except (IOError, OSError, struct.error, ValueError), e:
+            log.warning("Cannot check the archive of %s: %s", name, e)
+            self.failedNames.add(name)
+            return False
+        try:
+            text = textColumns(info) if info.rows else []
+            if not _sameColumns(info, reader, text, [c for c in info.header if c not in text], self.chunkRows):
+                log.warning("Archive of %s does not match it, keeping both", name)
+                self.failedNames.add(name)
+                return False
+        finally:
+            reader.close()
+        return True
+
+    def _removeText(self, name):
+        try:
+            os.remove(name)
+        except OSError, e:
+            log.warning("Cannot remove %s: %s", name, e)
+
+    def compactOnce(self, exclude=(), limit=0):
+        """Archive the finished files (at most limit of them if it is
+        positive) except the names in exclude, such as the file being
+        tailed. Returns the names of the archives written."""
+        written = []
+        for name, size in self.candidates(exclude):
+            try:
+                target = compactFile(name, self.chunkRows)
+            except Exception, e:
+                log.warning("Cannot archive %s: %s", name, e)
+                self.failed += 1
+                self.failedNames.add(name)
+                continue
+            self.archived += 1
+            self.bytesIn += size
+            self.bytesOut += os.path.getsize(target)
+            log.info("Archived %s (%d bytes) to %s (%d bytes)", name, size, target, os.path.getsize(target))
+            if not self.keepText:
+                self._removeText(name)
+            written.append(target)
+            if 0 < limit <= len(written):
+                break
+        return written
+
+    def stats(self):
+        return {"archived": self.archived, "failed": self.failed, "bytes_in": self.bytesIn,
+                "bytes_out": self.bytesOut}
@@ -0,0 +1,410 @@
+#!/usr/bin/python
+#
+# File Name: DataLogReader.py
+# Purpose: Readers for the fixed-width DataLog_User_Minimal .dat files written by the analyzer.
+# Notes:
+#               Every line in a DataLog file (including the header) is space-padded to the same
+#               length, so row N starts at byte N*lineLength. The readers here rely on that to seek
+#               straight to the requested rows instead of scanning the file.
+#
+
+"""Readers for fixed-width DataLog files.
+
+class:
+
+DataLogTail -- keeps the newest DataLog file open between polls and
+               returns the bytes appended since a given row.
+
+DataLogIndex -- first/last EPOCH_TIME and row count of every DataLog
+                file under the UserLog tree, used to answer time range
+                queries by binary search. Decimated queries are served
+                from per-file 10 s/1 min/10 min min/max levels.
+
+function:
+
+parseColumns(lines, header, lineLength, columns) -- convert complete
+                DataLog lines into lists of floats for the named columns.
+
+parseBlock(block, header, lineLength, columns) -- the same for a block
+                of bytes read from a row boundary, vectorized with NumPy
+                when it is installed.
+"""
+from collections import OrderedDict
+import fnmatch
+import glob
+import os
+from threading import Lock, RLock
+
+from Decimation import LevelBuilder, minMaxDecimate
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def parseColumns(lines, header, lineLength, columns):
+    """Return (nRows, data) where data maps each of columns to a list of floats.
+    Parsing stops at the first truncated line or line with the wrong number of
+    values. Columns missing from the header are filled with NaN."""
+    index = [header.index(col) if col in header else None for col in columns]
+    data = dict((col, []) for col in columns)
+    nCols = len(header)
+    nan = float('nan')
+    nRows = 0
+    for line in lines:
+        if len(line) != lineLength:
+            break
+        vals = line.split()
+        if len(vals) != nCols:
+            break
+        for col, i in zip(columns, index):
+            data[col].append(float(vals[i]) if i is not None else nan)
+        nRows += 1
+    return nRows, data
+
+
+def parseBlock(block, header, lineLength, columns):
+    """Return (nRows, data) for a block of bytes starting at a row boundary.
+
+    With NumPy the block is viewed as a 2-D array of characters, the line
+    and value count checks of parseColumns are done for all lines at once,
+    and each requested column is converted with a single astype() on its
+    character slots, so unused columns are never converted. Lines whose
+    values do not all start at the same offsets as the first line are left
+    to parseColumns."""
+    if numpy is None or lineLength == 0:
+        return parseColumns(block.splitlines(True), header, lineLength, columns)
+    nLines = len(block) // lineLength
+    if nLines == 0:
+        return 0, dict((col, numpy.empty(0)) for col in columns)
+    chars = numpy.frombuffer(block, dtype=numpy.uint8, count=nLines*lineLength).reshape(nLines, lineLength)
+    newline = chars == 10
+    space = newline | (chars == 32) | (chars == 9) | (chars == 13)
+    starts = ~space
+    starts[:, 1:] &= space[:, :-1]
+    # A complete line has its only newline at the end, and one value per column
+    good = newline[:, -1] & (newline.sum(axis=1) == 1) & (starts.sum(axis=1) == len(header))
+    bad = numpy.flatnonzero(~good)
+    nRows = int(bad[0]) if len(bad) else nLines
+    if nRows == 0:
+        return 0, dict((col, numpy.empty(0)) for col in columns)
+    chars = chars[:nRows]
+    positions = numpy.flatnonzero(starts[0])
+    if not (starts[:nRows] == starts[0]).all():
+        return parseColumns(block[:nRows*lineLength].splitlines(True), header, lineLength, columns)
+    bounds = list(positions) + [lineLength]
+    data = {}
+    for col in columns:
+        if col not in header:
+            data[col] = numpy.empty(nRows)
+            data[col].fill(numpy.nan)
+            continue
+        k = header.index(col)
+        field = numpy.ascontiguousarray(chars[:, bounds[k]:bounds[k+1]])
+        data[col] = field.view('S%d' % field.shape[1]).reshape(nRows).astype(numpy.float64)
+    return nRows, data
+
+
+class DataLogTail(object):
+    """Long-lived reader for the DataLog file currently being written.
+
+    The file handle, header, line length and last seen size are kept
+    between calls, so a poll costs a seek plus a read of the new bytes.
+    The file is only reopened when the name changes (rotation), when it
+    shrinks (truncation) or when the name refers to a different file.
+    """
+    def __init__(self):
+        self.name = None
+        self.fp = None
+        self.header = []
+        self.lineLength = 0
+        self.size = 0
+        self.opens = 0
+        self.lock = Lock()
+
+    def open(self, name):
+        self.close()
+        fp = file(name, 'rb')
+        headerLine = fp.readline()
+        if not headerLine.endswith('\n'):
+            # The analyzer has not finished writing the header yet
+            fp.close()
+            return False
+        self.name = name
+        self.fp = fp
+        self.header = headerLine.split()
+        self.lineLength = len(headerLine)
+        self.size = os.fstat(fp.fileno()).st_size
+        self.opens += 1
+        return True
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+        self.name = None
+        self.fp = None
+        self.header = []
+        self.lineLength = 0
+        self.size = 0
+
+    def sync(self, name):
+        """Make sure the handle refers to the file called name. Returns False
+        if the file cannot be read yet."""
+        if self.fp is None or name != self.name:
+            return self.open(name)
+        st = os.fstat(self.fp.fileno())
+        if st.st_size < self.size:
+            return self.open(name)
+        try:
+            if os.stat(name).st_ino != st.st_ino:
+                return self.open(name)
+        except OSError:
+            return self.open(name)
+        self.size = st.st_size
+        return True
+
+    def readBlock(self, name, startRow):
+        """Return (startRow, block) with the bytes of file name from row startRow
+        to the end of the file. startRow is reset to 1 if it is past the end of
+        the file."""
+        with self.lock:
+            if not self.sync(name):
+                return 1, ''
+            if self.size < startRow*self.lineLength:
+                startRow = 1
+            offset = startRow*self.lineLength
+            if offset >= self.size:
+                return startRow, ''
+            self.fp.seek(offset, 0)
+            return startRow, self.fp.read(self.size - offset)
+
+
+class DataLogFileInfo(object):
+    """Index entry for one DataLog file"""
+    def __init__(self, name):
+        self.name = name
+        self.size = -1
+        self.mtime = None
+        self.header = []
+        self.lineLength = 0
+        self.rows = 0
+        self.first = None
+        self.last = None
+        self.levels = None
+        self.aggRows = 0
+
+    def epochAt(self, fp, row):
+        fp.seek(row*self.lineLength, 0)
+        return float(fp.read(self.lineLength).split()[self.header.index("EPOCH_TIME")])
+
+    def update(self, st):
+        """Re-read the header and the first and last timestamps if the file changed"""
+        if st.st_size == self.size and st.st_mtime == self.mtime:
+            return
+        if st.st_size < self.size:
+            self.levels = None
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.rows = 0
+        self.first = self.last = None
+        fp = file(self.name, 'rb')
+        try:
+            headerLine = fp.readline()
+            if not headerLine.endswith('\n'):
+                return
+            self.header = headerLine.split()
+            self.lineLength = len(headerLine)
+            if "EPOCH_TIME" not in self.header:
+                return
+            rows = self.size // self.lineLength - 1
+            if rows > 0:
+                self.first = self.epochAt(fp, 1)
+                self.last = self.epochAt(fp, rows)
+                self.rows = rows
+        except (ValueError, IndexError):
+            self.rows = 0
+            self.first = self.last = None
+        finally:
+            fp.close()
+
+    def bisect(self, fp, t, right=False):
+        """Return the first row whose EPOCH_TIME is >= t (> t if right is True).
+        Rows must be in time order, which is how the analyzer writes them."""
+        lo, hi = 1, self.rows + 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v = self.epochAt(fp, mid)
+            if v < t or (right and v == t):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def readRange(self, start, end, columns):
+        """Return (nRows, data) for the rows with start <= EPOCH_TIME <= end"""
+        fp = file(self.name, 'rb')
+        try:
+            lo = self.bisect(fp, start)
+            hi = self.bisect(fp, end, right=True)
+        finally:
+            fp.close()
+        return self.readRows(lo, hi, columns)
+
+    def readRows(self, lo, hi, columns):
+        """Return (nRows, data) for rows lo (inclusive) to hi (exclusive)"""
+        if hi <= lo:
+            return 0, dict((col, []) for col in columns)
+        fp = file(self.name, 'rb')
+        try:
+            fp.seek(lo*self.lineLength, 0)
+            block = fp.read((hi - lo)*self.lineLength)
+        finally:
+            fp.close()
+        return parseBlock(block, self.header, self.lineLength, columns)
+
+    def findRow(self, t, right=False):
+        """Return the first row whose EPOCH_TIME is >= t (> t if right is True)"""
+        fp = file(self.name, 'rb')
+        try:
+            return self.bisect(fp, t, right)
+        finally:
+            fp.close()
+
+    def aggregate(self, widths, columns, chunkRows=10000):
+        """Bring the decimation levels up to date with the rows added to the file
+        since the last call. Each level is fed from the rows completed by the
+        next finer one, so the raw data is only read once."""
+        if self.levels is None:
+            self.levels = [LevelBuilder(width, columns) for width in widths]
+            self.aggRows = 0
+        if self.aggRows >= self.rows:
+            return
+        while self.aggRows < self.rows:
+            lo = self.aggRows + 1
+            nRows, data = self.readRows(lo, lo + min(chunkRows, self.rows - self.aggRows),
+                                        ["EPOCH_TIME"] + list(columns))
+            if nRows == 0:
+                break
+            rows = zip(data["EPOCH_TIME"], zip(*[data[col] for col in columns]))
+            for level in self.levels:
+                rows = level.addRows(rows)
+            self.aggRows += nRows
+
+    def readLevel(self, width, start, end, columns):
+        for i, level in enumerate(self.levels):
+            if level.width == width:
+                return level.read(start, end, columns, self.levels[:i])
+        raise KeyError(width)
+
+
+class DataLogIndex(object):
+    """Keeps a DataLogFileInfo for every file matching pattern under root.
+
+    refresh() stats each directory and only lists those whose modification
+    time changed, then stats each file and only re-reads the header and end
+    timestamps of files whose size or mtime changed (normally just the one
+    being written). A range query then opens only the files whose
+    [first, last] interval overlaps the requested range.
+
+    Queries with a point limit use the coarsest decimation level (widths
+    in seconds) that still gives at least maxPoints/2 buckets. Levels are
+    built per file on first use, extended as the file grows and kept for
+    the maxCachedFiles most recently used files.
+
+    archiveType (DataArchive.ArchiveFileInfo) also indexes the archives
+    matching its pattern; a file with an archive of the same base name is
+    read from the archive.
+    """
+    def __init__(self, root, pattern="*.dat", columns=(), levelWidths=(10, 60, 600), maxCachedFiles=32,
+                 archiveType=None):
+        self.root = root
+        self.pattern = pattern
+        self.columns = [col for col in columns if col != "EPOCH_TIME"]
+        self.levelWidths = sorted(levelWidths)
+        self.maxCachedFiles = maxCachedFiles
+        self.archiveType = archiveType
+        self.cached = OrderedDict()
+        self.dirs = {}
+        self.files = {}
+        self.lock = RLock()
+
+    def _scanDir(self, path, found):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        cached = self.dirs.get(path)
+        if cached is None or cached[0] != mtime:
+            subdirs = [os.path.join(path, d) for d in os.listdir(path)
+                       if os.path.isdir(os.path.join(path, d))]
+            names = glob.glob(os.path.join(path, self.pattern))
+            if self.archiveType is not None:
+                archives = glob.glob(os.path.join(path, self.archiveType.pattern))
+                bases = set(os.path.splitext(name)[0] for name in archives)
+                names = [name for name in names if os.path.splitext(name)[0] not in bases] + archives
+            cached = (mtime, subdirs, names)
+            self.dirs[path] = cached
+        found.extend(cached[2])
+        for d in cached[1]:
+            self._scanDir(d, found)
+
+    def refresh(self):
+        with self.lock:
+            found = []
+            self._scanDir(self.root, found)
+            files = {}
+            for name in found:
+                try:
+                    st = os.stat(name)
+                except OSError:
+                    continue
+                info = self.files.get(name)
+                if info is None:
+                    if self.archiveType is not None and fnmatch.fnmatch(name, self.archiveType.pattern):
+                        info = self.archiveType(name)
+                    else:
+                        info = DataLogFileInfo(name)
+                info.update(st)
+                files[name] = info
+            self.files = files
+
+    def overlapping(self, start, end):
+        """Return the indexed files with rows between start and end, oldest first"""
+        infos = [info for info in self.files.values()
+                 if info.rows > 0 and info.first <= end and info.last >= start]
+        return sorted(infos, key=lambda info: (info.first, info.name))
+
+    def query(self, start, end, columns, maxPoints=0):
+        """Return (names, data) with the rows of every file in the time range,
+        decimated to at most maxPoints rows if maxPoints is positive."""
+        with self.lock:
+            self.refresh()
+            width = 0
+            if maxPoints > 0:
+                bucketWidth = float(end - start) / max(1, maxPoints // 2)
+                width = max([w for w in self.levelWidths if w <= bucketWidth] or [0])
+            names = []
+            data = dict((col, []) for col in columns)
+            for info in self.overlapping(start, end):
+                if width:
+                    self._useLevels(info)
+                    fileData = info.readLevel(width, start, end, columns)
+                    nRows = len(fileData["EPOCH_TIME"])
+                else:
+                    nRows, fileData = info.readRange(start, end, columns)
+                if nRows > 0:
+                    names.append(info.name)
+                    for col in columns:
+                        data[col].extend(fileData[col])
+        if maxPoints > 0 and "EPOCH_TIME" in data:
+            data = minMaxDecimate(data, maxPoints)
+        return names, data
+
+    def _useLevels(self, info):
+        info.aggregate(self.levelWidths, self.columns)
+        self.cached.pop(info.name, None)
+        self.cached[info.name] = info
+        while len(self.cached) > self.maxCachedFiles:
+            name, old = self.cached.popitem(last=False)
+            old.levels = None
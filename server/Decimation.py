@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# File Name: Decimation.py
+# Purpose: Reduce long series to a bounded number of points for graphing without losing spikes.
+# Notes:
+#               Each bucket of samples is replaced by at most two rows: the first carries, for every
+#               column, whichever of its minimum and maximum comes first in the bucket and the second
+#               carries the other one. Decimating already decimated rows therefore still keeps the
+#               overall extremes, which is what lets the time levels below be chained.
+#
+
+"""Min/max decimation of columnar series.
+
+function:
+
+minMaxDecimate(data, maxPoints) -- reduce a dict of equal length
+                column lists to at most maxPoints rows.
+
+class:
+
+LevelBuilder -- incrementally decimates a stream of rows into fixed
+                time buckets (e.g. 10 s, 1 min, 10 min) and keeps the
+                result for later range reads.
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+TIME_COLUMN = "EPOCH_TIME"
+
+
+def _reduce(times, values, columns):
+    """Return up to two (time, row) pairs for one bucket which keep the minimum
+    and maximum of every column, in the order they occurred."""
+    if len(times) == 1:
+        return [(times[0], [values[col][0] for col in columns])]
+    first = []
+    second = []
+    for col in columns:
+        seg = values[col]
+        iMin = min(xrange(len(seg)), key=seg.__getitem__)
+        iMax = max(xrange(len(seg)), key=seg.__getitem__)
+        if iMin <= iMax:
+            first.append(seg[iMin])
+            second.append(seg[iMax])
+        else:
+            first.append(seg[iMax])
+            second.append(seg[iMin])
+    return [(times[0], first), (times[-1], second)]
+
+
+def minMaxDecimate(data, maxPoints):
+    """Return data (a dict of equal length lists including EPOCH_TIME) reduced
+    to at most maxPoints rows by splitting it into maxPoints/2 buckets of equal
+    sample count. data is returned unchanged if it is already small enough."""
+    times = data[TIME_COLUMN]
+    n = len(times)
+    maxPoints = max(maxPoints, 2)
+    if n <= maxPoints:
+        return data
+    columns = [col for col in data if col != TIME_COLUMN]
+    result = dict((col, []) for col in data)
+    nBuckets = maxPoints // 2
+    for b in xrange(nBuckets):
+        lo = b*n // nBuckets
+        hi = (b + 1)*n // nBuckets
+        values = dict((col, data[col][lo:hi]) for col in columns)
+        for t, row in _reduce(times[lo:hi], values, columns):
+            result[TIME_COLUMN].append(t)
+            for col, val in zip(columns, row):
+                result[col].append(val)
+    return result
+
+
+class LevelBuilder(object):
+    """Decimates rows into buckets of width seconds as they are added.
+
+    Completed buckets are stored as array('d') columns; the bucket still
+    being filled is kept as plain lists and reduced on demand by read().
+    """
+    def __init__(self, width, columns):
+        self.width = width
+        self.columns = list(columns)
+        self.data = dict((col, array('d')) for col in [TIME_COLUMN] + self.columns)
+        self.bucket = None
+        self.times = []
+        self.values = dict((col, []) for col in self.columns)
+
+    def _flush(self):
+        rows = _reduce(self.times, self.values, self.columns)
+        for t, row in rows:
+            self.data[TIME_COLUMN].append(t)
+            for col, val in zip(self.columns, row):
+                self.data[col].append(val)
+        self.times = []
+        self.values = dict((col, []) for col in self.columns)
+        return rows
+
+    def addRows(self, rows):
+        """Add a list of (time, row) pairs in time order. Returns the reduced rows
+        of the buckets that were completed, to be fed to a coarser level."""
+        flushed = []
+        for t, row in rows:
+            bucket = int(t // self.width)
+            if bucket != self.bucket and self.times:
+                flushed.extend(self._flush())
+            self.bucket = bucket
+            self.times.append(t)
+            for col, val in zip(self.columns, row):
+                self.values[col].append(val)
+        return flushed
+
+    def read(self, start, end, columns, finer=()):
+        """Return the decimated rows with start <= EPOCH_TIME <= end. finer are the
+        levels feeding this one, finest first; the rows still held in their open
+        buckets have not reached this level yet and are appended at the end."""
+        times = self.data[TIME_COLUMN]
+        lo = bisect_left(times, start)
+        hi = bisect_right(times, end)
+        result = {TIME_COLUMN: times[lo:hi].tolist()}
+        for col in columns:
+            if col != TIME_COLUMN:
+                result[col] = self.data[col][lo:hi].tolist()
+        for level in [self] + list(reversed(finer)):
+            level._readOpenBucket(start, end, result)
+        return result
+
+    def _readOpenBucket(self, start, end, result):
+        if not self.times:
+            return
+        for t, row in _reduce(self.times, self.values, self.columns):
+            if start <= t <= end:
+                result[TIME_COLUMN].append(t)
+                for col, val in zip(self.columns, row):
+                    if col in result:
+                        result[col].append(val)
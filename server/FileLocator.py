@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# File Name: FileLocator.py
+# Purpose: Find the newest DataLog file under the UserLog year/month/day tree without walking it on every poll.
+# Notes:
+#               Creating a file or directory updates the modification time of its parent directory, so the
+#               locator only needs to stat the four directories on the path to the current file (root, year,
+#               month, day) to know whether anything newer can have appeared. When pyinotify is available
+#               (Linux only) directory events are used instead and a lookup costs no system calls at all.
+#
+
+"""Cached discovery of the newest DataLog file.
+
+class:
+
+LatestFileLocator -- returns the newest file matching a pattern in the
+                     newest day directory of a year/month/day tree.
+"""
+import glob
+import os
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class LatestFileLocator(object):
+    """Caches the newest file and the directories leading to it.
+
+    In "poll" mode each locate() stats the cached directories and rescans
+    only from the level whose modification time changed. In "inotify" mode
+    a watch on the tree marks the cache dirty when an entry is created,
+    moved in or removed.
+    """
+    # Directory levels below the root: year, month, day
+    depth = 3
+    # A directory modified this recently is rechecked, in case an entry was
+    # added within the resolution of the file system timestamps
+    settleTime = 2.0
+
+    def __init__(self, root, pattern="*.dat", useInotify=True):
+        self.root = root
+        self.pattern = pattern
+        self.dirs = []
+        self.name = None
+        self.lookups = 0
+        self.rescans = 0
+        self.dirty = True
+        self.notifier = None
+        self.mode = "poll"
+        if useInotify and pyinotify is not None:
+            try:
+                self._startWatch()
+                self.mode = "inotify"
+            except Exception:
+                self.notifier = None
+
+    def _startWatch(self):
+        locator = self
+
+        class Handler(pyinotify.ProcessEvent):
+            def process_default(self, event):
+                locator.dirty = True
+
+        wm = pyinotify.WatchManager()
+        mask = pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO | pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM
+        wm.add_watch(self.root, mask, rec=True, auto_add=True, quiet=False)
+        self.notifier = pyinotify.ThreadedNotifier(wm, Handler())
+        self.notifier.daemon = True
+        self.notifier.start()
+
+    def stop(self):
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+            self.mode = "poll"
+
+    def locate(self):
+        """Return the path of the newest file, or None if there is none"""
+        self.lookups += 1
+        if self.mode == "inotify":
+            if self.dirty:
+                self.dirty = False
+                self._rescan(0)
+            return self.name
+        if not self.dirs:
+            self._rescan(0)
+            return self.name
+        now = time.time()
+        for level, (path, mtime) in enumerate(self.dirs):
+            try:
+                current = os.stat(path).st_mtime
+            except OSError:
+                self._rescan(0)
+                break
+            if current != mtime or now - current < self.settleTime:
+                self._rescan(level)
+                break
+        return self.name
+
+    def _rescan(self, level):
+        """Rebuild the cached path from the directory at the given level downwards"""
+        self.rescans += 1
+        try:
+            path = self.dirs[level][0] if level > 0 else self.root
+            dirs = self.dirs[:level]
+            while True:
+                # stat before listing so that a change made during the scan is seen next time
+                dirs.append((path, os.stat(path).st_mtime))
+                if len(dirs) > self.depth:
+                    break
+                path = os.path.join(path, max(os.listdir(path)))
+            names = sorted(glob.glob(os.path.join(path, self.pattern)))
+            self.name = names[-1]
+            self.dirs = dirs
+        except (OSError, ValueError, IndexError):
+            self.dirs = []
+            self.name = None
+
+    def stats(self):
+        return {"mode": self.mode,
+                "file_name": self.name,
+                "lookups": self.lookups,
+                "rescans": self.rescans}
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+#
+# File Name: LocalRpc.py
+# Purpose: Local stand-ins for the analyzer RPC servers used by the control API.
+# Notes:
+#               On the analyzer the backpack server calls the instrument manager, the data logger and
+#               the driver over RPC. In simulation mode (and for testing the control job queue without
+#               an analyzer) these classes take their place: they have the same methods, log the call,
+#               and take delay seconds to answer, like an instrument which is busy.
+#
+
+"""Stand-in RPC objects.
+
+class:
+
+LocalInstMgr -- instrument manager (INSTMGR_ShutdownRpc).
+
+LocalDataLogger -- data logger (startUserLogs).
+
+LocalDriver -- driver (allVersions).
+"""
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+VERSIONS = {'host release': 'mobile-2.4.2.24 (3102146b)',
+            'config - app version no': '1.0.5',
+            'config - instr version no': '9fa0b2b'}
+
+
+class LocalRpc(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def _call(self, name, *args):
+        if self.delay > 0:
+            time.sleep(self.delay)
+        self.calls.append((name,) + args)
+
+
+class LocalInstMgr(LocalRpc):
+    def INSTMGR_ShutdownRpc(self, mode):
+        self._call("INSTMGR_ShutdownRpc", mode)
+        log.info("Shut down analyzer per request of the user.")
+
+
+class LocalDataLogger(LocalRpc):
+    def startUserLogs(self, userLogNames, restart=False):
+        self._call("startUserLogs", userLogNames, restart)
+        log.info("Restart userlog per request of the user.")
+
+
+class LocalDriver(LocalRpc):
+    def allVersions(self):
+        self._call("allVersions")
+        log.info("Version information requested.")
+        return dict(VERSIONS)
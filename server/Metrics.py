@@ -0,0 +1,206 @@
+#!/usr/bin/python
+#
+# File Name: Metrics.py
+# Purpose: In-process counters, timers and latency histograms, rendered in the Prometheus text format.
+# Notes:
+#               Metrics are created once (at import time of the server) and updated from the request
+#               and ingest threads. An update is a dictionary lookup and an addition under the lock of
+#               that one metric, so the hot paths can be instrumented without measurable cost. Labels
+#               are given as a tuple of values in the order of the label names of the metric.
+#
+#               The registry is per process: with several WSGI workers each worker reports its own
+#               requests, and the scraper adds them up (e.g. sum by (endpoint)).
+#
+
+"""Metrics registry with Prometheus text exposition.
+
+class:
+
+Counter -- monotonically increasing count, per label values.
+
+Summary -- count and sum of observations (e.g. seconds spent in a
+           stage), per label values.
+
+Histogram -- Summary with counts per bucket, for latency distributions.
+
+Gauge -- value read from a function when the metrics are rendered.
+
+MetricsRegistry -- creates the metrics and renders them all.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import time
+from threading import Lock
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def formatLabels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                                           .replace("\n", "\\n")) for name, value in pairs)
+
+
+def formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Timer(object):
+    """Context manager which observes the seconds spent in its block"""
+    __slots__ = ("metric", "labels", "start")
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.metric.observe(time.time() - self.start, *self.labels)
+        return False
+
+
+class Metric(object):
+    typeName = "untyped"
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self.lock = Lock()
+        self.values = OrderedDict()
+
+    def header(self):
+        return ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.typeName)]
+
+
+class Counter(Metric):
+    typeName = "counter"
+
+    def inc(self, value=1, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def render(self):
+        with self.lock:
+            items = self.values.items()
+        return self.header() + ["%s%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(value))
+                                for labels, value in items]
+
+
+class Summary(Metric):
+    typeName = "summary"
+
+    def observe(self, value, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0, 0.0]
+            entry[0] += 1
+            entry[1] += value
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+    def render(self):
+        with self.lock:
+            items = [(labels, list(entry)) for labels, entry in self.values.items()]
+        lines = self.header()
+        for labels, (count, total) in items:
+            text = formatLabels(self.labelNames, labels)
+            lines.append("%s_sum%s %s" % (self.name, text, formatValue(total)))
+            lines.append("%s_count%s %s" % (self.name, text, count))
+        return lines
+
+
+class Histogram(Summary):
+    typeName = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        Summary.__init__(self, name, help, labelNames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0, 0.0, [0]*(len(self.buckets) + 1)]
+            entry[0] += 1
+            entry[1] += value
+            entry[2][i] += 1
+
+    def render(self):
+        with self.lock:
+            items = [(labels, entry[0], entry[1], list(entry[2])) for labels, entry in self.values.items()]
+        lines = self.header()
+        for labels, count, total, counts in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (self.name, formatLabels(self.labelNames, labels,
+                                                                         [("le", formatValue(bound))]),
+                                                 cumulative))
+            text = formatLabels(self.labelNames, labels)
+            lines.append("%s_sum%s %s" % (self.name, text, formatValue(total)))
+            lines.append("%s_count%s %s" % (self.name, text, count))
+        return lines
+
+
+class Gauge(Metric):
+    """func returns the current value, or a list of (label values, value)
+    when the gauge has labels. Returning None leaves the gauge out."""
+    typeName = "gauge"
+
+    def __init__(self, name, help, func, labelNames=()):
+        Metric.__init__(self, name, help, labelNames)
+        self.func = func
+
+    def render(self):
+        value = self.func()
+        if value is None:
+            return []
+        items = value if self.labelNames else [((), value)]
+        return self.header() + ["%s%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(v))
+                                for labels, v in items]
+
+
+class MetricsRegistry(object):
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.metrics = OrderedDict()
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric %s already registered" % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelNames=()):
+        return self._add(Counter(self.prefix + name, help, labelNames))
+
+    def summary(self, name, help, labelNames=()):
+        return self._add(Summary(self.prefix + name, help, labelNames))
+
+    def histogram(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labelNames, buckets))
+
+    def gauge(self, name, help, func, labelNames=()):
+        return self._add(Gauge(self.prefix + name, help, func, labelNames))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+#
+# File Name: ReplayEngine.py
+# Purpose: Time-accurate, accelerated and seekable replay of recorded DataLog files.
+# Notes:
+#               The replay files are laid end to end (in time order) and repeated forever. A replay row
+#               number counts rows across files and repetitions, starting at 1, so it can be used as the
+#               client's cursor exactly like next_row of the live series. EPOCH_TIME is shifted so that
+#               each file starts one sample interval after the end of the previous one, whatever the
+#               gap between the recordings, and each repetition shifts it again by the total length of
+#               the files, so replayed times never go backwards nor stall.
+#
+#               A session holds a replay clock: the data time that corresponds to a wall clock time,
+#               and a speed. Rows become due when the clock passes their EPOCH_TIME. Speed 1 is real
+#               time, N is N times faster and 0 serves rows as fast as the client asks for them.
+#               Files are only read with seeks, nothing is held open between requests.
+#
+#               Sessions are only created by a request without a session id; an unknown or expired id
+#               is refused rather than opening a new session, so clients which keep sending one do not
+#               fill the session table.
+#
+
+"""Replay of recorded DataLog files.
+
+class:
+
+ReplaySession -- replay clock and per-client state.
+
+ReplayEngine -- maps replay row numbers and times onto the recorded
+                files and serves the rows due for a session.
+"""
+from bisect import bisect_right
+from collections import OrderedDict
+import math
+import os
+import time
+import uuid
+from threading import Lock
+
+from DataLogReader import DataLogFileInfo
+
+
+class ReplaySession(object):
+    def __init__(self, sessionId, speed, dataStart, anchorRow, wallStart):
+        self.sessionId = sessionId
+        self.speed = speed
+        self.dataStart = dataStart
+        self.anchorRow = anchorRow
+        self.wallStart = wallStart
+        self.lastUsed = wallStart
+        # Filled in by the server with the session's own alarm state
+        self.channels = None
+        self.alarm = None
+
+    def clock(self, now):
+        """Replay data time at wall clock time now"""
+        return self.dataStart + (now - self.wallStart)*self.speed
+
+
+class ReplayEngine(object):
+    """Serves recorded files as a looping, time-ordered stream of rows.
+
+    Sessions idle for more than sessionTimeout seconds are dropped, and so
+    is the least recently used one when a new session would exceed
+    maxSessions. A poll returns at most maxBatch rows, so a client far
+    behind (or one using speed 0) catches up over several requests.
+    """
+    def __init__(self, fileNames, maxBatch=3600, sessionTimeout=600.0, maxSessions=100):
+        self.infos = []
+        for name in fileNames:
+            info = DataLogFileInfo(name)
+            info.update(os.stat(name))
+            if info.rows > 0:
+                self.infos.append(info)
+        if not self.infos:
+            raise ValueError("No replayable rows in %s" % ", ".join(fileNames))
+        self.infos.sort(key=lambda info: info.first)
+        self.offsets = []
+        total = 0
+        for info in self.infos:
+            self.offsets.append(total)
+            total += info.rows
+        self.totalRows = total
+        self.first = self.infos[0].first
+        # Time shift of each file: it starts one sample interval after the end of the previous one
+        self.shifts = []
+        start = self.first
+        for info in self.infos:
+            self.shifts.append(start - info.first)
+            start += info.last - info.first + self.interval(info)
+        self.period = start - self.first
+        self.maxBatch = maxBatch
+        self.sessionTimeout = sessionTimeout
+        self.maxSessions = maxSessions
+        self.sessions = OrderedDict()
+        self.lock = Lock()
+        self.defaultSession = ReplaySession(None, 1.0, self.first, 1, time.time())
+
+    def interval(self, info):
+        """Sample interval of a file, from its own rows if it has several"""
+        if info.rows > 1 and info.last > info.first:
+            return (info.last - info.first) / (info.rows - 1)
+        spans = [(i.last - i.first, i.rows - 1) for i in self.infos if i.rows > 1 and i.last > i.first]
+        return sum(span for span, n in spans) / sum(n for span, n in spans) if spans else 1.0
+
+    def _locate(self, row):
+        """Return (cycle, file index, row in file) of a replay row"""
+        cycle, r = divmod(row - 1, self.totalRows)
+        i = bisect_right(self.offsets, r) - 1
+        return cycle, i, r - self.offsets[i] + 1
+
+    def fileName(self, row):
+        return self.infos[self._locate(max(row, 1))[1]].name
+
+    def rowAfter(self, t, right=True):
+        """Return the first replay row whose (shifted) EPOCH_TIME is > t, or >= t
+        if right is False"""
+        cycle = int(math.floor((t - self.first) / self.period))
+        if cycle < 0:
+            return 1
+        t -= cycle*self.period
+        base = cycle*self.totalRows
+        for i, info in enumerate(self.infos):
+            fileTime = t - self.shifts[i]
+            if fileTime < info.first:
+                return base + self.offsets[i] + 1
+            if fileTime <= info.last:
+                return base + self.offsets[i] + info.findRow(fileTime, right)
+        return base + self.totalRows + 1
+
+    def read(self, lo, hi, columns):
+        """Return the data of replay rows lo (inclusive) to hi (exclusive)"""
+        data = dict((col, []) for col in columns)
+        row = lo
+        while row < hi:
+            cycle, i, fileRow = self._locate(row)
+            info = self.infos[i]
+            n = min(hi - row, info.rows - fileRow + 1)
+            nRows, fileData = info.readRows(fileRow, fileRow + n, columns)
+            shift = cycle*self.period + self.shifts[i]
+            for col in columns:
+                if col == "EPOCH_TIME" and shift:
+                    data[col].extend([t + shift for t in fileData[col]])
+                else:
+                    data[col].extend(fileData[col])
+            if nRows < n:
+                # Skip a malformed line instead of stopping the replay
+                nRows += 1
+            row += nRows
+        return data
+
+    def openSession(self, sessionId, speed):
+        """Return the session called sessionId, or None if there is no such
+        session (any more). A sessionId of None opens a new session, starting
+        at the beginning of the recording."""
+        now = time.time()
+        with self.lock:
+            # Sessions are kept in the order of their last use
+            sessions = self.sessions
+            while sessions and now - next(iter(sessions.values())).lastUsed > self.sessionTimeout:
+                sessions.popitem(last=False)
+            if sessionId is None:
+                session = ReplaySession(uuid.uuid4().hex, speed if speed is not None else 1.0,
+                                        self.first, 1, now)
+                while len(sessions) >= self.maxSessions:
+                    sessions.popitem(last=False)
+            else:
+                session = sessions.pop(sessionId, None)
+                if session is None:
+                    return None
+            session.lastUsed = now
+            sessions[session.sessionId] = session
+            return session
+
+    def setSpeed(self, session, speed, now=None):
+        """Change the speed of a session without moving its clock"""
+        now = now if now is not None else time.time()
+        if session.speed > 0:
+            session.dataStart = session.clock(now)
+        session.wallStart = now
+        session.speed = speed
+
+    def seek(self, session, t, now=None):
+        """Move the session clock to data time t. Returns the replay row to
+        continue from."""
+        session.dataStart = t
+        session.wallStart = now if now is not None else time.time()
+        session.anchorRow = self.rowAfter(t, right=False)
+        return session.anchorRow
+
+    def poll(self, session, startRow, columns, now=None):
+        """Return (nextRow, clock, data) with the rows due for session from
+        startRow onwards; startRow < 1 starts from the session's anchor."""
+        now = now if now is not None else time.time()
+        if startRow is None or startRow < 1:
+            startRow = session.anchorRow
+        hi = startRow + self.maxBatch
+        clock = None
+        if session.speed > 0:
+            clock = session.clock(now)
+            hi = min(hi, self.rowAfter(clock))
+        if hi <= startRow:
+            return startRow, clock, dict((col, []) for col in columns)
+        data = self.read(startRow, hi, columns)
+        if session.speed <= 0 and data.get("EPOCH_TIME"):
+            # Keep the clock with the delivered rows so that a later speed change continues from there
+            session.dataStart = data["EPOCH_TIME"][-1]
+            session.wallStart = now
+        return hi, clock, data
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+#
+# File Name: ResponseCache.py
+# Purpose: Share serialised series responses between clients polling the same rows.
+# Notes:
+#               Browsers polling the series API mostly ask for the same startRow (the next_row of the
+#               previous answer) at about the same time. The cache keeps the encoded (and compressed)
+#               bodies of recent answers, keyed by the request, for one generation of the data: the
+#               file name, next sequence number and alarm register. When the ingest thread adds rows
+#               or the alarm changes the generation changes and every entry is dropped. Entries are
+#               evicted least recently used first to stay under a size limit in bytes.
+#
+#               Concurrent requests for a key which is not cached yet wait for the first one to
+#               compute it, so a burst of identical polls is serialised once.
+#
+
+"""Generation-scoped LRU cache of encoded responses.
+
+class:
+
+ResponseCache -- byte-limited LRU of response bodies for the current
+                 data generation, computing each missing entry once.
+"""
+from collections import OrderedDict
+from threading import Event, Lock
+
+
+class ResponseCache(object):
+    """Values are tuples whose first item is the body string; its length is
+    what counts against maxBytes. maxBytes 0 disables the cache."""
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.pending = {}
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _reset(self, generation):
+        self.entries.clear()
+        self.size = 0
+        self.generation = generation
+
+    def get(self, generation, key, compute):
+        """Return the value of key in generation, calling compute() to make it
+        if it is not cached and no other thread is already doing so."""
+        if self.maxBytes <= 0:
+            return compute()
+        while True:
+            with self.lock:
+                if generation != self.generation:
+                    self._reset(generation)
+                value = self.entries.pop(key, None)
+                if value is not None:
+                    self.entries[key] = value
+                    self.hits += 1
+                    return value
+                waiting = self.pending.get((generation, key))
+                if waiting is None:
+                    done = self.pending[(generation, key)] = Event()
+                    self.misses += 1
+                    break
+            waiting.wait()
+        try:
+            value = compute()
+            with self.lock:
+                if generation == self.generation and len(value[0]) <= self.maxBytes:
+                    self.entries[key] = value
+                    self.size += len(value[0])
+                    while self.size > self.maxBytes:
+                        oldKey, old = self.entries.popitem(last=False)
+                        self.size -= len(old[0])
+                        self.evictions += 1
+            return value
+        finally:
+            with self.lock:
+                del self.pending[(generation, key)]
+            done.set()
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.size, "max_bytes": self.maxBytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+#
+# File Name: RollingStats.py
+# Purpose: Sliding window mean, standard deviation, min/max and baseline of the gas concentrations.
+# Notes:
+#               The ingest path feeds every parsed sample to the windows (e.g. the last 1, 5 and 15
+#               minutes of EPOCH_TIME). Each update is O(1) amortized, without ever rescanning a window:
+#                   mean and standard deviation are kept with Welford's update, applied in reverse for
+#                   the samples which leave the window;
+#                   min and max are the heads of monotonic deques, from which a sample is dropped as
+#                   soon as a newer one makes it irrelevant;
+#                   the baseline is the minimum, over the window, of the means of fixed time buckets
+#                   (e.g. 10 s), kept in a monotonic deque as well, so that single low samples do not
+#                   pull it down.
+#               Windows slide with the time of the newest sample, not the wall clock, so replayed data
+#               gives the same statistics as live data. NaN samples are ignored.
+#
+
+"""Rolling statistics of sample columns.
+
+class:
+
+RollingWindow -- statistics of one column over the last seconds of
+                 samples.
+
+RollingStats -- the windows of several columns, fed by blocks of rows,
+                with a compact snapshot for the stats API.
+
+SnapshotFile -- hands snapshots from the ingest process to the WSGI
+                workers through a small JSON file.
+"""
+from collections import deque
+import json
+import math
+import os
+
+# Fields of each window in a snapshot
+STATS_FIELDS = ("n", "mean", "std", "min", "max", "baseline")
+
+
+def _compact(value):
+    """Round to 7 significant digits, which keeps snapshots short"""
+    if value is None or value != value:
+        return None
+    return float("%.7g" % value)
+
+
+class RollingWindow(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = deque()
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.mins = deque()
+        self.maxs = deque()
+        self.baselines = deque()
+
+    def add(self, t, x):
+        self.samples.append((t, x))
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+        mins = self.mins
+        while mins and mins[-1][1] >= x:
+            mins.pop()
+        mins.append((t, x))
+        maxs = self.maxs
+        while maxs and maxs[-1][1] <= x:
+            maxs.pop()
+        maxs.append((t, x))
+        self.expire(t)
+
+    def addBaseline(self, t, x):
+        """Add the mean x of the bucket which ended at time t"""
+        baselines = self.baselines
+        while baselines and baselines[-1][1] >= x:
+            baselines.pop()
+        baselines.append((t, x))
+
+    def expire(self, now):
+        """Drop the samples at or before now - seconds"""
+        cutoff = now - self.seconds
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            t, x = samples.popleft()
+            if self.n == 1:
+                self.n = 0
+                self.mean = self.m2 = 0.0
+            else:
+                d = x - self.mean
+                self.mean -= d / (self.n - 1)
+                self.m2 = max(0.0, self.m2 - d * (x - self.mean))
+                self.n -= 1
+        for queue in (self.mins, self.maxs, self.baselines):
+            while queue and queue[0][0] <= cutoff:
+                queue.popleft()
+
+    def values(self):
+        """Return [n, mean, std, min, max, baseline]; None for the values of an
+        empty window and for the baseline until a bucket has ended in it"""
+        if self.n == 0:
+            return [0, None, None, None, None, None]
+        std = math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else 0.0
+        baseline = self.baselines[0][1] if self.baselines else None
+        return [self.n, _compact(self.mean), _compact(std), _compact(self.mins[0][1]),
+                _compact(self.maxs[0][1]), _compact(baseline)]
+
+
+class ColumnStats(object):
+    """The windows of one column and the bucket means feeding their baselines"""
+    def __init__(self, windows, bucket):
+        self.windows = [RollingWindow(seconds) for seconds in windows]
+        self.bucket = bucket
+        self.bucketEnd = None
+        self.bucketSum = 0.0
+        self.bucketCount = 0
+
+    def add(self, t, x):
+        if self.bucketEnd is None:
+            self.bucketEnd = (math.floor(t / self.bucket) + 1) * self.bucket
+        elif t >= self.bucketEnd:
+            if self.bucketCount:
+                mean = self.bucketSum / self.bucketCount
+                for window in self.windows:
+                    window.addBaseline(self.bucketEnd, mean)
+            self.bucketEnd = (math.floor(t / self.bucket) + 1) * self.bucket
+            self.bucketSum = 0.0
+            self.bucketCount = 0
+        self.bucketSum += x
+        self.bucketCount += 1
+        for window in self.windows:
+            window.add(t, x)
+
+
+class RollingStats(object):
+    """Rolling statistics of columns over windows (in seconds) of the time
+    column, with baselines from bucket (seconds) means"""
+    def __init__(self, columns, windows=(60, 300, 900), bucket=10.0, timeColumn="EPOCH_TIME"):
+        self.columns = tuple(columns)
+        self.windows = tuple(windows)
+        self.bucket = bucket
+        self.timeColumn = timeColumn
+        self.stats = dict((col, ColumnStats(self.windows, bucket)) for col in self.columns)
+        self.lastTime = None
+        self.rows = 0
+
+    def addColumns(self, data, nRows):
+        """Feed nRows rows of data (a dict of column sequences)"""
+        times = data.get(self.timeColumn)
+        if times is None or nRows == 0:
+            return
+        for col in self.columns:
+            values = data.get(col)
+            if values is None:
+                continue
+            stats = self.stats[col]
+            for t, x in zip(times[:nRows], values[:nRows]):
+                if x == x and t == t:
+                    stats.add(t, x)
+        t = times[nRows - 1]
+        if t == t:
+            self.lastTime = float(t)
+            for stats in self.stats.values():
+                for window in stats.windows:
+                    window.expire(self.lastTime)
+        self.rows += nRows
+
+    def snapshot(self):
+        """Return {"time", "windows", "fields", column: [values per window]}"""
+        result = {"time": self.lastTime, "windows": list(self.windows), "fields": list(STATS_FIELDS)}
+        for col in self.columns:
+            result[col] = [window.values() for window in self.stats[col].windows]
+        return result
+
+
+class SnapshotFile(object):
+    """write() replaces the file atomically; read() only parses it again
+    when it has changed since the last read"""
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.signature = None
+        self.snapshot = None
+
+    def write(self, snapshot):
+        temp = "%s.%d.tmp" % (self.fileName, os.getpid())
+        fp = open(temp, "w")
+        try:
+            json.dump(snapshot, fp, separators=(",", ":"))
+        finally:
+            fp.close()
+        os.rename(temp, self.fileName)
+
+    def read(self):
+        try:
+            st = os.stat(self.fileName)
+        except OSError:
+            return None
+        signature = (st.st_mtime, st.st_size, st.st_ino)
+        if signature != self.signature:
+            try:
+                self.snapshot = json.load(open(self.fileName))
+                self.signature = signature
+            except (IOError, ValueError):
+                pass
+        return self.snapshot
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#
+# File Name: SeriesFormat.py
+# Purpose: Compact binary encoding of series API results, as an alternative to JSON.
+# Notes:
+#               Layout (all integers little-endian):
+#                   4 bytes     magic "BPK1"
+#                   uint32      length H of the JSON header
+#                   H bytes     JSON header: every key of the result except "data", plus "columns",
+#                               a list of {"name", "dtype", "length"} in the order the blocks follow
+#                   padding     spaces to the next multiple of 8 bytes
+#                   blocks      one little-endian float64 or float32 block per column, each padded
+#                               to a multiple of 8 bytes
+#               Every block starts at a multiple of 8, so the browser can wrap it in a Float64Array or
+#               Float32Array without copying. EPOCH_TIME is always sent as float64: float32 would round
+#               present-day epoch times to about two minutes.
+#
+
+"""Binary encoding of series results.
+
+function:
+
+encodeSeries(result, dtype) -- encode a getData/getRange result as a
+                header followed by one typed array per column.
+"""
+from array import array
+import json
+import struct
+import sys
+
+MAGIC = "BPK1"
+TYPECODES = {"float64": "d", "float32": "f"}
+# Columns that must keep double precision whatever dtype is requested
+DOUBLE_COLUMNS = ("EPOCH_TIME",)
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def encodeSeries(result, dtype="float64"):
+    """Return the binary encoding of result as a string"""
+    data = result.get("data", {})
+    header = dict((k, v) for k, v in result.items() if k != "data")
+    header["columns"] = []
+    blocks = []
+    for name in sorted(data):
+        colType = "float64" if name in DOUBLE_COLUMNS else dtype
+        values = array(TYPECODES[colType], data[name])
+        if sys.byteorder != "little":
+            values.byteswap()
+        block = values.tostring()
+        header["columns"].append({"name": name, "dtype": colType, "length": len(values)})
+        blocks.append(block + "\0"*_pad(len(block)))
+    headerText = json.dumps(header)
+    headerText += " "*_pad(8 + len(headerText))
+    return MAGIC + struct.pack("<I", len(headerText)) + headerText + "".join(blocks)
@@ -0,0 +1,328 @@
+#!/usr/bin/python
+#
+# File Name: SeriesRing.py
+# Purpose: Bounded, columnar in-memory buffer of the most recent DataLog samples.
+# Notes:
+#               Samples are numbered with a sequence number which starts at 1 and never goes back,
+#               even when the analyzer rotates to a new DataLog file. Clients use it as their cursor.
+#               The status records the file being ingested and the sequence number of its first
+#               sample, so a client can tell which of the samples it got came from the previous file.
+#
+#               SharedSeriesRing keeps the same data in a memory-mapped file so that the WSGI worker
+#               processes can read what a single ingest process writes. Its layout (little-endian) is
+#                   0   4s      magic "BPKR"
+#                   4   uint32  layout version
+#                   8   uint32  capacity
+#                   12  uint32  number of columns
+#                   16  uint64  generation, odd while the writer is updating
+#                   24  uint64  next sequence number
+#                   32  uint32  alarm register
+#                   36  uint32  length of the file name
+#                   40  256s    name of the DataLog file being ingested
+#                   296 uint64  sequence number of the first sample of that file
+#                   304 32s     name of each column
+#               followed, at the next multiple of 8, by capacity float64 values for each column.
+#               Readers retry when the generation is odd or changes while they copy (a seqlock), so
+#               the writer never waits for them. A writer which was killed in the middle of an update
+#               leaves the generation odd; the owner rounds it up to even when it reopens the ring, and
+#               every update makes it odd whatever its value, so it can never stay even during one.
+#               Readers back off while they retry and give up with an IOError after readTimeout seconds
+#               instead of spinning on a ring whose writer died.
+#
+
+"""Columnar ring buffer of recent samples.
+
+class:
+
+SeriesRing -- fixed capacity store of float columns addressed by a
+              monotonically increasing sequence number.
+
+SharedSeriesRing -- the same interface over a memory-mapped file shared
+                    between processes.
+"""
+from array import array
+import mmap
+import os
+import struct
+import sys
+import time
+from threading import Condition, Lock
+
+
+class SeriesRing(object):
+    """Keeps the last capacity samples of each column in a circular array('d').
+
+    The ingest thread appends samples with appendColumns(); request handlers read
+    with since(), which only copies the slice the client has not seen yet,
+    and can block in waitFor() until there is something new.
+    """
+    def __init__(self, columns, capacity):
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.store = dict((col, array('d', [0.0])*capacity) for col in self.columns)
+        self.nextSeq = 1
+        self.alarm = 0
+        self.fileName = None
+        self.fileStart = 1
+        self.lock = Lock()
+        self.changed = Condition(self.lock)
+
+    def setStatus(self, alarm, fileName, fileStart=None):
+        """Record the alarm register and file name that go with the samples and,
+        if it is given, the sequence number of the first sample of the file"""
+        self.alarm = alarm
+        self.fileName = fileName
+        if fileStart is not None:
+            self.fileStart = fileStart
+
+    def status(self):
+        """Return (alarm, fileName)"""
+        return self.alarm, self.fileName
+
+    def firstSeq(self):
+        """Sequence number of the oldest sample still held in the buffer"""
+        return max(1, self.nextSeq - self.capacity)
+
+    def appendColumns(self, data, nRows):
+        """Append nRows samples given as a dict mapping each column to a sequence of floats"""
+        with self.lock:
+            seq = self.nextSeq
+            skip = max(0, nRows - self.capacity)
+            for col in self.columns:
+                values = self.store[col]
+                pos = (seq + skip) % self.capacity
+                for val in data[col][skip:nRows]:
+                    values[pos] = val
+                    pos += 1
+                    if pos == self.capacity:
+                        pos = 0
+            self.nextSeq = seq + nRows
+            if nRows:
+                self.changed.notify_all()
+
+    def tick(self):
+        """Wake all waiters so that they can check their deadlines. Called by the
+        ingest thread once per cycle."""
+        with self.lock:
+            self.changed.notify_all()
+
+    def waitFor(self, seq, deadline):
+        """Block until there are samples at or after seq, or time.time() passes
+        deadline. Returns True if there are. Waiters sleep on a condition without
+        a timeout (which would poll in Python 2) and are woken by appendColumns()
+        and tick()."""
+        with self.lock:
+            while seq == self.nextSeq and time.time() < deadline:
+                self.changed.wait()
+            return seq != self.nextSeq
+
+    def since(self, seq, columns=None):
+        """Return (nextSeq, data) where data maps each column to the list of
+        samples from seq onwards. A cursor older than the buffer, or one from
+        the future (e.g. after a server restart) starts from the oldest sample."""
+        if columns is None:
+            columns = self.columns
+        with self.lock:
+            nextSeq = self.nextSeq
+            firstSeq = self.firstSeq()
+            if seq < firstSeq or seq > nextSeq:
+                seq = firstSeq
+            start = seq % self.capacity
+            end = nextSeq % self.capacity
+            data = {}
+            for col in columns:
+                values = self.store[col]
+                if seq == nextSeq:
+                    data[col] = []
+                elif start < end:
+                    data[col] = values[start:end].tolist()
+                else:
+                    data[col] = values[start:].tolist() + values[:end].tolist()
+        return nextSeq, data
+
+
+HEADER = struct.Struct("<4sIIIQQII256sQ")
+MAGIC = "BPKR"
+VERSION = 2
+COLUMN_NAME_SIZE = 32
+GENERATION_OFFSET = 16
+
+
+class SharedSeriesRing(object):
+    """SeriesRing stored in a memory-mapped file.
+
+    Exactly one process (the ingest owner) opens it with create=True and
+    appends; any number of processes open it read-only and call since().
+    The owner reuses an existing file with the same capacity and columns,
+    so sequence numbers keep increasing across its restarts; the status
+    (file name and fileStart) tells it where to resume ingesting.
+    """
+    def __init__(self, fileName, columns, capacity, create=False, pollInterval=0.1, readTimeout=1.0):
+        self.path = fileName
+        self.columns = tuple(columns)
+        self.capacity = capacity
+        self.pollInterval = pollInterval
+        self.readTimeout = readTimeout
+        self.dataOffset = HEADER.size + COLUMN_NAME_SIZE*len(self.columns)
+        self.dataOffset += (8 - self.dataOffset % 8) % 8
+        size = self.dataOffset + 8*capacity*len(self.columns)
+        if create:
+            if not self._compatible(fileName, size):
+                fp = open(fileName, "wb")
+                fp.write(HEADER.pack(MAGIC, VERSION, capacity, len(self.columns), 0, 1, 0, 0, "", 1))
+                for col in self.columns:
+                    fp.write(struct.pack("%ds" % COLUMN_NAME_SIZE, col))
+                fp.truncate(size)
+                fp.close()
+            self.fp = open(fileName, "r+b")
+            self.mm = mmap.mmap(self.fp.fileno(), size)
+            generation = struct.unpack_from("<Q", self.mm, GENERATION_OFFSET)[0]
+            if generation % 2:
+                # The previous owner died in the middle of an update
+                self._endWrite(generation + 1)
+        else:
+            if not self._compatible(fileName, size):
+                raise ValueError("Shared ring %s does not match the configured columns and capacity" % fileName)
+            self.fp = open(fileName, "rb")
+            self.mm = mmap.mmap(self.fp.fileno(), size, access=mmap.ACCESS_READ)
+        self.lock = Lock()
+
+    def _compatible(self, fileName, size):
+        if not os.path.exists(fileName) or os.path.getsize(fileName) != size:
+            return False
+        fp = open(fileName, "rb")
+        try:
+            head = fp.read(HEADER.size + COLUMN_NAME_SIZE*len(self.columns))
+        finally:
+            fp.close()
+        magic, version, capacity, nColumns = HEADER.unpack(head[:HEADER.size])[:4]
+        names = [head[HEADER.size + i*COLUMN_NAME_SIZE:HEADER.size + (i + 1)*COLUMN_NAME_SIZE].rstrip("\0")
+                 for i in range(nColumns)]
+        return (magic == MAGIC and version == VERSION and capacity == self.capacity and
+                tuple(names) == self.columns)
+
+    def close(self):
+        self.mm.close()
+        self.fp.close()
+
+    def _header(self):
+        return HEADER.unpack(self.mm[:HEADER.size])
+
+    @property
+    def nextSeq(self):
+        return self._header()[5]
+
+    def firstSeq(self):
+        return max(1, self.nextSeq - self.capacity)
+
+    @property
+    def fileStart(self):
+        return self._header()[9]
+
+    def _beginWrite(self):
+        """Make the generation odd for the update; returns the even generation
+        to end it with"""
+        generation = struct.unpack_from("<Q", self.mm, GENERATION_OFFSET)[0] | 1
+        struct.pack_into("<Q", self.mm, GENERATION_OFFSET, generation)
+        return generation + 1
+
+    def _endWrite(self, generation):
+        struct.pack_into("<Q", self.mm, GENERATION_OFFSET, generation)
+
+    def _writeValues(self, col, pos, values):
+        base = self.dataOffset + 8*self.capacity*self.columns.index(col)
+        if sys.byteorder != "little":
+            values.byteswap()
+        raw = values.tostring()
+        first = min(len(raw), 8*(self.capacity - pos))
+        self.mm[base + 8*pos:base + 8*pos + first] = raw[:first]
+        if first < len(raw):
+            self.mm[base:base + len(raw) - first] = raw[first:]
+
+    def appendColumns(self, data, nRows):
+        with self.lock:
+            seq = self.nextSeq
+            skip = max(0, nRows - self.capacity)
+            generation = self._beginWrite()
+            for col in self.columns:
+                self._writeValues(col, (seq + skip) % self.capacity, array('d', data[col][skip:nRows]))
+            struct.pack_into("<Q", self.mm, 24, seq + nRows)
+            self._endWrite(generation)
+
+    def setStatus(self, alarm, fileName, fileStart=None):
+        with self.lock:
+            name = fileName or ""
+            if isinstance(name, unicode):
+                name = name.encode("utf-8")
+            name = name[:256]
+            generation = self._beginWrite()
+            struct.pack_into("<II256s", self.mm, 32, alarm, len(name), name)
+            if fileStart is not None:
+                struct.pack_into("<Q", self.mm, 296, fileStart)
+            self._endWrite(generation)
+
+    def _read(self, read):
+        """Return read(header) from a header and data which were not being
+        updated while read ran (a seqlock). Retries with a growing sleep and
+        raises IOError after readTimeout seconds of failed attempts."""
+        delay = 0.0
+        deadline = None
+        while True:
+            header = self._header()
+            generation = header[4]
+            if generation % 2 == 0:
+                result = read(header)
+                if struct.unpack_from("<Q", self.mm, GENERATION_OFFSET)[0] == generation:
+                    return result
+            if deadline is None:
+                deadline = time.time() + self.readTimeout
+            elif time.time() > deadline:
+                raise IOError("Shared ring %s is still being updated after %.1f s" % (self.path, self.readTimeout))
+            time.sleep(delay)
+            delay = min(2*delay or 0.0001, 0.01)
+
+    def status(self):
+        def read(header):
+            alarm, nameLength, name = header[6:9]
+            return alarm, (name[:nameLength] if nameLength else None)
+        return self._read(read)
+
+    def tick(self):
+        pass
+
+    def waitFor(self, seq, deadline):
+        """Poll the shared sequence number every pollInterval seconds; there is
+        no condition variable shared between processes."""
+        while seq == self.nextSeq and time.time() < deadline:
+            time.sleep(min(self.pollInterval, max(0.0, deadline - time.time())))
+        return seq != self.nextSeq
+
+    def _readValues(self, col, start, end):
+        base = self.dataOffset + 8*self.capacity*self.columns.index(col)
+        values = array('d')
+        if start < end:
+            values.fromstring(self.mm[base + 8*start:base + 8*end])
+        else:
+            values.fromstring(self.mm[base + 8*start:base + 8*self.capacity])
+            values.fromstring(self.mm[base:base + 8*end])
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values.tolist()
+
+    def since(self, seq, columns=None):
+        if columns is None:
+            columns = self.columns
+        def read(header):
+            nextSeq = header[5]
+            start = seq
+            firstSeq = max(1, nextSeq - self.capacity)
+            if start < firstSeq or start > nextSeq:
+                start = firstSeq
+            data = {}
+            for col in columns:
+                if start == nextSeq:
+                    data[col] = []
+                else:
+                    data[col] = self._readValues(col, start % self.capacity, nextSeq % self.capacity)
+            return nextSeq, data
+        return self._read(read)
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#
+# File Name: ServerLog.py
+# Purpose: Buffered, level-controlled logging for the backpack server.
+# Notes:
+#               Request handlers used to print to stdout, which blocks the request thread whenever the
+#               console or pipe is slow. Log calls now only put the record on a bounded queue; a writer
+#               thread formats the queued records and writes them in batches. Records below the level
+#               are discarded by the logging module before anything is formatted, and when the queue is
+#               full (the output cannot keep up) further records are dropped and counted instead of
+#               blocking the caller.
+#
+#               The handler is installed on the root logger, so the modules of the server (and the
+#               Werkzeug request log of the development server) all go through it.
+#
+
+"""Buffered logging.
+
+class:
+
+BufferedLogHandler -- logging handler which queues records for a
+                      writer thread.
+
+function:
+
+configureLogging(level, fileName) -- install (once per process) or
+                retune the handler and set the level of the root logger.
+
+asLogLevel(text, where) -- ConfigSnapshot converter of a level name such
+                as "INFO" to its number.
+"""
+import atexit
+import logging
+import Queue
+import sys
+from threading import Thread
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class BufferedLogHandler(logging.Handler):
+    """Writes to stream, from a writer thread, at most maxBatch records per
+    write. capacity bounds the number of queued records."""
+    def __init__(self, stream, capacity=10000, maxBatch=500):
+        logging.Handler.__init__(self)
+        self.stream = stream
+        self.queue = Queue.Queue(capacity)
+        self.maxBatch = maxBatch
+        self.dropped = 0
+        self.written = 0
+        self.writer = Thread(target=self._writeLoop, name="LogWriter")
+        self.writer.setDaemon(True)
+        self.writer.start()
+
+    def emit(self, record):
+        if record.exc_info:
+            # Format the traceback now, while its frames are still what they were
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _writeLoop(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while len(records) < self.maxBatch:
+                    records.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            if None in records:
+                records = records[:records.index(None)]
+                self._write(records)
+                return
+            self._write(records)
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + "\n")
+            except Exception:
+                self.dropped += 1
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+            self.written += len(lines)
+        except Exception:
+            self.dropped += len(lines)
+
+    def close(self):
+        """Write the queued records and stop the writer thread"""
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(5.0)
+        logging.Handler.close(self)
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped,
+                "level": logging.getLevelName(logging.getLogger().level)}
+
+
+_handler = None
+
+
+def asLogLevel(text, where):
+    level = logging.getLevelName(text.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError("Not a log level: %s" % text)
+    return level
+
+
+def configureLogging(level, fileName=""):
+    """Install the buffered handler on the root logger, writing to fileName
+    (appending) or to stderr if it is empty, and set the level. Later calls
+    only change the level. Returns the handler."""
+    global _handler
+    if _handler is None:
+        stream = open(fileName, "a") if fileName else sys.stderr
+        _handler = BufferedLogHandler(stream)
+        _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logging.getLogger().addHandler(_handler)
+        atexit.register(_handler.close)
+    logging.getLogger().setLevel(level)
+    return _handler
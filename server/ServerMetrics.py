@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# File Name: ServerMetrics.py
+# Purpose: The metrics of the backpack server, shared by the server core and its HTTP API.
+# Notes:
+#               backpackServer0.py (ingest, alarms, replay) and backpackApi.py (the Flask resources)
+#               both update these metrics. They live in a module of their own so that both use the
+#               same registry, also when backpackServer0.py is run as a script, where it is loaded as
+#               __main__ and not under its module name.
+#
+#               The gauges read the server given to watchServer(); they are left out of the metrics
+#               until it is called.
+#
+
+"""Metrics of the backpack server.
+
+function:
+
+watchServer(server) -- set the BackpackServer read by the gauges.
+
+countRows(endpoint, result) -- count the rows of a series result as
+                served on endpoint.
+"""
+from Metrics import MetricsRegistry
+
+_server = None
+
+# Metrics served by /api/v1.0/metrics. They are per process; WSGI workers each report their own requests.
+metrics = MetricsRegistry("backpack_")
+STAGE_SECONDS = metrics.summary("stage_seconds", "Time spent in each stage of ingesting and serving data",
+                                ("stage",))
+REQUEST_SECONDS = metrics.histogram("request_duration_seconds", "Time to the response headers by endpoint",
+                                    ("endpoint",))
+RESPONSES = metrics.counter("responses_total", "Responses by endpoint and status code", ("endpoint", "status"))
+RESPONSE_BYTES = metrics.counter("response_bytes_total", "Bytes of response bodies sent, after compression",
+                                 ("endpoint",))
+ROWS_SERVED = metrics.counter("rows_served_total", "Data rows returned to clients", ("endpoint",))
+ROWS_INGESTED = metrics.counter("rows_ingested_total", "DataLog rows parsed into the series buffer")
+FILES_ARCHIVED = metrics.counter("files_archived_total", "DataLog files converted to archives")
+
+
+def watchServer(server):
+    global _server
+    _server = server
+
+
+def seriesGauge():
+    if _server is None or _server.series is None:
+        return None
+    return _server.series
+
+
+def alarmRegister():
+    series = seriesGauge()
+    try:
+        return series and series.status()[0]
+    except IOError:     # a shared ring left mid-update by a dead ingest process
+        return None
+
+
+def cacheLookups():
+    cache = _server.response_cache if _server is not None else None
+    return [(("hit",), cache.hits), (("miss",), cache.misses)] if cache is not None else None
+
+
+def startupPhases():
+    if _server is None or not _server.startup:
+        return None
+    return [((phase,), seconds) for phase, seconds in sorted(_server.startup.items())]
+
+
+metrics.gauge("series_next_row", "Next row number of the series buffer",
+              lambda: seriesGauge() and seriesGauge().nextSeq)
+metrics.gauge("alarm_register", "Alarm register of the series buffer", alarmRegister)
+metrics.gauge("response_cache_lookups", "Response cache hits and misses since start", cacheLookups, ("result",))
+metrics.gauge("log_records_dropped", "Log records dropped because the log writer could not keep up",
+              lambda: _server.log_handler.dropped if _server and _server.log_handler else None)
+metrics.gauge("startup_seconds", "Seconds from the start of the process to each startup phase",
+              startupPhases, ("phase",))
+
+
+def countRows(endpoint, result):
+    """Count the rows of a series result as served on endpoint; returns the count"""
+    data = result.get("data") if isinstance(result, dict) else None
+    nRows = len(data.get("EPOCH_TIME", ())) if data else 0
+    ROWS_SERVED.inc(nRows, endpoint)
+    return nRows
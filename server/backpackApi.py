@@ -0,0 +1,332 @@
+#!/usr/bin/python
+#
+# File Name: backpackApi.py
+# Purpose: The Flask app and REST resources serving a BackpackServer over HTTP.
+# Notes:
+#               backpackServer0.py holds the data side of the server (ingest, alarms, replay,
+#               simulation) and does not import Flask or Flask-RESTful. This module is only imported
+#               by the app factories there (createApp, createWsgiApp) or by the script when it starts
+#               the development server, so an ingest process (-i) and tools which only need the data
+#               side never pay for loading the web framework.
+#
+#               createApp(server) builds a new app every time it is called; the resources serve the
+#               server given to the last call.
+#
+
+"""HTTP API of the backpack server.
+
+function:
+
+createApp(server) -- build the Flask app serving server, a BackpackServer
+                which has been run().
+"""
+import json
+import logging
+import sys
+import time
+import zlib
+
+from flask import abort, Flask, g, request, Response, stream_with_context, url_for
+from flask_restful import Api, reqparse, Resource
+from flask_restful.representations.json import output_json
+
+from SeriesFormat import encodeSeries
+from ServerMetrics import (metrics, countRows, watchServer, REQUEST_SECONDS, RESPONSE_BYTES, RESPONSES,
+                           ROWS_SERVED, STAGE_SECONDS)
+
+# Commands of the control API
+CONTROL_COMMANDS = ("shutdown", "restartUserlog", "about")
+
+# Response formats of the series and range APIs, selected by format= or the Accept header
+SERIES_FORMATS = {"json": ("application/json", None),
+                  "binary": ("application/x-backpack-series", "float64"),
+                  "binary32": ("application/x-backpack-series-f32", "float32")}
+
+log = logging.getLogger("backpackServer")
+
+backpack_server = None
+
+def negotiateFormat(fmt):
+    """Return fmt or, if it is None, the series format which best matches the
+    Accept header"""
+    if fmt not in SERIES_FORMATS:
+        mimetypes = dict((mimetype, name) for name, (mimetype, dtype) in SERIES_FORMATS.items())
+        best = request.accept_mimetypes.best_match(["application/json"] + sorted(mimetypes))
+        fmt = mimetypes.get(best, "json")
+    return fmt
+
+def seriesResponse(result, fmt):
+    """Return result in the format named by fmt or, if it is None, the best match
+    for the Accept header. JSON is left to Flask-RESTful."""
+    mimetype, dtype = SERIES_FORMATS[negotiateFormat(fmt)]
+    if dtype is None:
+        return result
+    with STAGE_SECONDS.time("serialize"):
+        body = encodeSeries(result, dtype)
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+def acceptedEncoding():
+    """Return the compression to use for the client, "gzip", "deflate" or None"""
+    accepted = request.accept_encodings
+    if accepted['gzip']:
+        return 'gzip'
+    elif accepted['deflate']:
+        return 'deflate'
+    return None
+
+def compressBody(body, encoding):
+    with STAGE_SECONDS.time("compress"):
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(backpack_server.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(backpack_server.compress_level)
+        return compressor.compress(body) + compressor.flush()
+
+def seriesETag(name, nextRow, alarm):
+    return "%d-%d-%08x" % (nextRow, alarm, zlib.crc32(name or "") & 0xffffffff)
+
+def cachedSeriesResponse(startRow, timeout, maxPoints, fmt):
+    """Serve the series API from the shared response cache. A client which
+    already has every row (startRow is the next row) and sends the ETag of
+    its last answer gets 304 Not Modified."""
+    fmt = negotiateFormat(fmt)
+    backpack_server.waitSeries(startRow, timeout)
+    state = backpack_server.seriesState()
+    name, nextRow, alarm = state
+    if name is not None and startRow == nextRow and seriesETag(*state) in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(seriesETag(*state))
+        return response
+    mimetype, dtype = SERIES_FORMATS[fmt]
+    encoding = acceptedEncoding() if dtype is None else None
+
+    def compute():
+        result = backpack_server.getData(startRow, maxPoints)
+        data = result.get('data')
+        nRows = len(data['EPOCH_TIME']) if data else 0
+        with STAGE_SECONDS.time("serialize"):
+            if dtype is None:
+                body = json.dumps(result)
+            else:
+                body = encodeSeries(result, dtype)
+        contentEncoding = None
+        if encoding is not None and len(body) >= backpack_server.compress_min_size:
+            body = compressBody(body, encoding)
+            contentEncoding = encoding
+        return body, contentEncoding, seriesETag(result.get('file_name'), result.get('next_row', 0),
+                                                 result.get('alarm', 0)), nRows
+    body, contentEncoding, etag, nRows = backpack_server.response_cache.get(
+        state, (startRow, maxPoints, fmt, encoding), compute)
+    ROWS_SERVED.inc(nRows, "series")
+    response = Response(body, mimetype=mimetype)
+    if contentEncoding is not None:
+        response.headers['Content-Encoding'] = contentEncoding
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    response.vary.add('Accept-Encoding')
+    return response
+
+def outputJson(data, code, headers=None):
+    with STAGE_SECONDS.time("serialize"):
+        return output_json(data, code, headers)
+
+def startRequestTimer():
+    g.request_start = time.time()
+
+def checkConfig():
+    """A worker has no ingest thread to reload the config file, so it checks
+    the file on requests, at most every [Setup] Config_Check_Interval seconds"""
+    if backpack_server.role == "worker":
+        backpack_server.checkConfig()
+
+def recordRequest(response):
+    endpoint = request.endpoint or "none"
+    start = getattr(g, "request_start", None)
+    if start is not None:
+        REQUEST_SECONDS.observe(time.time() - start, endpoint)
+    RESPONSES.inc(1, endpoint, response.status_code)
+    if not response.is_streamed:
+        RESPONSE_BYTES.inc(response.content_length or 0, endpoint)
+    if "first_request" not in backpack_server.startup:
+        backpack_server.markStartup("first_request")
+    return response
+
+def compressResponse(response):
+    """gzip or deflate JSON responses for clients that accept it"""
+    if (response.mimetype != 'application/json' or response.direct_passthrough or
+            response.is_streamed or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < backpack_server.compress_min_size:
+        return response
+    encoding = acceptedEncoding()
+    if encoding is None:
+        return response
+    response.set_data(compressBody(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+class SeriesAPI(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('startRow', type=int, required=True)
+        parser.add_argument('timeout', type=float, default=0.0)
+        parser.add_argument('max_points', type=int, default=0)
+        parser.add_argument('format', type=str, choices=SERIES_FORMATS.keys())
+        request_dict = parser.parse_args()
+        log.debug("series %s", request_dict)
+        if backpack_server.simulation:
+            result = backpack_server.waitData(request_dict['startRow'], request_dict['timeout'],
+                                              request_dict['max_points'])
+            countRows("series", result)
+            return seriesResponse(result, request_dict['format'])
+        return cachedSeriesResponse(request_dict['startRow'], request_dict['timeout'],
+                                    request_dict['max_points'], request_dict['format'])
+
+class SeriesStatsAPI(Resource):
+    def get(self):
+        return backpack_server.getSeriesStats()
+
+class RangeAPI(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('start', type=float, required=True)
+        parser.add_argument('end', type=float, required=True)
+        parser.add_argument('max_points', type=int, default=0)
+        parser.add_argument('format', type=str, choices=SERIES_FORMATS.keys())
+        request_dict = parser.parse_args()
+        log.debug("range %s", request_dict)
+        result = backpack_server.getRange(request_dict['start'], request_dict['end'], request_dict['max_points'])
+        countRows("range", result)
+        return seriesResponse(result, request_dict['format'])
+
+class ReplayAPI(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('session', type=str)
+        parser.add_argument('startRow', type=int, default=0)
+        parser.add_argument('speed', type=float)
+        parser.add_argument('seek', type=float)
+        parser.add_argument('format', type=str, choices=SERIES_FORMATS.keys())
+        request_dict = parser.parse_args()
+        log.debug("replay %s", request_dict)
+        result = backpack_server.replayData(request_dict['session'], request_dict['startRow'],
+                                            request_dict['speed'], request_dict['seek'])
+        if result is None:
+            abort(404)
+        countRows("replay", result)
+        return seriesResponse(result, request_dict['format'])
+
+class AlarmsAPI(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=int)
+        parser.add_argument('start', type=float)
+        parser.add_argument('end', type=float)
+        parser.add_argument('limit', type=int, default=1000)
+        request_dict = parser.parse_args()
+        return backpack_server.getAlarmEvents(request_dict['since'], request_dict['start'],
+                                              request_dict['end'], request_dict['limit'])
+
+class StreamAPI(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('startRow', type=int, default=1)
+        request_dict = parser.parse_args()
+        startRow = request_dict['startRow']
+        if request.headers.get('Last-Event-ID', '').isdigit():
+            startRow = int(request.headers['Last-Event-ID'])
+        return Response(stream_with_context(backpack_server.streamData(startRow)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+        
+def jobResponse(job):
+    """The result of a finished job, or 202 with the job and where to ask for it"""
+    if job.state == "done":
+        return job.result
+    if job.state == "failed":
+        return {"message": job.error, "job": job.jobId}, 502
+    return dict(job.asDict(), status_url=url_for('job', jobId=job.jobId)), 202
+
+class ControlAPI(Resource):
+    def get(self):
+        """Run a command and answer with its result if it finishes within
+        timeout seconds (default [Setup] Control_Wait), else with its job"""
+        parser = reqparse.RequestParser()
+        parser.add_argument('command', type=str, required=True, choices=CONTROL_COMMANDS)
+        parser.add_argument('timeout', type=float)
+        request_dict = parser.parse_args()
+        log.info("control get %s", request_dict)
+        command = request_dict['command']
+        if command == "about":
+            versions = backpack_server.about_cache.get()
+            if versions is not None:
+                return versions
+        timeout = request_dict['timeout']
+        return jobResponse(backpack_server.submitCommand(
+            command, backpack_server.control_wait if timeout is None else timeout))
+    
+    def post(self):
+        """Queue a command and answer with its job straight away"""
+        parser = reqparse.RequestParser()
+        parser.add_argument('command', type=str, required=True, choices=CONTROL_COMMANDS)
+        request_dict = parser.parse_args()
+        log.info("control post %s", request_dict)
+        job = backpack_server.control_jobs.submit(request_dict['command'])
+        return dict(job.asDict(), status_url=url_for('job', jobId=job.jobId)), 202
+
+class JobAPI(Resource):
+    def get(self, jobId):
+        job = backpack_server.control_jobs.get(jobId)
+        if job is None:
+            abort(404)
+        return job.asDict()
+
+class JobListAPI(Resource):
+    def get(self):
+        return {"jobs": [job.asDict() for job in backpack_server.control_jobs.list()]}
+
+class StatsAPI(Resource):
+    def get(self):
+        return backpack_server.getStats()
+
+class MetricsAPI(Resource):
+    def get(self):
+        return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+            
+def addResources(api):
+    api.add_resource(SeriesAPI, '/api/v1.0/series', endpoint='series')
+    api.add_resource(SeriesStatsAPI, '/api/v1.0/series/stats', endpoint='series_stats')
+    api.add_resource(RangeAPI, '/api/v1.0/range', endpoint='range')
+    api.add_resource(ReplayAPI, '/api/v1.0/replay', endpoint='replay')
+    api.add_resource(AlarmsAPI, '/api/v1.0/alarms', endpoint='alarms')
+    api.add_resource(StreamAPI, '/api/v1.0/stream', endpoint='stream')
+    api.add_resource(ControlAPI, '/api/v1.0/control', endpoint='control')
+    api.add_resource(JobListAPI, '/api/v1.0/jobs', endpoint='jobs')
+    api.add_resource(JobAPI, '/api/v1.0/jobs/<int:jobId>', endpoint='job')
+    api.add_resource(StatsAPI, '/api/v1.0/stats', endpoint='stats')
+    api.add_resource(MetricsAPI, '/api/v1.0/metrics', endpoint='metrics')
+
+def createApp(server):
+    """Return a new Flask app with the API resources, serving server"""
+    global backpack_server
+    backpack_server = server
+    watchServer(server)
+    if "backpackServer.py" in sys.argv[0]:
+        app = Flask(__name__, static_url_path='', static_folder='../../../../js/backpack/src/')
+    else:   # running executable
+        app = Flask(__name__, static_url_path='', static_folder='webGUI/')
+    app.add_url_rule('/', 'root', lambda: app.send_static_file('index.html'))
+    app.config.update(SEND_FILE_MAX_AGE_DEFAULT=0)
+    app.before_request(startRequestTimer)
+    app.before_request(checkConfig)
+    # Registered before compressResponse, so it runs after it and counts the compressed bytes
+    app.after_request(recordRequest)
+    app.after_request(compressResponse)
+    api = Api(app)
+    api.representation('application/json')(outputJson)
+    addResources(api)
+    return app
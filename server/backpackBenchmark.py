@@ -0,0 +1,397 @@
+#!/usr/bin/python
+#
+# File Name: backpackBenchmark.py
+# Purpose: Load generator and benchmark suite for the Backpack server.
+# Notes:
+#               The harness writes a DataLog_User_Minimal style UserLog tree (fixed-width, space padded
+#               lines) and keeps appending rows to it at a given rate, like the analyzer does. It then
+#               starts backpackServer0.py on that tree (or uses an already running server given by -u),
+#               drives the series and control endpoints from concurrent simulated clients and writes the
+#               results as JSON, so runs of different versions can be compared with --compare. The
+#               cold start of the server it starts (launch to first answer) is timed as well.
+#
+
+"""Benchmark harness for the Backpack server.
+
+backpackBenchmark.py [-h] [-o<FILENAME>] [options]
+
+Run with -h for the list of options.
+"""
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib2
+from threading import Event, Thread
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+FIELD_WIDTH = 26
+BASE_COLUMNS = ["DATE", "TIME", "EPOCH_TIME", "ALARM_STATUS", "CH4", "CO2", "H2O", "Battery_Voltage"]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def summarize(latencies, sizes, elapsed, errors):
+    """Latency figures are in milliseconds"""
+    return {"requests": len(latencies),
+            "errors": errors,
+            "throughput": len(latencies) / elapsed if elapsed > 0 else None,
+            "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+            "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+            "max_ms": max(latencies) * 1000 if latencies else None,
+            "bytes_per_response": float(sum(sizes)) / len(sizes) if sizes else None}
+
+
+class DataLogWriter(object):
+    """Writes a DataLog_User_Minimal style file under root/YYYY/MM/DD and appends
+    rows to it at rate rows per second from a background thread."""
+    def __init__(self, root, columns=20, rate=1.0, backlog=0, startTime=None):
+        self.root = root
+        extra = max(0, columns - len(BASE_COLUMNS))
+        self.header = BASE_COLUMNS + ["EXTRA_%d" % i for i in range(extra)]
+        self.rate = rate
+        self.epoch = startTime if startTime is not None else time.time() - backlog / max(rate, 1.0)
+        self.rows = 0
+        self.stop = Event()
+        self.thread = None
+        day = time.gmtime(self.epoch)
+        dirName = os.path.join(root, "%04d" % day.tm_year, "%02d" % day.tm_mon, "%02d" % day.tm_mday)
+        if not os.path.isdir(dirName):
+            os.makedirs(dirName)
+        self.name = os.path.join(dirName, "BENCH-%s-DataLog_User_Minimal.dat" %
+                                 time.strftime("%Y%m%d-%H%M%SZ", day))
+        self.fp = open(self.name, "wb")
+        self.fp.write(self._format(self.header))
+        self.writeRows(backlog)
+
+    def _format(self, vals):
+        return "".join(str(v).ljust(FIELD_WIDTH) for v in vals) + "\n"
+
+    def _row(self, i):
+        t = self.epoch + i / max(self.rate, 1.0)
+        gm = time.gmtime(t)
+        vals = [time.strftime("%Y-%m-%d", gm), time.strftime("%H:%M:%S", gm) + ".%03d" % int(t % 1 * 1000),
+                "%.3f" % t, "0",
+                "%.6f" % (2.0 + 0.1 * ((i * 7919) % 100) / 100.0 + (5.0 if i % 600 == 0 else 0.0)),
+                "%.4f" % (400.0 + (i % 120) / 10.0),
+                "%.4f" % (1.0 + (i % 60) / 100.0),
+                "%.3f" % (20.0 if (i // 300) % 2 == 0 else 18.0)]
+        vals += ["%.6E" % (i * 0.001 + k) for k in range(len(self.header) - len(BASE_COLUMNS))]
+        return self._format(vals)
+
+    def writeRows(self, n):
+        self.fp.write("".join(self._row(self.rows + i) for i in range(n)))
+        self.fp.flush()
+        self.rows += n
+
+    def _run(self):
+        start = time.time()
+        written = self.rows
+        while not self.stop.wait(0.1):
+            due = int((time.time() - start) * self.rate) + written
+            if due > self.rows:
+                self.writeRows(due - self.rows)
+
+    def start(self):
+        self.thread = Thread(target=self._run, name="DataLogWriter")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.fp.close()
+
+
+class ServerCpu(object):
+    """CPU seconds used by a process, from psutil or /proc"""
+    def __init__(self, pid):
+        self.pid = pid
+
+    def seconds(self):
+        if self.pid is None:
+            return None
+        if psutil is not None:
+            t = psutil.Process(self.pid).cpu_times()
+            return t.user + t.system
+        try:
+            fields = open("/proc/%d/stat" % self.pid).read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / float(os.sysconf("SC_CLK_TCK"))
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+
+class SimulatedClient(Thread):
+    """Polls the series endpoint like a browser tab, and asks for "about" every
+    controlEvery polls."""
+    def __init__(self, url, stop, pollInterval, query, controlEvery):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.url = url
+        self.stop = stop
+        self.pollInterval = pollInterval
+        self.query = query
+        self.controlEvery = controlEvery
+        self.results = {"series": ([], [], [0]), "control": ([], [], [0])}
+        self.rows = 0
+
+    def _get(self, endpoint, path):
+        latencies, sizes, errors = self.results[endpoint]
+        t0 = time.time()
+        try:
+            body = urllib2.urlopen(self.url + path, timeout=60).read()
+        except Exception:
+            errors[0] += 1
+            return None
+        latencies.append(time.time() - t0)
+        sizes.append(len(body))
+        return body
+
+    def run(self):
+        cursor = 1
+        polls = 0
+        while not self.stop.is_set():
+            body = self._get("series", "/api/v1.0/series?startRow=%d%s" % (cursor, self.query))
+            if body is not None:
+                try:
+                    if body.startswith("BPK1"):  # format=binary
+                        header = json.loads(body[8:8 + struct.unpack("<I", body[4:8])[0]])
+                        self.rows += max([c["length"] for c in header["columns"]] or [0])
+                    else:
+                        header = json.loads(body)
+                        self.rows += len(header.get("data", {}).get("EPOCH_TIME", []))
+                    cursor = header.get("next_row", cursor)
+                except (ValueError, KeyError, struct.error):
+                    pass
+            polls += 1
+            if self.controlEvery and polls % self.controlEvery == 0:
+                self._get("control", "/api/v1.0/control?command=about")
+            if self.pollInterval > 0:
+                self.stop.wait(self.pollInterval)
+
+
+def runHttpBenchmark(url, clients, duration, pollInterval, query, controlEvery, pid):
+    stop = Event()
+    threads = [SimulatedClient(url, stop, pollInterval, query, controlEvery) for i in range(clients)]
+    cpu = ServerCpu(pid)
+    cpu0 = cpu.seconds()
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - t0
+    cpu1 = cpu.seconds()
+    results = {}
+    for endpoint in ("series", "control"):
+        latencies, sizes, errors = [], [], 0
+        for t in threads:
+            l, s, e = t.results[endpoint]
+            latencies.extend(l)
+            sizes.extend(s)
+            errors += e[0]
+        results[endpoint] = summarize(latencies, sizes, elapsed, errors)
+    results["series"]["rows"] = sum(t.rows for t in threads)
+    if cpu0 is not None and cpu1 is not None:
+        results["server_cpu_seconds"] = cpu1 - cpu0
+        results["server_cpu_fraction"] = (cpu1 - cpu0) / elapsed
+    return results
+
+
+def timeCalls(func, args, repeat):
+    latencies = []
+    t0 = time.time()
+    for i in range(repeat):
+        t = time.time()
+        func(*args)
+        latencies.append(time.time() - t)
+    return summarize(latencies, [], time.time() - t0, 0)
+
+
+def runInProcessBenchmark(configFile, repeat):
+    """Time BackpackServer.getData, simulate_data and simulateRows without HTTP"""
+    t0 = time.time()
+    import backpackServer0
+    results = {"import_seconds": time.time() - t0}
+    server = backpackServer0.BackpackServer(configFile, False)
+    server.loadConfig()
+    t0 = time.time()
+    server.ingest()
+    results["ingest_backlog_seconds"] = time.time() - t0
+    results["ingest_backlog_rows"] = server.series.nextSeq - 1
+    results["getData_tail"] = timeCalls(server.getData, (server.series.nextSeq - 1,), repeat)
+    results["getData_full"] = timeCalls(server.getData, (1,), max(1, repeat // 10))
+    sim = backpackServer0.BackpackServer(configFile, True)
+    sim.loadConfig()
+    if "Files" not in sim.simulation_dict:
+        results["simulate_data"] = timeCalls(sim.simulate_data, (1,), repeat)
+        # Generate the rows of a day at 1 Hz in one call per column
+        results["simulate_rows"] = timeCalls(sim.simulateRows, (range(1, 86401),), max(1, repeat // 100))
+    return results
+
+
+def writeConfig(name, userlog, port, simulation=True):
+    fp = open(name, "w")
+    fp.write("[Setup]\nHost_IP = 127.0.0.1\nPort = %d\nDebug_Mode = False\nUserLog_Files = %s\n" % (port, userlog))
+    fp.write("Ingest_Interval = 0.2\n")
+    fp.write("[BatteryMonitor]\nPoints_Trigger_Alarm = 10\nPoints_Cancel_Alarm = 3\nVoltage_Threshold = 18.9\n")
+    if simulation:
+        fp.write("[Simulation]\nMax_Index = 30\nCH4 = sin(x/30.0*2*pi)\nH2O = cos(x/30.0*2*pi)\n"
+                 "CO2 = x/30.0\nBatteryVoltage = 20 if x<15 else 15\n")
+    fp.close()
+
+
+def waitForServer(url, timeout=30.0, interval=0.2):
+    """Poll the stats API every interval seconds until it answers; returns the
+    stats, or None if the server did not answer within timeout seconds"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return json.loads(urllib2.urlopen(url + "/api/v1.0/stats", timeout=1).read())
+        except Exception:
+            time.sleep(interval)
+    return None
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return "unknown"
+
+
+def compareResults(old, new):
+    """Print the relative change of every numeric figure present in both results"""
+    def walk(a, b, path):
+        for k in sorted(set(a) & set(b)):
+            if isinstance(a[k], dict) and isinstance(b[k], dict):
+                walk(a[k], b[k], path + [k])
+            elif isinstance(a[k], (int, float)) and isinstance(b[k], (int, float)) and a[k]:
+                print "%-60s %14.4g %14.4g %+8.1f%%" % (".".join(path + [k]), a[k], b[k],
+                                                        100.0 * (b[k] - a[k]) / a[k])
+    walk(old["results"], new["results"], [])
+
+
+HELP_STRING = \
+"""\
+backpackBenchmark.py [-h] [-o<FILENAME>] [options]
+
+Where the options can be a combination of the following:
+-h                  Print this help.
+-o                  Write the JSON results to this file instead of stdout.
+-u                  URL of an already running server (default: start one on the generated data).
+--rate=R            Rows per second appended to the DataLog file. Default = 1
+--columns=C         Number of columns in the DataLog file. Default = 40
+--backlog=N         Rows written before the benchmark starts. Default = 3600
+--clients=N         Number of concurrent simulated clients. Default = 10
+--duration=S        Seconds to drive the HTTP endpoints. Default = 30
+--poll=S            Seconds between polls of each client, 0 to poll flat out. Default = 1
+--query=Q           Extra query string for series requests, e.g. "&max_points=500".
+--control-every=K   Each client requests "about" every K polls, 0 for never. Default = 10
+--port=P            Port of the server started by the harness. Default = 3999
+--repeat=N          Calls per in-process measurement. Default = 200
+--no-http           Only run the in-process measurements.
+--compare=FILENAME  Compare the results in -o (or the new run) against an earlier results file.
+"""
+
+
+def PrintUsage():
+    print HELP_STRING
+
+
+def HandleCommandSwitches():
+    import getopt
+    shortOpts = 'ho:u:'
+    longOpts = ["help", "rate=", "columns=", "backlog=", "clients=", "duration=", "poll=", "query=",
+                "control-every=", "port=", "repeat=", "no-http", "compare="]
+    try:
+        switches, args = getopt.getopt(sys.argv[1:], shortOpts, longOpts)
+    except getopt.GetoptError, data:
+        print "%s %r" % (data, data)
+        sys.exit(1)
+    options = {}
+    for o, a in switches:
+        options[o] = a
+    if "-h" in options or "--help" in options:
+        PrintUsage()
+        sys.exit()
+    return options
+
+
+def main():
+    options = HandleCommandSwitches()
+    params = {"rate": float(options.get("--rate", 1.0)),
+              "columns": int(options.get("--columns", 40)),
+              "backlog": int(options.get("--backlog", 3600)),
+              "clients": int(options.get("--clients", 10)),
+              "duration": float(options.get("--duration", 30.0)),
+              "poll": float(options.get("--poll", 1.0)),
+              "query": options.get("--query", ""),
+              "control_every": int(options.get("--control-every", 10)),
+              "repeat": int(options.get("--repeat", 200))}
+    port = int(options.get("--port", 3999))
+    workDir = tempfile.mkdtemp(prefix="backpack_bench_")
+    userlog = os.path.join(workDir, "UserLog")
+    configFile = os.path.join(workDir, "backpackServer.ini")
+    writeConfig(configFile, userlog, port)
+    writer = DataLogWriter(userlog, params["columns"], params["rate"], params["backlog"])
+    report = {"version": gitVersion(), "timestamp": time.time(), "params": params, "results": {}}
+    server = None
+    try:
+        report["results"]["inprocess"] = runInProcessBenchmark(configFile, params["repeat"])
+        if "--no-http" not in options:
+            writer.start()
+            url = options.get("-u")
+            pid = None
+            if url is None:
+                url = "http://127.0.0.1:%d" % port
+                script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backpackServer0.py")
+                t0 = time.time()
+                server = subprocess.Popen([sys.executable, script, "-c", configFile],
+                                          stdout=open(os.path.join(workDir, "server.log"), "w"),
+                                          stderr=subprocess.STDOUT)
+                pid = server.pid
+                stats = waitForServer(url, interval=0.01)
+                if stats is None:
+                    raise RuntimeError("Server did not start, see %s" % os.path.join(workDir, "server.log"))
+                # Cold start: from launching the process to its first answer, and the
+                # phases as timed by the server itself
+                report["results"]["startup"] = {"first_response_seconds": time.time() - t0,
+                                                "server": stats.get("startup")}
+            report["results"]["http"] = runHttpBenchmark(url, params["clients"], params["duration"],
+                                                         params["poll"], params["query"],
+                                                         params["control_every"], pid)
+    finally:
+        writer.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(workDir, ignore_errors=True)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if "-o" in options:
+        open(options["-o"], "w").write(text + "\n")
+    else:
+        print text
+    if "--compare" in options:
+        compareResults(json.load(open(options["--compare"])), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,189 +1,649 @@
-from flask import abort, Flask, make_response, jsonify, Response, request, url_for
-from flask_restful import Api, reqparse, Resource, fields, marshal
-import glob
+import time
 import os
 import sys
-from threading import Thread
-import time
+from threading import Event, Lock, Thread
 import math
-import traceback
-from CustomConfigObj import CustomConfigObj
+import json
+import logging
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from AlarmLog import AlarmLog
+from AlarmMonitor import AlarmChannel, AlarmRegister, BatteryVoltageMonitor, ThresholdMonitor
+from ConfigCache import ParsedConfigCache
+from ControlJobs import JobQueue, TtlValue
+from ConfigSnapshot import (ConfigSchema, ConfigValueError, ReloadableConfig, asBoolean, asExpression,
+                            asFloat, asInt, asIntList, asOptionalFloat, asString)
+from DataArchive import ArchiveCompactor, ArchiveFileInfo
+from DataLogReader import DataLogIndex, DataLogTail, parseBlock
+from Decimation import minMaxDecimate
+from FileLocator import LatestFileLocator
+from LocalRpc import LocalDataLogger, LocalDriver, LocalInstMgr
+from ReplayEngine import ReplayEngine
+from ResponseCache import ResponseCache
+from RollingStats import RollingStats, SnapshotFile
+from SeriesRing import SeriesRing, SharedSeriesRing
+from ServerLog import asLogLevel, configureLogging
+from ServerMetrics import countRows, FILES_ARCHIVED, RESPONSE_BYTES, ROWS_INGESTED, STAGE_SECONDS
 
 if hasattr(sys, "frozen"): #we're running compiled with py2exe
     AppPath = sys.executable
 else:
     AppPath = sys.argv[0]
 APP_NAME = "BackpackServer"
-if "backpackServer.py" in sys.argv[0]:
-    app = Flask(__name__, static_url_path='', static_folder='../../../../js/backpack/src/')
-else:   # running executable
-    app = Flask(__name__, static_url_path='', static_folder='webGUI/')
-     
-app.add_url_rule('/', 'root', lambda: app.send_static_file('index.html'))
-api = Api(app)
-app.config.update(SEND_FILE_MAX_AGE_DEFAULT=0)
+
+def processStartTime():
+    """Return the wall clock time at which this process started, from /proc on
+    Linux; elsewhere, the time of the call"""
+    now = time.time()
+    try:
+        # Field 22 of /proc/self/stat is the start time in clock ticks after boot
+        ticks = float(open("/proc/self/stat").read().rsplit(")", 1)[1].split()[19])
+        uptime = float(open("/proc/uptime").read().split()[0])
+        return now - max(uptime - ticks/os.sysconf("SC_CLK_TCK"), 0.0)
+    except (IOError, OSError, IndexError, ValueError):
+        return now
+
+# When the process started (for a WSGI worker, when it was forked); the startup phases are timed from here
+STARTED = processStartTime()
+
+# Columns returned by the series API, and the columns kept by the ingest thread
+SERIES_COLUMNS = ("EPOCH_TIME", "CH4", "CO2", "H2O")
+RING_COLUMNS = SERIES_COLUMNS + ("Battery_Voltage",)
+# Columns with rolling statistics
+STATS_COLUMNS = ("CH4", "CO2", "H2O")
+
+# Builtins available to [Simulation] expressions besides the math module;
+# expressions are evaluated without the rest of __builtins__
+SIMULATION_BUILTINS = {"abs": abs, "min": min, "max": max, "round": round,
+                       "int": int, "float": float, "True": True, "False": False}
+# Seconds without a simulated row being fed to the shared state after which the row of
+# any client is fed, so that the others take over when the client being followed leaves
+SIMULATION_RESYNC = 5.0
+
+def checkAlarmSections(cfg):
+    """Check the [Alarm_*] sections of a config snapshot together"""
+    bits = set([0])     # bit 0 is the battery voltage alarm
+    names = set(["battery_voltage"])
+    for section in cfg.Alarm:
+        if section.Column not in RING_COLUMNS:
+            raise ConfigValueError("[%s] Column must be one of %s" % (section.Section, ", ".join(RING_COLUMNS)))
+        if not 1 <= section.Alarm_Bit <= 31 or section.Alarm_Bit in bits:
+            raise ConfigValueError("[%s] Alarm_Bit must be an unused bit between 1 and 31" % section.Section)
+        if section.Low_Threshold is None and section.High_Threshold is None:
+            raise ConfigValueError("[%s] needs Low_Threshold and/or High_Threshold" % section.Section)
+        name = section.Section[len("Alarm_"):].lower()
+        if name in names:
+            raise ConfigValueError("[%s] has the name of another alarm" % section.Section)
+        bits.add(section.Alarm_Bit)
+        names.add(name)
+
+# Options read from the config file, with their types and defaults
+CONFIG_SCHEMA = ConfigSchema([
+    ("Setup", [("Host_IP", asString, "0.0.0.0"),
+               ("Port", asInt, 3000),
+               ("Debug_Mode", asBoolean, True),
+               ("Threaded", asBoolean, True),
+               ("UserLog_Files", asString, None),
+               ("Ingest_Interval", asFloat, 0.5),
+               ("Buffer_Rows", asInt, 86400),
+               ("Shared_Ring", asString, ""),
+               ("Alarm_Log", asString, ""),
+               ("Max_Wait", asFloat, 30.0),
+               ("Keepalive_Interval", asFloat, 15.0),
+               ("Compress_Min_Size", asInt, 1024),
+               ("Compress_Level", asInt, 6),
+               ("Response_Cache_Size", asInt, 8*1024*1024),
+               ("Stats_Windows", asIntList, "60,300,900"),
+               ("Stats_Baseline_Bucket", asFloat, 10.0),
+               ("Stats_File", asString, ""),
+               ("Decimation_Levels", asIntList, "10,60,600"),
+               ("Decimation_Cache_Files", asInt, 32),
+               ("Use_Inotify", asBoolean, True),
+               ("Archive_Files", asBoolean, False),
+               ("Archive_Interval", asFloat, 300.0),
+               ("Archive_Min_Age", asFloat, 600.0),
+               ("Archive_Chunk_Rows", asInt, 4096),
+               ("Archive_Keep_Text", asBoolean, False),
+               ("Config_Check_Interval", asFloat, 1.0),
+               ("Control_Wait", asFloat, 5.0),
+               ("About_Cache_TTL", asFloat, 300.0),
+               ("Job_History", asInt, 100),
+               ("Log_Level", asLogLevel, "INFO"),
+               ("Log_File", asString, "")]),
+    ("BatteryMonitor", [("Points_Trigger_Alarm", asInt, 10),
+                        ("Points_Cancel_Alarm", asInt, 3),
+                        ("Voltage_Threshold", asFloat, 18.9)]),
+    # Further alarm channels, one section each: [Alarm_CH4_High], [Alarm_H2O_Range], ...
+    ("Alarm_*", [("Column", asString, None),
+                 ("Alarm_Bit", asInt, None),
+                 ("Low_Threshold", asOptionalFloat, ""),
+                 ("High_Threshold", asOptionalFloat, ""),
+                 ("Points_Trigger_Alarm", asInt, 10),
+                 ("Points_Cancel_Alarm", asInt, 3)]),
+    ("Simulation", [("Replay_Data", asString, ""),
+                    ("Replay_Max_Batch", asInt, 3600),
+                    ("Replay_Session_Timeout", asFloat, 600.0),
+                    ("Replay_Max_Sessions", asInt, 100),
+                    ("Max_Index", asInt, 100),
+                    ("Rpc_Delay", asFloat, 0.0),
+                    ("CH4", asExpression, ""),
+                    ("CO2", asExpression, ""),
+                    ("H2O", asExpression, ""),
+                    ("BatteryVoltage", asExpression, "")]),
+], check=checkAlarmSections)
+
+log = logging.getLogger("backpackServer")
+
+def simulationEnv(codes):
+    """Return the globals for evaluating the compiled [Simulation] expressions
+    codes: the SIMULATION_BUILTINS and the functions and constants of the math
+    module which they use, without the rest of __builtins__"""
+    env = dict(SIMULATION_BUILTINS)
+    codes = [code for code in codes if code is not None]
+    while codes:
+        code = codes.pop()
+        for name in code.co_names:
+            if hasattr(math, name) and not name.startswith("__"):
+                env[name] = getattr(math, name)
+        codes.extend(const for const in code.co_consts if hasattr(const, "co_names"))
+    env["__builtins__"] = {}
+    return env
+
+# NumPy names of the math functions which NumPy calls differently
+NUMPY_NAMES = {"asin": "arcsin", "acos": "arccos", "atan": "arctan", "atan2": "arctan2", "pow": "power"}
+
+def simulationVectorEnv(env):
+    """Return the globals of simulationEnv() with the math functions replaced
+    by the NumPy ufuncs of the same name, for evaluating the expressions over
+    a vector of x values. Functions NumPy does not have are kept; they fail on
+    a vector, and the expression is then evaluated one x at a time."""
+    vectorEnv = dict(env)
+    for name, value in env.items():
+        if name not in SIMULATION_BUILTINS and name != "__builtins__":
+            vectorEnv[name] = getattr(numpy, NUMPY_NAMES.get(name, name), value)
+    return vectorEnv
 
 class JSON_Remote_Procedure_Error(RuntimeError):
     pass
     
-class BatteryVoltageMonitor(object):
-    def __init__(self):
-        self.old_voltage = 0
-        self.count = 0
-        
-    def checkValue(self, voltage):
-        if (self.old_voltage - self.voltageThreshold) * (voltage - self.voltageThreshold) < 0:
-            self.count = 1
-            ret = (self.old_voltage < self.voltageThreshold)
-        elif voltage < self.voltageThreshold:
-            ret = True if self.count >= self.pointsTriggerAlarm else False
-            self.count += 1
-        elif voltage > self.voltageThreshold:
-            if self.count == 0:
-                ret = False
-            elif self.count == self.pointsCancelAlarm:
-                ret = False
-                self.count = 0
-            else:
-                ret = True
-                self.count += 1
-        self.old_voltage = voltage
-        return ret
-        
-        
-class AlarmRegister(object):
-    def __init__(self):
-        self.register = 0x00000000
-        self.alarmMask = {
-            "battery_voltage": 0x00000001
-        }
-        
-    def setAlarm(self, alarmName, value):
-        if value:
-            self.register |= self.alarmMask[alarmName]
-        else:
-            self.register &= ~self.alarmMask[alarmName]
-
 class BackpackServer(object):
-    def __init__(self, configFile, simulation):
-        if os.path.exists(configFile):
-            self.config = CustomConfigObj(configFile)
-        else:
+    """role is "standalone" (ingest and serve in one process), "ingest" (only
+    ingest, into the [Setup] Shared_Ring file) or "worker" (only serve, from
+    the Shared_Ring file written by the ingest process)."""
+    def __init__(self, configFile, simulation, role="standalone"):
+        if not os.path.exists(configFile):
             print "Configuration file not found: %s" % configFile
             sys.exit(1)
+        self.config_file = configFile
+        self._config = None
         self.simulation = simulation
+        self.role = role
         self.battery_monitor = BatteryVoltageMonitor()
         self.alarmStatus = AlarmRegister()
+        self.alarm_channels = [AlarmChannel("battery_voltage", "Battery_Voltage", 0x1, [self.battery_monitor])]
+        self.tail = DataLogTail()
+        self.locator = None
+        self.index = None
+        self.series = None
+        self.alarm_log = None
+        self.response_cache = None
+        self.rolling_stats = None
+        self.stats_file = None
+        self.log_handler = None
+        self._replay = None
+        self.replay_files = None
+        self.replay_lock = Lock()
+        self.simulation_env = None
+        self.simulation_vector_env = None
+        # simulate_data feeds each simulated or replayed row to the shared alarm state, alarm log
+        # and statistics once, whatever the number of clients polling: replayed rows up to
+        # replay_fed_row (exclusive), and the calculated row simulation_next_row, which the last
+        # row fed told its client to ask for next
+        self.simulation_lock = Lock()
+        self.replay_fed_row = 1
+        self.simulation_next_row = None
+        self.simulation_fed_time = 0.0
+        self.startup = {}
+        self.ingest_name = None
+        self.ingest_row = 1
+        self.ingest_thread = None
+        self.ingest_stop = Event()
+        self.compactor = None
+        self.compact_thread = None
         self.driver = None
         self.inst_mgr = None
         self.logger = None
+        self.control_jobs = JobQueue(self.act_on_command)
+        self.about_cache = TtlValue(0.0)
+
+    @property
+    def config(self):
+        """The ReloadableConfig of the config file, parsed on first use"""
+        if self._config is None:
+            cacheDir = os.environ.get("BACKPACK_CONFIG_CACHE")
+            self._config = ReloadableConfig(self.config_file, CONFIG_SCHEMA,
+                                            cache=ParsedConfigCache(cacheDir) if cacheDir else None)
+        return self._config
+
+    @property
+    def replay(self):
+        """The ReplayEngine of the [Simulation] Replay_Data files, or None. The
+        files are opened and indexed by the first request which replays them."""
+        if self._replay is None and self.replay_files:
+            with self.replay_lock:
+                if self._replay is None:
+                    cfg = self.config.snapshot
+                    self._replay = ReplayEngine(self.replay_files, cfg.Simulation.Replay_Max_Batch,
+                                                cfg.Simulation.Replay_Session_Timeout,
+                                                cfg.Simulation.Replay_Max_Sessions)
+        return self._replay
+
+    def markStartup(self, phase):
+        """Record the seconds from the start of the process to phase, once"""
+        if phase not in self.startup:
+            self.startup[phase] = time.time() - STARTED
+            log.info("Startup: %s %.3f s after start", phase, self.startup[phase])
     
     def loadConfig(self):
-        self.setup = {'host' : self.config.get('Setup', "Host_IP", "0.0.0.0"),
-                      'port' : self.config.getint('Setup', "Port", 3000),
-                      'debug' : self.config.getboolean('Setup', "Debug_Mode", True)}
-        self.userlog = self.config.get('Setup', "UserLog_Files")
-        self.battery_monitor.pointsTriggerAlarm = self.config.getint("BatteryMonitor", "Points_Trigger_Alarm", 10)
-        self.battery_monitor.pointsCancelAlarm = self.config.getint("BatteryMonitor", "Points_Cancel_Alarm", 3)
-        self.battery_monitor.voltageThreshold = self.config.getfloat("BatteryMonitor", "Voltage_Threshold", 18.9)
+        cfg = self.config.snapshot
+        self.log_handler = configureLogging(cfg.Setup.Log_Level, cfg.Setup.Log_File)
+        self.setup = {'host' : cfg.Setup.Host_IP,
+                      'port' : cfg.Setup.Port,
+                      'debug' : cfg.Setup.Debug_Mode,
+                      'threaded' : cfg.Setup.Threaded}
+        self.userlog = cfg.Setup.UserLog_Files
+        self.index = DataLogIndex(self.userlog, "*.dat", RING_COLUMNS, cfg.Setup.Decimation_Levels,
+                                  cfg.Setup.Decimation_Cache_Files, archiveType=ArchiveFileInfo)
+        if cfg.Setup.Archive_Files and self.role != "worker" and not self.simulation:
+            self.compactor = ArchiveCompactor(self.userlog, "*.dat", cfg.Setup.Archive_Chunk_Rows,
+                                              cfg.Setup.Archive_Min_Age, cfg.Setup.Archive_Keep_Text)
+        self.locator = LatestFileLocator(self.userlog, "*.dat", cfg.Setup.Use_Inotify)
+        bufferRows = cfg.Setup.Buffer_Rows
+        sharedRing = cfg.Setup.Shared_Ring
+        if sharedRing:
+            self.series = SharedSeriesRing(sharedRing, RING_COLUMNS, bufferRows,
+                                           create=(self.role != "worker"), pollInterval=cfg.Setup.Ingest_Interval)
+        elif self.role != "standalone":
+            raise Exception("[Setup] Shared_Ring must be set to run as %s" % self.role)
+        else:
+            self.series = SeriesRing(RING_COLUMNS, bufferRows)
+        self.response_cache = ResponseCache(cfg.Setup.Response_Cache_Size)
+        if self.role != "worker" or self.simulation:
+            self.rolling_stats = RollingStats(STATS_COLUMNS, cfg.Setup.Stats_Windows, cfg.Setup.Stats_Baseline_Bucket)
+        statsFile = cfg.Setup.Stats_File or (sharedRing + ".stats" if sharedRing else None)
+        if statsFile and self.role != "standalone" and not self.simulation:
+            self.stats_file = SnapshotFile(statsFile)
+        alarmLog = cfg.Setup.Alarm_Log or (sharedRing + ".alarms" if sharedRing else None)
+        self.alarm_log = AlarmLog(alarmLog, create=(self.role != "worker"))
         if self.simulation:
-            self.simulation_dict = {}
-            if self.config.has_option('Simulation', 'Replay_Data'):
-                replay_data = self.config.get('Simulation', 'Replay_Data', '')
-                self.simulation_dict["Files"] = replay_data.split(',')
-                for f in self.simulation_dict["Files"]:
+            delay = cfg.Simulation.Rpc_Delay
+            self.driver = LocalDriver(delay)
+            self.inst_mgr = LocalInstMgr(delay)
+            self.logger = LocalDataLogger(delay)
+            if cfg.Simulation.Replay_Data:
+                files = cfg.Simulation.Replay_Data.split(',')
+                for f in files:
                     if not os.path.exists(f):
                         raise Exception("Data file not found: %s" % f)
-                self.simulation_dict["CurrentFile"] = self.simulation_dict["Files"][0]
-                self.simulation_dict["CurrentFileIndex"] = 0
-                fp = open(self.simulation_dict["Files"][0], 'r')
-                self.simulation_dict["CurrentFileHeader"] = fp.readline().split()
-                self.simulation_dict["CurrentFileHandle"] = fp
+                self.replay_files = files
             else:
-                self.simulation_dict["CH4"] = self.config.get('Simulation', 'CH4', '')
-                self.simulation_dict["CO2"] = self.config.get('Simulation', 'CO2', '')
-                self.simulation_dict["H2O"] = self.config.get('Simulation', 'H2O', '')
-                self.simulation_dict["Battery"] = self.config.get('Simulation', 'BatteryVoltage', '')
-                self.simulation_env = {func: getattr(math, func) for func in dir(math) if not func.startswith("__")}
-                self.simulation_max_index = self.config.getint('Simulation', 'Max_Index', 100)
                 self.simulation_index_increment = 1
+        self.applyConfig(cfg)
+        if sharedRing and self.role != "worker" and not self.simulation:
+            self.resumeIngest()
+
+    def applyConfig(self, cfg):
+        """Copy the settings that can be retuned while running from a config
+        snapshot. The others (host, port, files, buffer sizes) are only read by
+        loadConfig and need a restart."""
+        # Everything which can fail comes before the first change
+        channels = self.buildAlarmChannels(cfg)
+        self.battery_monitor.pointsTriggerAlarm = cfg.BatteryMonitor.Points_Trigger_Alarm
+        self.battery_monitor.pointsCancelAlarm = cfg.BatteryMonitor.Points_Cancel_Alarm
+        self.battery_monitor.voltageThreshold = cfg.BatteryMonitor.Voltage_Threshold
+        self.ingest_interval = cfg.Setup.Ingest_Interval
+        self.max_wait = cfg.Setup.Max_Wait
+        self.keepalive_interval = cfg.Setup.Keepalive_Interval
+        self.compress_min_size = cfg.Setup.Compress_Min_Size
+        self.compress_level = cfg.Setup.Compress_Level
+        self.archive_interval = cfg.Setup.Archive_Interval
+        self.config.checkInterval = cfg.Setup.Config_Check_Interval
+        logging.getLogger().setLevel(cfg.Setup.Log_Level)
+        self.control_wait = cfg.Setup.Control_Wait
+        self.control_jobs.maxHistory = cfg.Setup.Job_History
+        self.about_cache.ttl = cfg.Setup.About_Cache_TTL
+        self.configureAlarms(channels)
+        if self.simulation:
+            if self.replay_files:
+                self.simulation_dict = {"Files": self.replay_files}
+            else:
+                self.simulation_dict = {"CH4": cfg.Simulation.CH4,
+                                        "CO2": cfg.Simulation.CO2,
+                                        "H2O": cfg.Simulation.H2O,
+                                        "Battery": cfg.Simulation.BatteryVoltage}
+                self.simulation_max_index = cfg.Simulation.Max_Index
+                self.simulation_env = simulationEnv(self.simulation_dict.values())
+                if numpy is not None:
+                    self.simulation_vector_env = simulationVectorEnv(self.simulation_env)
+
+    def buildAlarmChannels(self, cfg):
+        """Return the alarm channels of the [Alarm_*] sections, which the schema
+        has checked. A channel which is still configured keeps the state of its
+        monitors across a reload."""
+        channels = [self.alarm_channels[0]]
+        old = dict((channel.name, channel) for channel in self.alarm_channels)
+        for section in cfg.Alarm:
+            monitors = []
+            if section.Low_Threshold is not None:
+                monitors.append(ThresholdMonitor(section.Low_Threshold, section.Points_Trigger_Alarm,
+                                                 section.Points_Cancel_Alarm))
+            if section.High_Threshold is not None:
+                monitors.append(ThresholdMonitor(section.High_Threshold, section.Points_Trigger_Alarm,
+                                                 section.Points_Cancel_Alarm, above=True))
+            channel = AlarmChannel(section.Section[len("Alarm_"):].lower(), section.Column,
+                                   1 << section.Alarm_Bit, monitors)
+            previous = old.get(channel.name)
+            if previous is not None and previous.column == channel.column and \
+                    [m.above for m in previous.monitors] == [m.above for m in monitors]:
+                for m, p in zip(monitors, previous.monitors):
+                    m.setState(p.getState())
+            channels.append(channel)
+        return channels
+
+    def configureAlarms(self, channels):
+        """Replace the alarm channels, clearing the bits of the removed ones"""
+        names = set(channel.name for channel in channels)
+        for channel in self.alarm_channels:
+            if channel.name not in names:
+                self.alarmStatus.setAlarm(channel.name, False)
+        for channel in channels:
+            self.alarmStatus.addAlarm(channel.name, channel.mask)
+        self.alarm_channels = channels
+
+    def checkConfig(self):
+        """Apply the config file again if it has changed since it was last read"""
+        if self.config.check():
+            log.info("Configuration reloaded from %s", self.config.fileName)
+            try:
+                self.applyConfig(self.config.snapshot)
+            except Exception, e:
+                log.exception("Configuration not applied: %s", e)
     
-    def getData(self, startRow):
+    def getData(self, startRow, maxPoints=0):
         if self.simulation:
             return self.simulate_data(startRow)
-        name = self._getFileName()
-        if name is not None:
-            fp = file(name,'rb')
-        else:
+        alarm, name = self.series.status()
+        if name is None:
             return {'filename':''}
-        fp.seek(0,0)
-        header = fp.readline().split()
-        data = dict(EPOCH_TIME=[],CH4=[],CO2=[],H2O=[])
-        lineLength = fp.tell()
-        fp.seek(0,2)
-        if fp.tell() < startRow*lineLength:
-            startRow = 1
-        fp.seek(startRow*lineLength,0)
-        for line in fp:
-            if len(line) != lineLength:
-                break
-            vals = line.split()
-            if len(vals)!=len(header):
-                break
-            for col,val in zip(header,vals):
-                if col in data: 
-                    data[col].append(float(val))
-                if col == "Battery_Voltage":
-                    self.alarmStatus.setAlarm("battery_voltage", self.battery_monitor.checkValue(float(val)))
-            startRow += 1
-        fp.close()
-        result = {"next_row" : startRow,
+        with STAGE_SECONDS.time("ring"):
+            nextSeq, data = self.series.since(startRow, SERIES_COLUMNS)
+        if maxPoints > 0:
+            with STAGE_SECONDS.time("decimate"):
+                data = minMaxDecimate(data, maxPoints)
+        result = {"next_row" : nextSeq,
                   "file_name" :  name,
-                  "alarm" : self.alarmStatus.register,
+                  "file_start_row" : self.series.fileStart,
+                  "alarm" : alarm,
                   "data" : data}
         return result
+
+    def getRange(self, start, end, maxPoints=0):
+        """Return the rows with start <= EPOCH_TIME <= end from every DataLog file
+        under UserLog_Files, decimated to at most maxPoints rows if it is positive."""
+        with STAGE_SECONDS.time("range_query"):
+            names, data = self.index.query(start, end, SERIES_COLUMNS, maxPoints)
+        result = {"start" : start,
+                  "end" : end,
+                  "file_names" : names,
+                  "alarm" : self.series.status()[0],
+                  "data" : data}
+        return result
+
+    def getAlarmEvents(self, since=None, start=None, end=None, limit=1000):
+        """Return the alarm transitions from event cursor since, or with
+        start <= time <= end, as columns like the series data."""
+        nextEvent, records = self.alarm_log.query(since, start, end, limit)
+        names = dict((mask, name) for name, mask in self.alarmStatus.alarmMask.items())
+        events = {"event": [], "time": [], "row": [], "name": [], "value": [], "register": []}
+        for event, t, row, mask, register in records:
+            events["event"].append(event)
+            events["time"].append(t)
+            events["row"].append(row)
+            events["name"].append(names.get(mask, "0x%08x" % mask))
+            events["value"].append(bool(register & mask))
+            events["register"].append(register)
+        return {"next_event" : nextEvent,
+                "alarm" : self.series.status()[0] if not self.simulation else self.alarmStatus.register,
+                "events" : events}
+
+    def getSeriesStats(self):
+        """Return the rolling statistics of STATS_COLUMNS, computed by the
+        ingest path (read from the Stats_File in a WSGI worker)"""
+        if self.rolling_stats is not None:
+            result = self.rolling_stats.snapshot()
+        else:
+            result = self.stats_file.read() if self.stats_file is not None else None
+            if result is None:
+                return {"windows": [], "fields": [], "time": None}
+            result = dict(result)
+        if not self.simulation:
+            result["next_row"] = self.series.nextSeq
+        return result
+
+    def seriesState(self):
+        """Return (file name, next row, alarm register) of the series buffer.
+        It changes whenever a getData result would, and costs no file access."""
+        alarm, name = self.series.status()
+        return (name, self.series.nextSeq, alarm)
+
+    def waitSeries(self, startRow, timeout):
+        """When there is nothing after startRow wait up to timeout seconds for
+        the ingest thread to add rows."""
+        if not self.simulation and self.series is not None and timeout > 0:
+            self.series.waitFor(startRow, time.time() + min(timeout, self.max_wait))
+
+    def waitData(self, startRow, timeout, maxPoints=0):
+        """Like getData, but when there is nothing after startRow wait up to
+        timeout seconds for the ingest thread to add rows."""
+        self.waitSeries(startRow, timeout)
+        return self.getData(startRow, maxPoints)
+
+    def streamData(self, startRow):
+        """Generator of Server-Sent Events, one per batch of new rows. Each event
+        carries a getData result and has next_row as its id so that a reconnecting
+        EventSource resumes from Last-Event-ID."""
+        while True:
+            if self.simulation:
+                time.sleep(self.ingest_interval)
+                result = self.getData(startRow)
+            else:
+                result = self.waitData(startRow, self.keepalive_interval)
+                if result.get("next_row", startRow) == startRow:
+                    yield ": keepalive\n\n"
+                    continue
+            startRow = result.get("next_row", startRow)
+            countRows("stream", result)
+            with STAGE_SECONDS.time("serialize"):
+                event = "id: %s\ndata: %s\n\n" % (startRow, json.dumps(result))
+            RESPONSE_BYTES.inc(len(event), "stream")
+            yield event
+
+    def _readNewRows(self, name, startRow):
+        """Return (next row, nRows, data) for the rows of file name from startRow"""
+        with STAGE_SECONDS.time("read"):
+            startRow, block = self.tail.readBlock(name, startRow)
+        with STAGE_SECONDS.time("parse"):
+            nRows, data = parseBlock(block, self.tail.header, self.tail.lineLength, RING_COLUMNS)
+        return startRow + nRows, nRows, data
+
+    def resumeIngest(self):
+        """Continue from where a previous ingest process left the shared ring:
+        the file it was reading and the rows of it already in the ring, which
+        are not appended again. Those rows are run through the alarm monitors
+        and the rolling statistics, without logging anything, to bring them
+        back to the state they had."""
+        name = self.series.status()[1]
+        if name is None or not os.path.exists(name):
+            return
+        row = self.series.nextSeq - self.series.fileStart + 1
+        try:
+            nRows, data = self._readNewRows(name, 1)[1:]
+        except (IOError, OSError), e:
+            log.warning("Cannot resume ingesting %s: %s", name, e)
+            return
+        if nRows < row - 1:
+            log.warning("%s has %d rows, fewer than the %d in the shared ring; ingesting it again",
+                        name, nRows, row - 1)
+            return
+        data = dict((col, data[col][:row - 1]) for col in RING_COLUMNS)
+        self.alarmStatus.evaluate(self.alarm_channels, data)
+        self.rolling_stats.addColumns(data, row - 1)
+        self.ingest_name = name
+        self.ingest_row = row
+        log.info("Resuming ingest of %s at row %d", name, row)
+
+    def ingest(self):
+        """Parse the rows appended to the newest DataLog file since the last call
+        into the series buffer, updating the alarm register once per sample.
+
+        When the analyzer has moved on to a new file, the rows appended to the
+        previous one since the last call are read first, and the rows of both
+        files go into the buffer in one append, so the sequence number runs on
+        across the rotation and no row is skipped."""
+        with STAGE_SECONDS.time("discovery"):
+            name = self._getFileName()
+        if name is None:
+            return 0
+        nRows, data = 0, None
+        fileStart = None
+        if name != self.ingest_name:
+            if self.ingest_name is not None:
+                try:
+                    self.ingest_row, nRows, data = self._readNewRows(self.ingest_name, self.ingest_row)
+                except (IOError, OSError), e:
+                    log.warning("Cannot finish reading %s: %s", self.ingest_name, e)
+                log.info("Rotated from %s (%d rows) to %s", self.ingest_name, self.ingest_row - 1, name)
+            self.ingest_row = 1
+            fileStart = self.series.nextSeq + nRows
+        self.ingest_row, newRows, newData = self._readNewRows(name, self.ingest_row)
+        if nRows == 0:
+            nRows, data = newRows, newData
+        elif newRows > 0:
+            data = dict((col, list(data[col][:nRows]) + list(newData[col][:newRows])) for col in RING_COLUMNS)
+            nRows += newRows
+        with STAGE_SECONDS.time("alarm"):
+            register = self.alarmStatus.register
+            states = self.alarmStatus.evaluate(self.alarm_channels, data)
+            self.alarm_log.recordBlock(self.alarmStatus.alarmMask, register, states, data["EPOCH_TIME"],
+                                       self.series.nextSeq)
+        if nRows > 0:
+            with STAGE_SECONDS.time("rolling_stats"):
+                self.rolling_stats.addColumns(data, nRows)
+                if self.stats_file is not None:
+                    self.stats_file.write(self.rolling_stats.snapshot())
+        self.series.appendColumns(data, nRows)
+        self.series.setStatus(self.alarmStatus.register, name, fileStart)
+        ROWS_INGESTED.inc(nRows)
+        self.ingest_name = name
+        return nRows
+
+    def ingestLoop(self):
+        while not self.ingest_stop.is_set():
+            try:
+                self.checkConfig()
+                self.ingest()
+            except Exception:
+                log.exception("Ingest failed")
+            self.series.tick()
+            self.ingest_stop.wait(self.ingest_interval)
+
+    def compactLoop(self):
+        """Archive the finished DataLog files every Archive_Interval seconds"""
+        while not self.ingest_stop.wait(self.archive_interval):
+            try:
+                with STAGE_SECONDS.time("compact"):
+                    FILES_ARCHIVED.inc(len(self.compactor.compactOnce(exclude=(self.ingest_name,))))
+            except Exception:
+                log.exception("Archiving failed")
+
+    def startCompactor(self):
+        if self.compactor is not None:
+            self.compact_thread = Thread(target=self.compactLoop, name="Compactor")
+            self.compact_thread.setDaemon(True)
+            self.compact_thread.start()
+
+    def startIngest(self):
+        self.ingest_thread = Thread(target=self.ingestLoop, name="Ingest")
+        self.ingest_thread.setDaemon(True)
+        self.ingest_thread.start()
+
+    def stopIngest(self):
+        self.ingest_stop.set()
+        self.series.tick()
+        if self.ingest_thread is not None:
+            self.ingest_thread.join()
+            self.ingest_thread = None
+        if self.compact_thread is not None:
+            self.compact_thread.join()
+            self.compact_thread = None
         
     def _getFileName(self):
-        try:
-            year = max(os.listdir(self.userlog))
-            month = max(os.listdir(os.path.join(self.userlog, year)))
-            day = max(os.listdir(os.path.join(self.userlog, year, month)))
-            names = sorted(glob.glob(os.path.join(self.userlog, year, month, day, "*.dat")))
-            return names[-1]
-        except:
-            return None
+        return self.locator.locate()
+
+    def getStats(self):
+        stats = {"role": self.role, "pid": os.getpid(), "config": self.config.stats(), "startup": self.startup}
+        if self.response_cache is not None:
+            stats["response_cache"] = self.response_cache.stats()
+        stats["control_jobs"] = self.control_jobs.stats()
+        if self.log_handler is not None:
+            stats["log"] = self.log_handler.stats()
+        if self.alarm_log is not None:
+            stats["alarm_log"] = self.alarm_log.stats()
+        if self.series is not None:
+            stats["series"] = {"file_name": self.series.status()[1], "next_seq": self.series.nextSeq,
+                               "shared": isinstance(self.series, SharedSeriesRing)}
+        if self.role != "worker":
+            stats["file_locator"] = self.locator.stats() if self.locator is not None else None
+            stats["tail"] = {"file_name": self.tail.name, "opens": self.tail.opens}
+            stats["ingest"] = {"file_name": self.ingest_name, "next_row": self.ingest_row}
+            stats["archive"] = self.compactor.stats() if self.compactor is not None else None
+        return stats
             
+    def feedSimulated(self, data, nRows, firstRow):
+        """Evaluate the shared alarm channels over nRows simulated rows, the
+        first numbered firstRow, log their transitions and add the rows to the
+        rolling statistics. simulate_data calls it once for each row."""
+        with STAGE_SECONDS.time("alarm"):
+            register = self.alarmStatus.register
+            states = self.alarmStatus.evaluate(self.alarm_channels, data)
+            self.alarm_log.recordBlock(self.alarmStatus.alarmMask, register, states, data["EPOCH_TIME"], firstRow)
+        self.rolling_stats.addColumns(data, nRows)
+
     def simulate_data(self, startRow):
-        if "Files" in self.simulation_dict: # replay data from files
-            data = dict(EPOCH_TIME=[],CH4=[],CO2=[],H2O=[])
-            fp = self.simulation_dict["CurrentFileHandle"]
-            buf = fp.readline()
-            while len(buf) == 0:    # reach the end of file
-                fp.close()
-                self.simulation_dict["CurrentFileIndex"] += 1
-                if self.simulation_dict["CurrentFileIndex"] >= len(self.simulation_dict["Files"]):
-                    self.simulation_dict["CurrentFileIndex"] = 0
-                self.simulation_dict["CurrentFile"] = self.simulation_dict["Files"][self.simulation_dict["CurrentFileIndex"]]
-                fp = open(self.simulation_dict["CurrentFile"], "r")
-                self.simulation_dict["CurrentFileHeader"] = fp.readline().split()
-                self.simulation_dict["CurrentFileHandle"] = fp
-                buf = fp.readline()
-            vals = buf.split()
-            for col, val in zip(self.simulation_dict["CurrentFileHeader"], vals):
-                if col == "Battery_Voltage":
-                    self.alarmStatus.setAlarm("battery_voltage", self.battery_monitor.checkValue(float(val)))
-                elif col in data:
-                    data[col].append(float(val))
-            result = {"next_row" : -1,
-                      "file_name" :  self.simulation_dict["CurrentFile"],
+        self.checkConfig()
+        if "Files" in self.simulation_dict: # replay data from files in real time
+            session = self.replay.defaultSession
+            with STAGE_SECONDS.time("replay"):
+                nextRow, clock, data = self.replay.poll(session, startRow, RING_COLUMNS)
+            nRows = len(data["EPOCH_TIME"])
+            with self.simulation_lock:
+                skip = min(max(self.replay_fed_row - (nextRow - nRows), 0), nRows)
+                if skip < nRows:
+                    self.feedSimulated(dict((col, values[skip:]) for col, values in data.items()),
+                                       nRows - skip, nextRow - nRows + skip)
+                    self.replay_fed_row = nextRow
+            del data["Battery_Voltage"]
+            result = {"next_row" : nextRow,
+                      "file_name" :  self.replay.fileName(nextRow - 1),
                       "alarm" : self.alarmStatus.register,
                       "data" : data}
         else:   # calculate data from predefined functions
             data = {}
             for k in self.simulation_dict:
                 if k == "Battery":
-                    self.alarmStatus.setAlarm("battery_voltage", 
-                        self.battery_monitor.checkValue(self.run_simulation_expression(self.simulation_dict[k], startRow)))
+                    data["Battery_Voltage"] = [self.run_simulation_expression(self.simulation_dict[k], startRow)]
                 else:
                     data[k] = [self.run_simulation_expression(self.simulation_dict[k], startRow)]
             data["EPOCH_TIME"] = [time.time()]
@@ -191,42 +651,124 @@ class BackpackServer(object):
                 self.simulation_index_increment = -1
             elif startRow == 1:
                 self.simulation_index_increment = 1
+            with self.simulation_lock:
+                now = data["EPOCH_TIME"][0]
+                if startRow == self.simulation_next_row or now - self.simulation_fed_time > SIMULATION_RESYNC:
+                    self.feedSimulated(data, 1, startRow)
+                    self.simulation_next_row = startRow + self.simulation_index_increment
+                    self.simulation_fed_time = now
+            del data["Battery_Voltage"]
             result = {"next_row" : startRow + self.simulation_index_increment,
                       "file_name" :  "simulation",
                       "alarm" : self.alarmStatus.register,
                       "data" : data}
         return result
         
-    def run_simulation_expression(self, expression, startRow):
-        if len(expression) > 0:
-            self.simulation_env["x"] = startRow
-            exec "simulation_result=" + expression in self.simulation_env
-            return self.simulation_env["simulation_result"]
+    def replayData(self, sessionId, startRow, speed=None, seek=None):
+        """Serve replayed rows for one client. Each session has its own replay
+        clock, cursor and battery alarm state, so concurrent viewers do not
+        affect each other. speed 0 serves up to Replay_Max_Batch rows per call.
+        A sessionId of None opens a new session; returns None if there is no
+        replay or no session sessionId."""
+        if self.replay is None:
+            return None
+        self.checkConfig()
+        session = self.replay.openSession(sessionId, speed)
+        if session is None:
+            return None
+        if session.channels is None:
+            session.channels = [channel.copy() for channel in self.alarm_channels]
+            session.alarm = AlarmRegister()
+            for channel in session.channels:
+                session.alarm.addAlarm(channel.name, channel.mask)
+        if speed is not None and speed != session.speed:
+            self.replay.setSpeed(session, speed)
+        if seek is not None:
+            startRow = self.replay.seek(session, seek)
+        with STAGE_SECONDS.time("replay"):
+            nextRow, clock, data = self.replay.poll(session, startRow, RING_COLUMNS)
+        with STAGE_SECONDS.time("alarm"):
+            session.alarm.evaluate(session.channels, data)
+        del data["Battery_Voltage"]
+        result = {"next_row" : nextRow,
+                  "file_name" :  self.replay.fileName(nextRow - 1),
+                  "alarm" : session.alarm.register,
+                  "session" : session.sessionId,
+                  "speed" : session.speed,
+                  "replay_time" : clock,
+                  "data" : data}
+        return result
+
+    def run_simulation_expression(self, code, startRow):
+        if code is not None:
+            return eval(code, self.simulation_env, {"x": startRow})
         else:
             return 0.0
-    
+
+    def run_simulation_batch(self, code, xs):
+        """Evaluate a compiled simulation expression for every x in xs in one
+        call, over a NumPy vector of xs. An expression which cannot be evaluated
+        over a vector (e.g. "20 if x<15 else 15"), or which hits a floating point
+        error there, is evaluated one x at a time, so that it gives the same
+        values and errors as run_simulation_expression. Returns a float array,
+        or a list without NumPy."""
+        if numpy is None:
+            return [float(self.run_simulation_expression(code, x)) for x in xs]
+        vector = numpy.asarray(xs)
+        if code is None:
+            return numpy.zeros(len(vector))
+        try:
+            with numpy.errstate(divide="raise", over="raise", invalid="raise"):
+                values = numpy.asarray(eval(code, self.simulation_vector_env, {"x": vector}), dtype=float)
+            if values.shape == vector.shape:
+                return values
+            if values.ndim == 0 and "x" not in code.co_names:
+                return numpy.full(len(vector), float(values))
+        except Exception:
+            pass
+        return numpy.array([self.run_simulation_expression(code, x) for x in xs], dtype=float)
+
+    def simulateRows(self, xs):
+        """Return the simulated CH4, CO2, H2O and Battery_Voltage of the rows
+        numbered xs, each column computed by one run_simulation_batch call"""
+        self.checkConfig()
+        data = {}
+        for k in ("CH4", "CO2", "H2O", "Battery"):
+            data["Battery_Voltage" if k == "Battery" else k] = self.run_simulation_batch(self.simulation_dict[k], xs)
+        return data
+
     def act_on_command(self, command):
+        """Carry out a control command. This makes the RPC to the analyzer and
+        blocks until it answers, so it is run by the control job queue."""
         if command == "shutdown":
-            if self.simulation:
-                print "Shut down analyzer per request of the user."
-            else:
-                self.inst_mgr.INSTMGR_ShutdownRpc(2)  # Turn Off Analyzer in Current State
+            self._rpc(self.inst_mgr).INSTMGR_ShutdownRpc(2)  # Turn Off Analyzer in Current State
         elif command == "restartUserlog":
-            if self.simulation:
-                print "Restart userlog per request of the user."
-            else:
-                self.logger.startUserLogs(["DataLog_User_Minimal"], True)
+            self._rpc(self.logger).startUserLogs(["DataLog_User_Minimal"], True)
         elif command == "about":
-            if self.simulation:
-                print "Version information requested."
-                return {'host release': 'mobile-2.4.2.24 (3102146b)', 
-                    'config - app version no': '1.0.5', 
-                    'config - instr version no': '9fa0b2b'}
-            else:
-                return self.driver.allVersions()
+            versions = self._rpc(self.driver).allVersions()
+            self.about_cache.set(versions)
+            return versions
+
+    def _rpc(self, proxy):
+        if proxy is None:
+            raise JSON_Remote_Procedure_Error("No connection to the analyzer")
+        return proxy
+
+    def submitCommand(self, command, timeout=0.0):
+        """Queue a control command and wait up to timeout seconds for it to
+        finish. Returns its job."""
+        job = self.control_jobs.submit(command)
+        job.wait(min(timeout, self.max_wait))
+        return job
     
     def run(self):
         self.loadConfig()
+        self.startCompactor()
+        self.markStartup("loaded")
+        if self.role == "ingest":
+            self.ingestLoop()
+        elif not self.simulation and self.role == "standalone":
+            self.startIngest()
         #self.startServer()
      
 HELP_STRING = \
@@ -237,13 +779,18 @@ Where the options can be a combination of the following:
 -h              Print this help.
 -c              Specify a different config file.  Default = "./backpackServer.ini"
 -s              Simulation mode.
+-i              Ingest only: write the DataLog rows and alarm register to the [Setup] Shared_Ring
+                file for WSGI workers (see backpackWsgi.py) instead of serving HTTP.
+
+Set the environment variable BACKPACK_CONFIG_CACHE to a directory to share the parsed
+config file between processes (see ConfigCache.py).
 """
 
 def PrintUsage():
     print HELP_STRING
 def HandleCommandSwitches():
     import getopt
-    shortOpts = 'hc:s'
+    shortOpts = 'hc:si'
     longOpts = ["help"]
     try:
         switches, args = getopt.getopt(sys.argv[1:], shortOpts, longOpts)
@@ -271,37 +818,30 @@ def HandleCommandSwitches():
         configFile = options["-c"]
         print "Config file specified at command line: %s" % configFile
     simulation = True if "-s" in options else False
+    role = "ingest" if "-i" in options else "standalone"
     
-    return (configFile, simulation)    
+    return (configFile, simulation, role)    
     
-backpack_server = BackpackServer(*HandleCommandSwitches())
+backpack_server = None
             
-class SeriesAPI(Resource):
-    def get(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('startRow', type=int, required=True)
-        request_dict = parser.parse_args()
-        print request_dict
-        return backpack_server.getData(request_dict['startRow'])
-        
-class ControlAPI(Resource):
-    def get(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('command', type=str, required=True)
-        request_dict = parser.parse_args()
-        print "CAPIget:",request_dict
-        return backpack_server.act_on_command(request_dict['command'])
-    
-    def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument('command', type=str, required=True)
-        request_dict = parser.parse_args()
-        backpack_server.act_on_command(request_dict['command'])
-        print "CAPIpost:", request_dict
-        return {}
+def createApp(configFile, simulation=False, role="standalone"):
+    """App factory: run a BackpackServer on configFile and return the Flask app
+    serving it. Flask and Flask-RESTful are imported here, not when this module
+    is imported."""
+    global backpack_server
+    backpack_server = BackpackServer(configFile, simulation, role)
+    backpack_server.run()
+    import backpackApi
+    return backpackApi.createApp(backpack_server)
+
+def createWsgiApp(configFile, simulation=False, role="worker"):
+    """Return the Flask app for a WSGI worker process; role "worker" serves the
+    data written to the shared ring by a separate "backpackServer.py -i" process."""
+    if not os.path.exists(configFile):
+        raise IOError("Configuration file not found: %s" % configFile)
+    return createApp(configFile, simulation, role)
             
 if __name__ == '__main__':
-    backpack_server.run()
-    api.add_resource(SeriesAPI, '/api/v1.0/series', endpoint='series')
-    api.add_resource(ControlAPI, '/api/v1.0/control', endpoint='control')
+    configFile, simulation, role = HandleCommandSwitches()
+    app = createApp(configFile, simulation, role)
     app.run(**backpack_server.setup)
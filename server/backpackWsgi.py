@@ -0,0 +1,32 @@
+#!/usr/bin/python
+#
+# File Name: backpackWsgi.py
+# Purpose: WSGI entry point for serving the Backpack API from several worker processes.
+# Notes:
+#               The Flask development server started by backpackServer0.py runs in one process. For
+#               production, run exactly one ingest process, which owns the DataLog tail and the alarm
+#               state machine and writes them to the [Setup] Shared_Ring file:
+#
+#                   python backpackServer0.py -c backpackServer.ini -i
+#
+#               and serve this module's "application" from a multi-process WSGI server, e.g.
+#
+#                   BACKPACK_CONFIG=backpackServer.ini gunicorn -w 4 -k gthread --threads 8 \
+#                       -b 0.0.0.0:3000 backpackWsgi:application
+#
+#               The gthread worker (which needs the "futures" package under Python 2) lets long-poll and
+#               stream requests wait without tying up a whole process. Every worker maps the same ring
+#               read-only, so they all serve the same rows and the same alarm register. Each worker checks
+#               the config file on requests, at most every [Setup] Config_Check_Interval seconds, and
+#               applies changes itself.
+#               Set BACKPACK_SIMULATION=1 to serve simulated data instead.
+#
+
+"""WSGI application for multi-process serving of the Backpack API."""
+import os
+
+from backpackServer0 import createWsgiApp
+
+configFile = os.environ.get("BACKPACK_CONFIG",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "backpackServer.ini"))
+application = createWsgiApp(configFile, os.environ.get("BACKPACK_SIMULATION") == "1", role="worker")
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+#
+# File Name: configBenchmark.py
+# Purpose: Measure the load and lookup cost of CustomConfigObj against plain ConfigObj.
+# Notes:
+#               Writes an analyzer-sized .ini file (many sections of many options, in mixed case) to a
+#               temporary directory, then times loading it (also through the parsed-file cache of
+#               ConfigCache.py) and the common ConfigParser-style calls with CustomConfigObj, and the
+#               equivalent dictionary access on a plain ConfigObj. Results are written as JSON, so runs
+#               of different versions can be compared with --compare.
+#
+
+"""Benchmark of CustomConfigObj against ConfigObj.
+
+configBenchmark.py [-h] [-o<FILENAME>] [options]
+
+Run with -h for the list of options.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import configobj
+from ConfigCache import ParsedConfigCache
+from CustomConfigObj import CustomConfigObj
+from backpackBenchmark import gitVersion
+
+
+def writeIni(name, sections, options):
+    fp = open(name, "w")
+    for s in range(sections):
+        fp.write("[Section_%d]\n" % s)
+        for o in range(options):
+            fp.write("Option_Name_%d = %d.%d\n" % (o, s, o))
+    fp.close()
+
+
+def timeIt(func, repeat):
+    """Return the mean time of func() in microseconds"""
+    start = time.time()
+    for i in xrange(repeat):
+        func()
+    return (time.time() - start) / repeat * 1e6
+
+
+def runBenchmark(name, sections, options, repeat, cacheDir):
+    keys = [("Section_%d" % (i % sections), "Option_Name_%d" % (i*7 % options)) for i in range(1000)]
+    lowerKeys = [(s, o.lower()) for s, o in keys]
+    results = {}
+    loads = max(1, repeat // 100)
+    results["load_configobj_us"] = timeIt(lambda: configobj.ConfigObj(name, list_values=False), loads)
+    results["load_custom_us"] = timeIt(lambda: CustomConfigObj(name), loads)
+    cache = ParsedConfigCache(cacheDir)
+    CustomConfigObj(name, cache=cache)
+    results["load_custom_cached_us"] = timeIt(lambda: CustomConfigObj(name, cache=cache), loads)
+    plain = configobj.ConfigObj(name, list_values=False)
+    custom = CustomConfigObj(name)
+
+    def plainLookups():
+        for s, o in keys:
+            plain[s][o]
+    def customLookups():
+        for s, o in keys:
+            custom.get(s, o)
+    def customCaseLookups():
+        for s, o in lowerKeys:
+            custom.get(s, o)
+    def customSets():
+        for s, o in keys:
+            custom.set(s, o, "1.0")
+    def customItems():
+        for s in range(0, sections, max(1, sections // 10)):
+            custom.list_items("Section_%d" % s)
+    def customCaseToggle():
+        custom.ignore_option_case_off()
+        custom.ignore_option_case_on()
+    results["lookup_configobj_us"] = timeIt(plainLookups, repeat) / len(keys)
+    results["lookup_custom_us"] = timeIt(customLookups, repeat) / len(keys)
+    results["lookup_custom_other_case_us"] = timeIt(customCaseLookups, repeat) / len(keys)
+    results["set_custom_us"] = timeIt(customSets, repeat) / len(keys)
+    results["list_items_custom_us"] = timeIt(customItems, repeat) / 10
+    results["case_toggle_custom_us"] = timeIt(customCaseToggle, repeat)
+    updates = dict(("option_name_%d" % o, o) for o in range(options))
+    results["update_many_custom_us"] = timeIt(lambda: custom.update_many("Section_0", updates), repeat)
+    return results
+
+
+def compareResults(old, new):
+    print "%-32s %14s %14s %8s" % ("measurement", old["version"], new["version"], "ratio")
+    for key in sorted(new["results"]):
+        a = old["results"].get(key)
+        b = new["results"][key]
+        ratio = "%.2f" % (b / a) if a else "-"
+        print "%-32s %14s %14.3f %8s" % (key, "%.3f" % a if a is not None else "-", b, ratio)
+
+
+HELP_STRING = \
+"""\
+configBenchmark.py [-h] [-o<FILENAME>] [options]
+
+Where the options can be a combination of the following:
+-h                      Print this help.
+-o                      Write the JSON results to this file instead of stdout.
+--sections=N            Sections in the generated file. Default = 200
+--options=N             Options in each section. Default = 50
+--repeat=N              Repetitions of each lookup measurement. Default = 200
+--compare=FILENAME      Print a comparison with the results of an earlier run.
+"""
+
+def PrintUsage():
+    print HELP_STRING
+
+def HandleCommandSwitches():
+    import getopt
+    shortOpts = 'ho:'
+    longOpts = ["help", "sections=", "options=", "repeat=", "compare="]
+    try:
+        switches, args = getopt.getopt(sys.argv[1:], shortOpts, longOpts)
+    except getopt.GetoptError, data:
+        print "%s %r" % (data, data)
+        sys.exit(1)
+    options = dict(switches)
+    if "-h" in options or "--help" in options:
+        PrintUsage()
+        sys.exit()
+    return options
+
+
+def main():
+    options = HandleCommandSwitches()
+    params = {"sections": int(options.get("--sections", 200)),
+              "options": int(options.get("--options", 50)),
+              "repeat": int(options.get("--repeat", 200))}
+    workDir = tempfile.mkdtemp(prefix="config_bench_")
+    try:
+        name = os.path.join(workDir, "bench.ini")
+        writeIni(name, params["sections"], params["options"])
+        report = {"version": gitVersion(), "timestamp": time.time(), "params": params,
+                  "results": runBenchmark(name, params["sections"], params["options"], params["repeat"],
+                                            os.path.join(workDir, "cache"))}
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if "-o" in options:
+        open(options["-o"], "w").write(text + "\n")
+    else:
+        print text
+    if "--compare" in options:
+        compareResults(json.load(open(options["--compare"])), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+#
+# File Name: test_AlarmLog.py
+# Purpose: Checks of the append-only alarm transition log.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of AlarmLog.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import AlarmLog
+from AlarmLog import AlarmLog as Log
+
+MASKS = {"battery_voltage": 0x1, "ch4_high": 0x2}
+
+
+class RecordBlockTest(unittest.TestCase):
+    def transitions(self):
+        log = Log()
+        states = {"battery_voltage": [False, True, True, False, False],
+                  "ch4_high": [True, True, False, False, True]}
+        times = [100.0, 101.0, 102.0, 103.0, 104.0]
+        self.assertEqual(log.recordBlock(MASKS, 0x0, states, times, 11), 5)
+        return log.query(since=1)
+
+    def testTransitions(self):
+        nextEvent, events = self.transitions()
+        self.assertEqual(nextEvent, 6)
+        self.assertEqual(events, [(1, 100.0, 11, 0x2, 0x2),
+                                  (2, 101.0, 12, 0x1, 0x3),
+                                  (3, 102.0, 13, 0x2, 0x1),
+                                  (4, 103.0, 14, 0x1, 0x0),
+                                  (5, 104.0, 15, 0x2, 0x2)])
+
+    def testWithoutNumpy(self):
+        numpy = AlarmLog.numpy
+        AlarmLog.numpy = None
+        try:
+            withoutNumpy = self.transitions()
+        finally:
+            AlarmLog.numpy = numpy
+        self.assertEqual(withoutNumpy, self.transitions())
+
+    def testStartsFromRegister(self):
+        log = Log()
+        # The battery alarm was already on; staying on is not a transition
+        self.assertEqual(log.recordBlock(MASKS, 0x1, {"battery_voltage": [True, True]}, [1.0, 2.0], 1), 0)
+        self.assertEqual(log.stats()["events"], 0)
+
+
+class QueryTest(unittest.TestCase):
+    def setUp(self):
+        self.log = Log()
+        self.log.append([(100.0 + i, i + 1, 0x1, i % 2) for i in range(20)])
+
+    def testSince(self):
+        nextEvent, events = self.log.query(since=18)
+        self.assertEqual((nextEvent, [e[0] for e in events]), (21, [18, 19, 20]))
+        self.assertEqual(self.log.query(since=21), (21, []))
+        nextEvent, events = self.log.query(since=1, limit=5)
+        self.assertEqual((nextEvent, [e[0] for e in events]), (6, [1, 2, 3, 4, 5]))
+
+    def testTimeRange(self):
+        nextEvent, events = self.log.query(start=104.5, end=107.0)
+        self.assertEqual([e[1] for e in events], [105.0, 106.0, 107.0])
+        self.assertEqual([e[1] for e in self.log.query(start=118.0)[1]], [118.0, 119.0])
+        self.assertEqual([e[1] for e in self.log.query(end=101.0)[1]], [100.0, 101.0])
+        self.assertEqual(self.log.query(start=200.0)[1], [])
+
+    def testOlderEventsAreNotAppended(self):
+        self.assertEqual(self.log.append([(119.0, 20, 0x1, 0), (118.0, 19, 0x1, 1), (120.0, 21, 0x1, 0)]), 1)
+        self.assertEqual(self.log.stats()["events"], 21)
+
+
+class LogFileTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_alarms_")
+        self.name = os.path.join(self.root, "ring.bin.alarms")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def testReaderSeesOwnerAndHistorySurvivesRestart(self):
+        reader = Log(self.name, create=False)
+        self.assertEqual(reader.query(since=1), (1, []))
+        owner = Log(self.name)
+        owner.append([(100.0, 1, 0x1, 0x1)])
+        self.assertEqual(reader.query(since=1)[1], [(1, 100.0, 1, 0x1, 0x1)])
+        # A restarted owner keeps the history and does not log the same samples again
+        owner = Log(self.name)
+        self.assertEqual(owner.append([(100.0, 1, 0x1, 0x1), (101.0, 2, 0x1, 0x0)]), 1)
+        self.assertEqual(reader.query(since=2)[1], [(2, 101.0, 2, 0x1, 0x0)])
+
+    def testNotAnAlarmLog(self):
+        open(self.name, "wb").write("not an alarm log")
+        self.assertRaises(IOError, Log, self.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+#
+# File Name: test_AlarmMonitor.py
+# Purpose: Checks that the block evaluation of ThresholdMonitor matches the per-sample state machine.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of AlarmMonitor.py."""
+import random
+import unittest
+
+import AlarmMonitor
+from AlarmMonitor import AlarmChannel, AlarmRegister, ThresholdMonitor
+
+
+def randomValues(rng, n, threshold):
+    """Values around threshold in runs of random length, with NaNs and values
+    exactly on the threshold mixed in"""
+    values = []
+    while len(values) < n:
+        side = rng.choice((-1, 1))
+        for i in range(rng.randint(1, 15)):
+            r = rng.random()
+            if r < 0.05:
+                values.append(float("nan"))
+            elif r < 0.1:
+                values.append(threshold)
+            else:
+                values.append(threshold + side*rng.uniform(0.01, 2.0))
+    return values[:n]
+
+
+class CheckValuesTest(unittest.TestCase):
+    def setUp(self):
+        if AlarmMonitor.numpy is None:
+            self.skipTest("the block evaluation needs NumPy")
+
+    def testMatchesCheckValue(self):
+        rng = random.Random(16)
+        for trial in range(500):
+            threshold = rng.uniform(-5.0, 25.0)
+            trigger = rng.randint(0, 12)
+            cancel = rng.randint(0, 6)
+            above = rng.random() < 0.5
+            scalar = ThresholdMonitor(threshold, trigger, cancel, above)
+            block = ThresholdMonitor(threshold, trigger, cancel, above)
+            # Start both from the same, possibly mid-alarm, state
+            for v in randomValues(rng, rng.randint(0, 40), threshold):
+                scalar.checkValue(v)
+            block.setState(scalar.getState())
+            for size in (rng.randint(1, 200) for i in range(5)):
+                values = randomValues(rng, size, threshold)
+                expected = [scalar.checkValue(v) for v in values]
+                result, state = block.checkValues(values)
+                self.assertEqual(result, expected, (trial, threshold, trigger, cancel, above))
+                self.assertEqual(state, scalar.getState())
+                self.assertEqual(block.getState(), scalar.getState())
+
+    def testShortBlocksUseCheckValue(self):
+        monitor = ThresholdMonitor(18.9, 3, 2)
+        reference = ThresholdMonitor(18.9, 3, 2)
+        values = [20.0, 18.0, 18.0, 18.0, 18.0, 20.0, 20.0, 20.0]
+        self.assertEqual(monitor.checkValues(values)[0], [reference.checkValue(v) for v in values])
+
+
+class AlarmRegisterTest(unittest.TestCase):
+    def testRegisterFollowsLastSample(self):
+        register = AlarmRegister()
+        channel = AlarmChannel("ch4_high", "CH4", 0x2, [ThresholdMonitor(2.5, 2, 1, above=True)])
+        register.addAlarm(channel.name, channel.mask)
+        states = register.evaluate([channel], {"CH4": [3.0, 3.0, 3.0, 3.0]})
+        self.assertEqual(states["ch4_high"], [False, False, True, True])
+        self.assertEqual(register.register, 0x2)
+        register.evaluate([channel], {"CH4": [2.0, 2.0, 2.0]})
+        self.assertEqual(register.register, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# File Name: test_ControlJobs.py
+# Purpose: Checks of the control command job queue and of the local stand-in RPC objects.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of ControlJobs.py and LocalRpc.py."""
+import logging
+import time
+import unittest
+from threading import Event
+
+from ControlJobs import JobQueue, TtlValue
+from LocalRpc import LocalDataLogger, LocalDriver, LocalInstMgr, VERSIONS
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.release = Event()
+        self.ran = []
+        logging.getLogger("ControlJobs").disabled = True
+
+    def tearDown(self):
+        self.release.set()
+        logging.getLogger("ControlJobs").disabled = False
+
+    def runCommand(self, command):
+        self.ran.append(command)
+        if command == "block":
+            self.release.wait(5)
+        if command == "fail":
+            raise RuntimeError("analyzer did not answer")
+        return command.upper()
+
+    def testJobsRunInOrder(self):
+        queue = JobQueue(self.runCommand)
+        jobs = [queue.submit(command) for command in ("a", "b", "c")]
+        for job in jobs:
+            self.assertTrue(job.wait(5))
+        self.assertEqual([job.result for job in jobs], ["A", "B", "C"])
+        self.assertEqual(self.ran, ["a", "b", "c"])
+        self.assertEqual([job.state for job in queue.list()], ["done"]*3)
+        self.assertTrue(queue.get(jobs[1].jobId) is jobs[1])
+        self.assertEqual(queue.get(99), None)
+        self.assertEqual(queue.stats()["completed"], 3)
+
+    def testSameCommandSharesJob(self):
+        queue = JobQueue(self.runCommand)
+        blocking = queue.submit("block")
+        first = queue.submit("about")
+        self.assertTrue(queue.submit("about") is first)
+        self.assertTrue(queue.submit("block") is blocking)
+        self.assertFalse(first.wait(0))
+        self.release.set()
+        self.assertTrue(first.wait(5))
+        self.assertEqual(self.ran, ["block", "about"])
+        # Once finished, the command runs again
+        again = queue.submit("about")
+        self.assertFalse(again is first)
+        self.assertTrue(again.wait(5))
+
+    def testFailedJob(self):
+        queue = JobQueue(self.runCommand)
+        job = queue.submit("fail")
+        self.assertTrue(job.wait(5))
+        self.assertEqual((job.state, job.error, job.result), ("failed", "analyzer did not answer", None))
+        self.assertEqual(queue.stats()["failed"], 1)
+        self.assertEqual(job.asDict()["state"], "failed")
+
+    def testHistoryKeepsUnfinishedJobs(self):
+        queue = JobQueue(self.runCommand, maxHistory=2)
+        jobs = [queue.submit(command) for command in ("a", "b", "c")]
+        for job in jobs:
+            job.wait(5)
+        queue.submit("d").wait(5)
+        self.assertEqual([job.command for job in queue.list()], ["c", "d"])
+        # Jobs still queued or running are never dropped from the history
+        queue.submit("block")
+        queue.submit("e")
+        queue.submit("f")
+        self.assertEqual([job.command for job in queue.list()], ["block", "e", "f"])
+
+
+class TtlValueTest(unittest.TestCase):
+    def testExpires(self):
+        value = TtlValue(0.05)
+        self.assertEqual(value.get(), None)
+        value.set({"a": 1})
+        self.assertEqual(value.get(), {"a": 1})
+        time.sleep(0.1)
+        self.assertEqual(value.get(), None)
+
+
+class LocalRpcTest(unittest.TestCase):
+    def testCallsAreRecorded(self):
+        driver = LocalDriver()
+        versions = driver.allVersions()
+        self.assertEqual(versions, VERSIONS)
+        versions["host release"] = "changed"
+        self.assertEqual(driver.allVersions(), VERSIONS)
+        logger = LocalDataLogger()
+        logger.startUserLogs(["DataLog_User_Minimal"], True)
+        self.assertEqual(logger.calls, [("startUserLogs", ["DataLog_User_Minimal"], True)])
+        instMgr = LocalInstMgr()
+        instMgr.INSTMGR_ShutdownRpc(2)
+        self.assertEqual(instMgr.calls, [("INSTMGR_ShutdownRpc", 2)])
+
+    def testDelay(self):
+        started = time.time()
+        LocalDriver(0.05).allVersions()
+        self.assertTrue(time.time() - started >= 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+#
+# File Name: test_DataArchive.py
+# Purpose: Checks of the DataLog archive format and of the compactor.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of DataArchive.py."""
+from bisect import bisect_left, bisect_right
+import os
+import random
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+import DataArchive
+from DataArchive import ArchiveCompactor, ArchiveReader, ArchiveWriter, archiveName
+from backpackBenchmark import DataLogWriter
+
+
+def bits(values):
+    """The float64 bit patterns of values, so that NaNs compare equal"""
+    values = [float(v) for v in values]
+    return struct.unpack("<%dq" % len(values), struct.pack("<%dd" % len(values), *values))
+
+
+class RandomRoundTripTest(unittest.TestCase):
+    """Archives of random columns read back bit for bit, with and without NumPy"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_archive_")
+        self.numpy = DataArchive.numpy
+
+    def tearDown(self):
+        DataArchive.numpy = self.numpy
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def randomColumns(self, rng, nRows):
+        t = rng.uniform(1e9, 2e9)
+        times = []
+        for i in range(nRows):
+            times.append(t)
+            t += rng.choice((1.0, 1.0, 1.0, 0.25, 7.5, rng.uniform(0.001, 1000.0)))
+        special = [float("nan"), float("inf"), -float("inf"), 0.0, -0.0, 5e-324, 1.7976931348623157e308]
+        values = [rng.choice(special) if rng.random() < 0.05 else rng.gauss(0.0, 10.0**rng.randint(-6, 6))
+                  for i in range(nRows)]
+        steps = [float(i % 7) for i in range(nRows)]
+        flags = ["%d" % rng.randint(0, 1) if rng.random() < 0.5 else "x%d" % i for i in range(nRows)]
+        return {"EPOCH_TIME": times, "VALUE": values, "STEP": steps, "FLAG": flags}
+
+    def roundTrip(self, rng, encodeWithNumpy, decodeWithNumpy):
+        nRows = rng.randint(1, 3000)
+        chunkRows = rng.choice((1, 7, 100, 512, 4096))
+        data = self.randomColumns(rng, nRows)
+        columns = ["EPOCH_TIME", "VALUE", "STEP", "FLAG"]
+        name = os.path.join(self.root, "r.dla")
+        DataArchive.numpy = self.numpy if encodeWithNumpy else None
+        writer = ArchiveWriter(name, columns, chunkRows, ["FLAG"])
+        for lo in range(0, nRows, chunkRows):
+            hi = min(lo + chunkRows, nRows)
+            writer.addChunk(dict((col, data[col][lo:hi]) for col in columns), hi - lo)
+        writer.close()
+        DataArchive.numpy = self.numpy if decodeWithNumpy else None
+        reader = ArchiveReader(name)
+        try:
+            self.assertEqual((reader.rows, reader.columns, reader.textColumns), (nRows, columns, set(["FLAG"])))
+            self.assertEqual((reader.first, reader.last), (data["EPOCH_TIME"][0], data["EPOCH_TIME"][-1]))
+            for i in range(20):
+                lo = rng.randint(-5, nRows + 5)
+                hi = rng.randint(lo, nRows + 10)
+                n, read = reader.readRows(lo, hi, columns + ["MISSING"])
+                a = max(lo, 1) - 1
+                b = max(min(hi, nRows + 1) - 1, a)
+                self.assertEqual(n, b - a)
+                for col in ("EPOCH_TIME", "VALUE", "STEP"):
+                    self.assertEqual(bits(read[col]), bits(data[col][a:b]))
+                self.assertEqual(list(read["FLAG"]), data["FLAG"][a:b])
+                self.assertTrue(all(v != v for v in read["MISSING"]))
+                t = rng.uniform(data["EPOCH_TIME"][0] - 10, data["EPOCH_TIME"][-1] + 10)
+                if rng.random() < 0.3:
+                    t = rng.choice(data["EPOCH_TIME"])
+                self.assertEqual(reader.findRow(t), bisect_left(data["EPOCH_TIME"], t) + 1)
+                self.assertEqual(reader.findRow(t, right=True), bisect_right(data["EPOCH_TIME"], t) + 1)
+        finally:
+            reader.close()
+
+    def testRoundTrip(self):
+        rng = random.Random(21)
+        for trial in range(30):
+            self.roundTrip(rng, True, True)
+
+    def testWithoutNumpy(self):
+        rng = random.Random(22)
+        for trial in range(10):
+            self.roundTrip(rng, rng.random() < 0.5, rng.random() < 0.5)
+
+    def testEncodersGiveTheSameStreams(self):
+        if self.numpy is None:
+            self.skipTest("needs NumPy to compare with")
+        rng = random.Random(23)
+        data = self.randomColumns(rng, 1000)
+        for col, delta in (("EPOCH_TIME", True), ("VALUE", False)):
+            DataArchive.numpy = self.numpy
+            stream = DataArchive._encodeColumn(data[col], delta)
+            DataArchive.numpy = None
+            self.assertEqual(DataArchive._encodeColumn(data[col], delta), stream)
+
+
+class CompactGeneratedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_archive_")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def compactGenerated(self):
+        writer = DataLogWriter(self.root, columns=12, rate=1.0, backlog=1000, startTime=1466117932.0)
+        writer.close()
+        old = time.time() - 3600
+        os.utime(writer.name, (old, old))
+        compactor = ArchiveCompactor(self.root, chunkRows=128, minAge=60.0, keepText=False)
+        written = compactor.compactOnce()
+        self.assertEqual(written, [archiveName(writer.name)])
+        self.assertEqual(compactor.failed, 0)
+        self.assertFalse(os.path.exists(writer.name))
+        reader = ArchiveReader(written[0])
+        try:
+            self.assertEqual(reader.columns, writer.header)
+            self.assertEqual(reader.textColumns, set(["DATE", "TIME"]))
+            nRows, data = reader.readRows(1, reader.rows + 1, writer.header)
+            self.assertEqual(nRows, 1000)
+            for i in range(nRows):
+                expected = writer._row(i).split()
+                for col, value in zip(writer.header, expected):
+                    if col in reader.textColumns:
+                        self.assertEqual(data[col][i], value)
+                    else:
+                        self.assertEqual(float(data[col][i]), float(value))
+        finally:
+            reader.close()
+
+    def testCompactGeneratedFile(self):
+        self.compactGenerated()
+
+    def testCompactGeneratedFileWithoutNumpy(self):
+        numpy = DataArchive.numpy
+        DataArchive.numpy = None
+        try:
+            self.compactGenerated()
+        finally:
+            DataArchive.numpy = numpy
+
+    def testMismatchedArchiveKeepsText(self):
+        writer = DataLogWriter(self.root, columns=8, rate=1.0, backlog=100, startTime=1466117932.0)
+        writer.close()
+        old = time.time() - 3600
+        os.utime(writer.name, (old, old))
+        open(archiveName(writer.name), "wb").write("not an archive")
+        ArchiveCompactor(self.root, minAge=60.0, keepText=False).compactOnce()
+        self.assertTrue(os.path.exists(writer.name))
+
+
+if __name__ == '__main__':
+    unittest.main()
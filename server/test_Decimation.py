@@ -0,0 +1,97 @@
+#!/usr/bin/python
+#
+# File Name: test_Decimation.py
+# Purpose: Checks that min/max decimation keeps the extremes of the series.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of Decimation.py."""
+import random
+import unittest
+
+from Decimation import LevelBuilder, minMaxDecimate
+
+COLUMNS = ["CH4", "CO2"]
+
+
+def randomSeries(rng, n, t=1466117932.0):
+    data = {"EPOCH_TIME": [], "CH4": [], "CO2": []}
+    for i in range(n):
+        t += rng.choice((0.5, 1.0, 1.0, 3.0))
+        data["EPOCH_TIME"].append(t)
+        data["CH4"].append(rng.gauss(2.0, 0.1) + (50.0 if rng.random() < 0.01 else 0.0))
+        data["CO2"].append(rng.gauss(400.0, 5.0))
+    return data
+
+
+class MinMaxDecimateTest(unittest.TestCase):
+    def testSmallSeriesUnchanged(self):
+        data = randomSeries(random.Random(1), 10)
+        self.assertTrue(minMaxDecimate(data, 10) is data)
+
+    def testBucketExtremesAreKept(self):
+        rng = random.Random(6)
+        for trial in range(50):
+            n = rng.randint(3, 2000)
+            maxPoints = rng.randint(2, 300)
+            data = randomSeries(rng, n)
+            result = minMaxDecimate(data, maxPoints)
+            if n <= maxPoints:
+                continue
+            self.assertTrue(len(result["EPOCH_TIME"]) <= maxPoints)
+            self.assertEqual(result["EPOCH_TIME"], sorted(result["EPOCH_TIME"]))
+            nBuckets = maxPoints // 2
+            for b in range(nBuckets):
+                lo, hi = b*n // nBuckets, (b + 1)*n // nBuckets
+                times = data["EPOCH_TIME"][lo:hi]
+                rows = [i for i, t in enumerate(result["EPOCH_TIME"]) if times[0] <= t <= times[-1]]
+                for col in COLUMNS:
+                    kept = [result[col][i] for i in rows]
+                    self.assertEqual((min(kept), max(kept)), (min(data[col][lo:hi]), max(data[col][lo:hi])))
+
+    def testExtremesInOrder(self):
+        data = {"EPOCH_TIME": [1.0, 2.0, 3.0, 4.0], "CH4": [5.0, 1.0, 9.0, 4.0], "CO2": [7.0, 8.0, 6.0, 6.5]}
+        result = minMaxDecimate(data, 2)
+        self.assertEqual(result, {"EPOCH_TIME": [1.0, 4.0], "CH4": [1.0, 9.0], "CO2": [8.0, 6.0]})
+
+
+class LevelBuilderTest(unittest.TestCase):
+    def testChainedLevelsKeepExtremes(self):
+        rng = random.Random(60)
+        data = randomSeries(rng, 3000)
+        rows = [(t, [data[col][i] for col in COLUMNS]) for i, t in enumerate(data["EPOCH_TIME"])]
+        fine = LevelBuilder(10, COLUMNS)
+        coarse = LevelBuilder(60, COLUMNS)
+        i = 0
+        while i < len(rows):
+            n = rng.randint(1, 100)
+            coarse.addRows(fine.addRows(rows[i:i + n]))
+            i += n
+        start, end = data["EPOCH_TIME"][0], data["EPOCH_TIME"][-1]
+        result = coarse.read(start, end, ["EPOCH_TIME"] + COLUMNS, finer=[fine])
+        self.assertEqual(result["EPOCH_TIME"], sorted(result["EPOCH_TIME"]))
+        self.assertTrue(len(result["EPOCH_TIME"]) < len(rows) // 10)
+        for col in COLUMNS:
+            self.assertEqual((min(result[col]), max(result[col])), (min(data[col]), max(data[col])))
+        # Every completed coarse bucket holds the extremes of its rows
+        buckets = {}
+        for t, row in rows:
+            buckets.setdefault(int(t // 60), []).append(row)
+        for t, values in zip(coarse.data["EPOCH_TIME"], zip(*[coarse.data[col] for col in COLUMNS])):
+            bucket = buckets[int(t // 60)]
+            for k, col in enumerate(COLUMNS):
+                self.assertTrue(values[k] in (min(r[k] for r in bucket), max(r[k] for r in bucket)))
+
+    def testReadRange(self):
+        level = LevelBuilder(10, ["CH4"])
+        level.addRows([(float(t), [float(t % 7)]) for t in range(100)])
+        result = level.read(20, 39.5, ["EPOCH_TIME", "CH4"])
+        self.assertEqual(result["EPOCH_TIME"], [20.0, 29.0, 30.0, 39.0])
+        self.assertEqual(result["CH4"], [6.0, 0.0, 6.0, 0.0])
+        # The rows of the bucket still open are read too
+        self.assertEqual(level.read(90, 100, ["EPOCH_TIME", "CH4"])["EPOCH_TIME"], [90.0, 99.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
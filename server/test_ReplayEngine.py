@@ -0,0 +1,103 @@
+#!/usr/bin/python
+#
+# File Name: test_ReplayEngine.py
+# Purpose: Checks of the replay timeline of ReplayEngine.py.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of ReplayEngine.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from ReplayEngine import ReplayEngine, ReplaySession
+
+COLUMNS = ["EPOCH_TIME", "CH4"]
+
+
+def writeDataLog(name, times):
+    fp = open(name, "w")
+    fp.write("".join(col.ljust(26) for col in COLUMNS) + "\n")
+    for t in times:
+        fp.write(("%.3f" % t).ljust(26) + "2.000000".ljust(26) + "\n")
+    fp.close()
+
+
+class ReplayGapTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_replay_")
+        # Two recordings a day apart, sampled every 2 s
+        self.a = os.path.join(self.root, "a.dat")
+        self.b = os.path.join(self.root, "b.dat")
+        writeDataLog(self.a, [1000.0 + 2*i for i in range(50)])
+        writeDataLog(self.b, [1000.0 + 86400 + 2*i for i in range(30)])
+        self.engine = ReplayEngine([self.b, self.a], maxBatch=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def testFilesAreLaidEndToEnd(self):
+        engine = self.engine
+        self.assertEqual(engine.period, 80*2.0)
+        times = engine.read(1, 2*engine.totalRows + 1, COLUMNS)["EPOCH_TIME"]
+        self.assertEqual(times[0], 1000.0)
+        self.assertEqual([b - a for a, b in zip(times[:-1], times[1:])], [2.0]*(len(times) - 1))
+
+    def testRowAfterMatchesRead(self):
+        engine = self.engine
+        times = engine.read(1, 2*engine.totalRows + 1, COLUMNS)["EPOCH_TIME"]
+        for row, t in enumerate(times, 1):
+            self.assertEqual(engine.rowAfter(t, right=False), row)
+            self.assertEqual(engine.rowAfter(t), row + 1)
+
+    def testRealTimeReplayDoesNotStallInGap(self):
+        engine = self.engine
+        session = ReplaySession("s", 1.0, engine.first, 1, 0.0)
+        # 120 s of wall time covers the 50 rows of a.dat and the start of b.dat
+        nextRow, clock, data = engine.poll(session, 1, COLUMNS, now=120.0)
+        self.assertEqual(nextRow, 62)
+        self.assertEqual(data["EPOCH_TIME"][-1], 1120.0)
+
+
+class ReplaySessionsTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_replay_")
+        name = os.path.join(self.root, "a.dat")
+        writeDataLog(name, [1000.0 + i for i in range(10)])
+        self.engine = ReplayEngine([name], sessionTimeout=600.0, maxSessions=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def testUnknownSessionIsNotCreated(self):
+        engine = self.engine
+        self.assertEqual(engine.openSession("nosuchsession", None), None)
+        self.assertEqual(len(engine.sessions), 0)
+        session = engine.openSession(None, 2.0)
+        self.assertEqual(session.speed, 2.0)
+        self.assertTrue(engine.openSession(session.sessionId, None) is session)
+        self.assertEqual(len(engine.sessions), 1)
+
+    def testSessionsAreCapped(self):
+        engine = self.engine
+        first = engine.openSession(None, None)
+        others = [engine.openSession(None, None) for i in range(2)]
+        # Using the first session keeps it; the least recently used one is dropped
+        engine.openSession(first.sessionId, None)
+        engine.openSession(None, None)
+        self.assertEqual(len(engine.sessions), 3)
+        self.assertTrue(engine.openSession(first.sessionId, None) is first)
+        self.assertEqual(engine.openSession(others[0].sessionId, None), None)
+
+    def testIdleSessionsExpire(self):
+        engine = self.engine
+        session = engine.openSession(None, None)
+        session.lastUsed -= 601.0
+        self.assertEqual(engine.openSession(session.sessionId, None), None)
+        self.assertEqual(len(engine.sessions), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
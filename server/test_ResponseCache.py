@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# File Name: test_ResponseCache.py
+# Purpose: Checks of the generation-scoped LRU cache of series responses.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of ResponseCache.py."""
+from threading import Event, Thread
+import unittest
+
+from ResponseCache import ResponseCache
+
+GENERATION = ("a.dat", 11, 0)
+
+
+def body(size, tag="x"):
+    return (tag*size, None)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def testHitsAndMisses(self):
+        cache = ResponseCache(1000)
+        calls = []
+        compute = lambda: calls.append(1) or body(10)
+        self.assertEqual(cache.get(GENERATION, "k", compute), body(10))
+        self.assertEqual(cache.get(GENERATION, "k", compute), body(10))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        cache = ResponseCache(30)
+        for key in "abc":
+            cache.get(GENERATION, key, lambda: body(10, key))
+        cache.get(GENERATION, "a", lambda: self.fail("a is cached"))
+        cache.get(GENERATION, "d", lambda: body(10, "d"))
+        self.assertEqual(list(cache.entries), ["c", "a", "d"])
+        self.assertEqual((cache.size, cache.evictions), (30, 1))
+
+    def testMemoryCap(self):
+        cache = ResponseCache(100)
+        for i in range(50):
+            cache.get(GENERATION, i, lambda: body(7 + i % 5))
+            self.assertTrue(cache.size <= 100)
+            self.assertEqual(cache.size, sum(len(value[0]) for value in cache.entries.values()))
+        # A body larger than the whole cache is served but not kept
+        self.assertEqual(cache.get(GENERATION, "big", lambda: body(101)), body(101))
+        self.assertFalse("big" in cache.entries)
+
+    def testNewGenerationDropsEntries(self):
+        cache = ResponseCache(1000)
+        cache.get(GENERATION, "k", lambda: body(10, "o"))
+        # The ingest thread appended rows: the next sequence number changed
+        grown = ("a.dat", 12, 0)
+        self.assertEqual(cache.get(grown, "k", lambda: body(10, "n")), body(10, "n"))
+        self.assertEqual((len(cache.entries), cache.size), (1, 10))
+        # So did a change of the alarm register
+        self.assertEqual(cache.get(("a.dat", 12, 1), "k", lambda: body(10, "a")), body(10, "a"))
+
+    def testResultOfOldGenerationIsNotKept(self):
+        cache = ResponseCache(1000)
+        def compute():
+            # Another request moves the cache to a newer generation meanwhile
+            cache.get(("a.dat", 12, 0), "other", lambda: body(5))
+            return body(10)
+        cache.get(GENERATION, "k", compute)
+        self.assertEqual(list(cache.entries), ["other"])
+
+    def testDisabled(self):
+        cache = ResponseCache(0)
+        calls = []
+        for i in range(3):
+            cache.get(GENERATION, "k", lambda: calls.append(1) or body(1))
+        self.assertEqual((len(calls), len(cache.entries)), (3, 0))
+
+    def testConcurrentMissesComputeOnce(self):
+        cache = ResponseCache(1000)
+        started = Event()
+        release = Event()
+        calls = []
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return body(10)
+        results = []
+        threads = [Thread(target=lambda: results.append(cache.get(GENERATION, "k", compute))) for i in range(4)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual((len(calls), results), (1, [body(10)]*4))
+        self.assertEqual(cache.pending, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
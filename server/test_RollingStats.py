@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# File Name: test_RollingStats.py
+# Purpose: Checks the sliding window statistics of RollingStats.py against a brute-force recomputation.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of RollingStats.py."""
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from RollingStats import RollingStats, SnapshotFile, _compact
+
+WINDOWS = (3, 10, 30)
+BUCKET = 2.0
+
+
+def bruteForce(samples, seconds, now):
+    """[n, mean, std, min, max, baseline] of the (t, x) samples over the window
+    of seconds ending at now, recomputed from scratch"""
+    cutoff = now - seconds
+    window = [x for t, x in samples if t > cutoff]
+    buckets = []
+    for t, x in samples:
+        end = (math.floor(t / BUCKET) + 1) * BUCKET
+        if buckets and buckets[-1][0] == end:
+            buckets[-1][1].append(x)
+        else:
+            buckets.append((end, [x]))
+    # The bucket of the newest sample has not ended yet
+    means = [sum(values) / len(values) for end, values in buckets[:-1] if end > cutoff]
+    baseline = min(means) if means else None
+    if not window:
+        return [0, None, None, None, None, None]
+    n = len(window)
+    mean = sum(window) / n
+    std = math.sqrt(sum((x - mean)**2 for x in window) / (n - 1)) if n > 1 else 0.0
+    return [n, mean, std, min(window), max(window), baseline]
+
+
+class RollingStatsTest(unittest.TestCase):
+    def assertWindow(self, values, expected, scale, context):
+        n, mean, std, low, high, baseline = expected
+        self.assertEqual(values[0], n, context)
+        if n == 0:
+            self.assertEqual(values, [0, None, None, None, None, None])
+            return
+        self.assertAlmostEqual(values[1], mean, delta=1e-6*scale, msg=context)
+        self.assertAlmostEqual(values[2], std, delta=1e-6*scale, msg=context)
+        self.assertEqual(values[3:5], [_compact(low), _compact(high)], context)
+        self.assertEqual(values[5], _compact(baseline), context)
+
+    def testMatchesBruteForce(self):
+        rng = random.Random(23)
+        for trial in range(20):
+            stats = RollingStats(["CH4", "CO2"], windows=WINDOWS, bucket=BUCKET)
+            fed = {"CH4": [], "CO2": []}
+            t = rng.uniform(1e9, 2e9)
+            level = rng.uniform(-100.0, 100.0)
+            for block in range(30):
+                nRows = rng.randint(1, 40)
+                times, ch4, co2 = [], [], []
+                for i in range(nRows):
+                    t += rng.choice((0.1, 0.5, 1.0, 1.0, 2.0, rng.uniform(0.0, 12.0)))
+                    times.append(t)
+                    ch4.append(float("nan") if rng.random() < 0.1 else level + rng.gauss(0.0, 1.0))
+                    co2.append(float("nan") if rng.random() < 0.5 else rng.uniform(400.0, 401.0))
+                stats.addColumns({"EPOCH_TIME": times, "CH4": ch4, "CO2": co2, "OTHER": co2}, nRows)
+                for col, values in (("CH4", ch4), ("CO2", co2)):
+                    fed[col].extend((s, x) for s, x in zip(times, values) if x == x)
+                snapshot = stats.snapshot()
+                self.assertEqual(snapshot["time"], t)
+                for col in ("CH4", "CO2"):
+                    scale = max([abs(x) for s, x in fed[col]] + [1.0])
+                    for seconds, values in zip(WINDOWS, snapshot[col]):
+                        self.assertWindow(values, bruteForce(fed[col], seconds, t), scale,
+                                          (trial, block, col, seconds))
+
+    def testGapEmptiesWindows(self):
+        stats = RollingStats(["CH4"], windows=WINDOWS, bucket=BUCKET)
+        stats.addColumns({"EPOCH_TIME": [100.0, 101.0, 102.0, 103.0], "CH4": [1.0, 2.0, 3.0, 4.0]}, 4)
+        self.assertEqual(stats.snapshot()["CH4"][2][:5], [4, 2.5, _compact(math.sqrt(5.0/3)), 1.0, 4.0])
+        stats.addColumns({"EPOCH_TIME": [1000.0], "CH4": [float("nan")]}, 1)
+        self.assertEqual(stats.snapshot()["CH4"], [[0, None, None, None, None, None]]*len(WINDOWS))
+
+
+class SnapshotFileTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_stats_")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def testWriteRead(self):
+        name = os.path.join(self.root, "stats.json")
+        writer = SnapshotFile(name)
+        reader = SnapshotFile(name)
+        self.assertEqual(reader.read(), None)
+        stats = RollingStats(["CH4"], windows=WINDOWS, bucket=BUCKET)
+        stats.addColumns({"EPOCH_TIME": [100.0, 101.0], "CH4": [1.0, 2.0]}, 2)
+        writer.write(stats.snapshot())
+        self.assertEqual(reader.read(), stats.snapshot())
+
+
+if __name__ == '__main__':
+    unittest.main()
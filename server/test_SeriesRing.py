@@ -0,0 +1,146 @@
+#!/usr/bin/python
+#
+# File Name: test_SeriesRing.py
+# Purpose: Checks of the in-process and the memory-mapped series ring buffers.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of SeriesRing.py."""
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from SeriesRing import GENERATION_OFFSET, SeriesRing, SharedSeriesRing
+
+COLUMNS = ("EPOCH_TIME", "CH4")
+
+
+def rows(lo, hi):
+    return {"EPOCH_TIME": [float(i) for i in range(lo, hi)], "CH4": [i/10.0 for i in range(lo, hi)]}
+
+
+class RingTests(object):
+    """Behaviour common to both rings; makeRing(capacity) returns the ring"""
+    def testWrapAround(self):
+        ring = self.makeRing(8)
+        ring.appendColumns(rows(1, 6), 5)
+        ring.appendColumns(rows(6, 12), 6)
+        self.assertEqual(ring.nextSeq, 12)
+        self.assertEqual(ring.firstSeq(), 4)
+        nextSeq, data = ring.since(7)
+        self.assertEqual((nextSeq, data), (12, rows(7, 12)))
+        # A cursor older than the buffer, or from the future, starts from the oldest sample
+        self.assertEqual(ring.since(1)[1], rows(4, 12))
+        self.assertEqual(ring.since(50)[1], rows(4, 12))
+        self.assertEqual(ring.since(12, ["CH4"]), (12, {"CH4": []}))
+
+    def testBlockLargerThanCapacity(self):
+        ring = self.makeRing(4)
+        ring.appendColumns(rows(1, 11), 10)
+        self.assertEqual(ring.since(1), (11, rows(7, 11)))
+
+    def testStatus(self):
+        ring = self.makeRing(4)
+        ring.setStatus(5, "a.dat", 3)
+        self.assertEqual(ring.status(), (5, "a.dat"))
+        self.assertEqual(ring.fileStart, 3)
+        ring.setStatus(0, "b.dat")
+        self.assertEqual((ring.status(), ring.fileStart), ((0, "b.dat"), 3))
+
+
+class SeriesRingTest(RingTests, unittest.TestCase):
+    def makeRing(self, capacity):
+        return SeriesRing(COLUMNS, capacity)
+
+    def testWaitFor(self):
+        ring = self.makeRing(4)
+        self.assertFalse(ring.waitFor(1, time.time() - 1))
+        ring.appendColumns(rows(1, 2), 1)
+        self.assertTrue(ring.waitFor(1, time.time() + 10))
+
+
+class SharedSeriesRingTest(RingTests, unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_ring_")
+        self.name = os.path.join(self.root, "ring.bin")
+        self.rings = []
+
+    def tearDown(self):
+        for ring in self.rings:
+            ring.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def makeRing(self, capacity, create=True, readTimeout=1.0):
+        ring = SharedSeriesRing(self.name, COLUMNS, capacity, create=create, readTimeout=readTimeout)
+        self.rings.append(ring)
+        return ring
+
+    def generation(self, ring):
+        return struct.unpack_from("<Q", ring.mm, GENERATION_OFFSET)[0]
+
+    def testReaderSeesWriter(self):
+        owner = self.makeRing(8)
+        reader = self.makeRing(8, create=False)
+        owner.appendColumns(rows(1, 4), 3)
+        owner.setStatus(1, "a.dat", 1)
+        self.assertEqual(reader.since(1), (4, rows(1, 4)))
+        self.assertEqual(reader.status(), (1, "a.dat"))
+        self.assertTrue(reader.waitFor(1, time.time() + 1))
+
+    def testReusedAfterRestart(self):
+        owner = self.makeRing(8)
+        owner.appendColumns(rows(1, 6), 5)
+        owner.setStatus(0, "a.dat", 2)
+        owner.close()
+        self.rings.remove(owner)
+        owner = self.makeRing(8)
+        self.assertEqual((owner.nextSeq, owner.fileStart, owner.status()), (6, 2, (0, "a.dat")))
+        owner.appendColumns(rows(6, 8), 2)
+        self.assertEqual(owner.since(1), (8, rows(1, 8)))
+
+    def testOtherLayoutIsReplaced(self):
+        self.makeRing(8).appendColumns(rows(1, 4), 3)
+        self.assertRaises(ValueError, SharedSeriesRing, self.name, COLUMNS, 16)
+        self.assertEqual(self.makeRing(16).nextSeq, 1)
+
+    def testReopenAfterInterruptedWrite(self):
+        owner = self.makeRing(8)
+        owner.appendColumns(rows(1, 4), 3)
+        # The owner is killed between _beginWrite and _endWrite
+        owner._beginWrite()
+        self.assertEqual(self.generation(owner) % 2, 1)
+        owner.close()
+        self.rings.remove(owner)
+        owner = self.makeRing(8)
+        self.assertEqual(self.generation(owner) % 2, 0)
+        reader = self.makeRing(8, create=False, readTimeout=0.2)
+        owner.appendColumns(rows(4, 6), 2)
+        self.assertEqual(self.generation(owner) % 2, 0)
+        self.assertEqual(reader.since(1), (6, rows(1, 6)))
+        self.assertEqual(reader.status()[0], 0)
+
+    def testGenerationIsOddDuringWrite(self):
+        owner = self.makeRing(8)
+        struct.pack_into("<Q", owner.mm, GENERATION_OFFSET, 5)
+        generation = owner._beginWrite()
+        self.assertEqual((self.generation(owner), generation), (5, 6))
+        owner._endWrite(generation)
+        generation = owner._beginWrite()
+        self.assertEqual((self.generation(owner), generation), (7, 8))
+
+    def testReadersGiveUpOnStuckWriter(self):
+        owner = self.makeRing(8)
+        reader = self.makeRing(8, create=False, readTimeout=0.1)
+        owner._beginWrite()
+        started = time.time()
+        self.assertRaises(IOError, reader.since, 1)
+        self.assertRaises(IOError, reader.status)
+        self.assertTrue(time.time() - started < 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# File Name: test_backpackApi.py
+# Purpose: Checks of the HTTP API served by the WSGI worker processes.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of backpackApi.py."""
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import backpackApi
+from backpackServer0 import BackpackServer, RING_COLUMNS
+
+
+class WorkerTest(unittest.TestCase):
+    """An ingest server writing the shared ring and a worker serving it"""
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_api_")
+        os.mkdir(os.path.join(self.root, "UserLog"))
+        self.configFile = os.path.join(self.root, "backpackServer.ini")
+        self.writeConfig(18.9)
+        # The ingest process creates the shared ring the worker reads
+        self.ingest = BackpackServer(self.configFile, False, "ingest")
+        self.ingest.loadConfig()
+        self.worker = BackpackServer(self.configFile, False, "worker")
+        self.worker.loadConfig()
+        self.client = backpackApi.createApp(self.worker).test_client()
+
+    def tearDown(self):
+        self.worker.series.close()
+        self.ingest.series.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def writeConfig(self, threshold):
+        fp = open(self.configFile, "w")
+        fp.write("[Setup]\nUserLog_Files = %s\nShared_Ring = %s\nConfig_Check_Interval = 0\n" %
+                 (os.path.join(self.root, "UserLog"), os.path.join(self.root, "ring.bin")))
+        fp.write("[BatteryMonitor]\nVoltage_Threshold = %s\n" % threshold)
+        fp.close()
+
+
+class WorkerConfigReloadTest(WorkerTest):
+    def testWorkerReloadsOnRequest(self):
+        self.assertEqual(self.client.get("/api/v1.0/stats").status_code, 200)
+        self.assertEqual(self.worker.battery_monitor.voltageThreshold, 18.9)
+        self.writeConfig(17.5)
+        later = time.time() + 10
+        os.utime(self.configFile, (later, later))
+        self.assertEqual(self.client.get("/api/v1.0/stats").status_code, 200)
+        self.assertEqual(self.worker.battery_monitor.voltageThreshold, 17.5)
+
+
+class SeriesNotModifiedTest(WorkerTest):
+    def append(self, lo, hi):
+        data = dict((col, [float(i) for i in range(lo, hi)]) for col in RING_COLUMNS)
+        self.ingest.series.appendColumns(data, hi - lo)
+        self.ingest.series.setStatus(0, "a.dat", 1)
+
+    def series(self, startRow, etag=None):
+        headers = {"If-None-Match": '"%s"' % etag} if etag else {}
+        return self.client.get("/api/v1.0/series?startRow=%d" % startRow, headers=headers)
+
+    def testNotModifiedUntilRowsArrive(self):
+        self.append(1, 4)
+        response = self.series(1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["next_row"], 4)
+        etag = response.get_etag()[0]
+        # The client has every row and its answer is still current
+        response = self.series(4, etag)
+        self.assertEqual((response.status_code, response.data), (304, ""))
+        self.assertEqual(response.get_etag()[0], etag)
+        # A client which is behind gets the rows whatever its ETag
+        self.assertEqual(self.series(1, etag).status_code, 200)
+        self.append(4, 5)
+        response = self.series(4, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(json.loads(response.data)["data"]["EPOCH_TIME"], [4.0])
+
+    def testAnswersAreShared(self):
+        self.append(1, 4)
+        first = self.series(1)
+        second = self.series(1)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual((self.worker.response_cache.hits, self.worker.response_cache.misses), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+#
+# File Name: test_backpackServer0.py
+# Purpose: Checks of the simulation mode of BackpackServer.
+# Notes:
+#               Run with "python -m unittest discover -s server" (or pytest) from the repository root.
+#
+
+"""Tests of backpackServer0.py."""
+import os
+import shutil
+import tempfile
+import unittest
+
+import backpackServer0
+from backpackServer0 import BackpackServer
+from ConfigSnapshot import asExpression
+
+SIMULATION = """[Simulation]
+Max_Index = 30
+CH4 = sin(x/30.0*2*pi)
+H2O = cos(x/30.0*2*pi)
+CO2 = x/30.0
+BatteryVoltage = 20 if x<15 else 15
+"""
+
+
+class SimulationTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="backpack_server_")
+        os.mkdir(os.path.join(self.root, "UserLog"))
+        self.configFile = os.path.join(self.root, "backpackServer.ini")
+        self.writeConfig(SIMULATION)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def writeConfig(self, simulation):
+        fp = open(self.configFile, "w")
+        fp.write("[Setup]\nUserLog_Files = %s\n" % os.path.join(self.root, "UserLog"))
+        fp.write("[BatteryMonitor]\nPoints_Trigger_Alarm = 3\nPoints_Cancel_Alarm = 2\nVoltage_Threshold = 18.9\n")
+        fp.write(simulation)
+        fp.close()
+
+    def makeServer(self):
+        server = BackpackServer(self.configFile, True)
+        server.loadConfig()
+        return server
+
+
+class SimulationBatchTest(SimulationTest):
+    def assertBatchMatches(self, server, code, xs):
+        try:
+            expected = [float(server.run_simulation_expression(code, x)) for x in xs]
+        except Exception, e:
+            self.assertRaises(type(e), server.run_simulation_batch, code, xs)
+            return
+        self.assertEqual(list(server.run_simulation_batch(code, xs)), expected)
+
+    def testConfiguredExpressions(self):
+        server = self.makeServer()
+        xs = range(-5, 40)
+        for code in server.simulation_dict.values():
+            self.assertBatchMatches(server, code, xs)
+        data = server.simulateRows(xs)
+        self.assertEqual(sorted(data), ["Battery_Voltage", "CH4", "CO2", "H2O"])
+        self.assertEqual(list(data["Battery_Voltage"]), [20.0 if x < 15 else 15.0 for x in xs])
+
+    def testVectorAndScalarAgree(self):
+        server = self.makeServer()
+        xs = range(-20, 20)
+        for text in ["1/(x-15)", "sqrt(x)", "log(x, 10)", "atan2(x, 3)", "asin(x/100.0)", "7", "x/4",
+                     "max(x, 3)", "exp(x*50)", "pow(x, 2) + abs(x)", "round(x/3.0)", "floor(x/3.0)"]:
+            code = asExpression(text, "test")
+            server.simulation_env = backpackServer0.simulationEnv([code])
+            if backpackServer0.numpy is not None:
+                server.simulation_vector_env = backpackServer0.simulationVectorEnv(server.simulation_env)
+            self.assertBatchMatches(server, code, xs)
+
+    def testWithoutNumpy(self):
+        numpy = backpackServer0.numpy
+        backpackServer0.numpy = None
+        try:
+            server = self.makeServer()
+            self.assertEqual(server.run_simulation_batch(server.simulation_dict["CO2"], [3, 6]), [0.1, 0.2])
+        finally:
+            backpackServer0.numpy = numpy
+
+
+class SharedStateFedOnceTest(SimulationTest):
+    """Rows polled by several clients, or more than once, feed the shared
+    statistics once"""
+    def testCalculatedRows(self):
+        server = self.makeServer()
+        for startRow in (1, 1, 1):
+            self.assertEqual(server.simulate_data(startRow)["next_row"], 2)
+        self.assertEqual(server.rolling_stats.rows, 1)
+        server.simulate_data(2)
+        server.simulate_data(2)
+        self.assertEqual(server.rolling_stats.rows, 2)
+        # A client out of step with the rows being fed does not feed
+        server.simulate_data(20)
+        self.assertEqual(server.rolling_stats.rows, 2)
+        server.simulate_data(3)
+        self.assertEqual(server.rolling_stats.rows, 3)
+
+    def testCalculatedRowsResync(self):
+        server = self.makeServer()
+        server.simulate_data(1)
+        server.simulation_fed_time -= backpackServer0.SIMULATION_RESYNC + 1
+        server.simulate_data(20)
+        self.assertEqual(server.rolling_stats.rows, 2)
+        server.simulate_data(21)
+        self.assertEqual(server.rolling_stats.rows, 3)
+
+    def testReplayedRows(self):
+        name = os.path.join(self.root, "replay.dat")
+        fp = open(name, "w")
+        columns = backpackServer0.RING_COLUMNS
+        fp.write("".join(col.ljust(26) for col in columns) + "\n")
+        for i in range(40):
+            values = [1466117932.0 + i, 2.0 + i/100.0, 400.0, 1.0, 20.0]
+            fp.write("".join(("%.6f" % v).ljust(26) for v in values) + "\n")
+        fp.close()
+        self.writeConfig("[Simulation]\nReplay_Data = %s\nReplay_Max_Batch = 10\n" % name)
+        server = self.makeServer()
+        server.replay.defaultSession.speed = 0
+        self.assertEqual(server.simulate_data(1)["next_row"], 11)
+        server.simulate_data(1)
+        self.assertEqual(server.rolling_stats.rows, 10)
+        self.assertEqual(server.simulate_data(5)["next_row"], 15)
+        self.assertEqual(server.rolling_stats.rows, 14)
+        self.assertEqual(server.rolling_stats.snapshot()["CH4"][0][0], 14)
+
+
+class AlarmsEvaluatedOnceTest(SimulationTest):
+    """Polling the same rows again neither advances the shared alarm channels
+    nor logs their transitions again"""
+    def testCalculatedRows(self):
+        # The battery alarm triggers after 3 samples below 18.9 V, i.e. x >= 15
+        server = self.makeServer()
+        for startRow in range(15, 17) + [17]*5:
+            server.simulate_data(startRow)
+        self.assertEqual(server.alarmStatus.register, 0)
+        events = server.alarm_log.stats()["events"]
+        server.simulate_data(18)
+        server.simulate_data(18)
+        self.assertEqual(server.alarmStatus.register, 1)
+        self.assertEqual(server.alarm_log.stats()["events"], events + 1)
+
+    def testReplayedRows(self):
+        name = os.path.join(self.root, "replay.dat")
+        fp = open(name, "w")
+        columns = backpackServer0.RING_COLUMNS
+        fp.write("".join(col.ljust(26) for col in columns) + "\n")
+        for i in range(40):
+            values = [1466117932.0 + i, 2.0, 400.0, 1.0, 15.0 if 10 <= i < 30 else 20.0]
+            fp.write("".join(("%.6f" % v).ljust(26) for v in values) + "\n")
+        fp.close()
+        self.writeConfig("[Simulation]\nReplay_Data = %s\nReplay_Max_Batch = 12\n" % name)
+        server = self.makeServer()
+        server.replay.defaultSession.speed = 0
+        for i in range(3):
+            server.simulate_data(1)
+        # Rows 11 and 12 are low: two of the three samples needed
+        self.assertEqual(server.alarmStatus.register, 0)
+        events = server.alarm_log.stats()["events"]
+        server.simulate_data(13)
+        self.assertEqual(server.alarmStatus.register, 1)
+        # Replaying rows 1 to 12 again would cancel the alarm
+        server.simulate_data(1)
+        self.assertEqual(server.alarmStatus.register, 1)
+        server.simulate_data(13)
+        self.assertEqual(server.alarm_log.stats()["events"], events + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()